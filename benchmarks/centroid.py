@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmark centroid calculation on random locations around a point.
+
+Usage::
+
+    python benchmarks/centroid.py [--count N]
+
+"""
+
+import argparse
+import random
+import time
+
+from operator import itemgetter
+
+from pic2map.util import (
+    average,
+    centroid,
+)
+
+
+def average_centroid(coordinates):
+    """Calculate centroid averaging latitudes and longitudes.
+
+    :param coordinates: Latitude and longitude pairs in degrees
+    :type coordinates: list(tuple(float, float))
+    :returns: Average latitude and longitude
+    :rtype: tuple(float, float)
+
+    """
+    return (
+        average(coordinates, itemgetter(0)),
+        average(coordinates, itemgetter(1)),
+    )
+
+
+def main():
+    """Run benchmark and print results."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=1000000)
+    args = parser.parse_args()
+
+    # Locations spread over a few hundred kilometers, so that the
+    # centroid is well defined
+    random.seed(0)
+    coordinates = [
+        (random.gauss(40.4, 2.0), random.gauss(-3.7, 2.0))
+        for _index in xrange(args.count)
+    ]
+
+    for name, function in [
+            ('average', average_centroid),
+            ('centroid', centroid),
+            ('centroid (iterator)', lambda values: centroid(iter(values))),
+    ]:
+        start = time.time()
+        result = function(coordinates)
+        elapsed = time.time() - start
+        print '{}: {} in {:.3f}s ({:.0f} locations/s)'.format(
+            name, result, elapsed, args.count / elapsed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmark the native GPS reader against exiftool.
+
+Usage::
+
+    python benchmarks/exif_reader.py [--count N] [--jobs N]
+
+"""
+
+import argparse
+import os
+import shutil
+import struct
+import tempfile
+import time
+
+from distutils.spawn import find_executable
+
+from PIL import Image
+
+from pic2map.exif import read_gps_tags
+from pic2map.gps import filter_gps_metadata
+
+
+def build_gps_exif(latitude=(40, 26, 46), latitude_ref='N',
+                   longitude=(79, 58, 56), longitude_ref='W'):
+    """Build little endian EXIF segment data with GPS tags.
+
+    :param latitude: Latitude degrees, minutes and seconds
+    :type latitude: tuple(int, int, int)
+    :param latitude_ref: Latitude reference (``N`` or ``S``)
+    :type latitude_ref: str
+    :param longitude: Longitude degrees, minutes and seconds
+    :type longitude: tuple(int, int, int)
+    :param longitude_ref: Longitude reference (``E`` or ``W``)
+    :type longitude_ref: str
+    :returns: EXIF segment data
+    :rtype: str
+
+    """
+    def rational(*values):
+        """Pack degrees, minutes and seconds as rationals."""
+        return ''.join(struct.pack('<II', value, 1) for value in values)
+
+    gps_entries = [
+        (0x0001, 2, 2, latitude_ref + '\x00'),
+        (0x0002, 5, 3, rational(*latitude)),
+        (0x0003, 2, 2, longitude_ref + '\x00'),
+        (0x0004, 5, 3, rational(*longitude)),
+        (0x0007, 5, 3, rational(12, 34, 56)),
+        (0x001d, 2, 11, '2015:01:01\x00'),
+    ]
+    gps_ifd_offset = 8 + 2 + 12 + 4
+    data_offset = gps_ifd_offset + 2 + 12 * len(gps_entries) + 4
+
+    entries = ''
+    data = ''
+    for tag_id, field_type, count, value in gps_entries:
+        entries += struct.pack('<HHI', tag_id, field_type, count)
+        if len(value) <= 4:
+            entries += value.ljust(4, '\x00')
+        else:
+            entries += struct.pack('<I', data_offset + len(data))
+            data += value
+
+    return (
+        'Exif\x00\x00II' +
+        struct.pack('<HI', 42, 8) +
+        struct.pack('<HHHIII', 1, 0x8825, 4, 1, gps_ifd_offset, 0) +
+        struct.pack('<H', len(gps_entries)) + entries + struct.pack('<I', 0) +
+        data
+    )
+
+
+def create_pictures(directory, count):
+    """Create picture files with GPS metadata.
+
+    :param directory: Directory where pictures are created
+    :type directory: str
+    :param count: Number of pictures to create
+    :type count: int
+    :returns: Paths to the pictures
+    :rtype: list(unicode)
+
+    """
+    template = os.path.join(directory, u'template.jpg')
+    Image.new('RGB', (640, 480)).save(template, 'JPEG', exif=build_gps_exif())
+
+    paths = []
+    for index in range(count):
+        path = os.path.join(directory, u'{}.jpg'.format(index))
+        shutil.copyfile(template, path)
+        paths.append(path)
+    return paths
+
+
+def measure(function, *args, **kwargs):
+    """Measure how much time a function call takes.
+
+    :returns: Elapsed time in seconds
+    :rtype: float
+
+    """
+    start = time.time()
+    function(*args, **kwargs)
+    return time.time() - start
+
+
+def main():
+    """Run benchmark and print results."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=1000)
+    parser.add_argument('--jobs', type=int, default=1)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        paths = create_pictures(directory, args.count)
+
+        elapsed = measure(lambda: [read_gps_tags(path) for path in paths])
+        print 'native reader: {:.3f}s ({:.0f} files/s)'.format(
+            elapsed, args.count / elapsed)
+
+        elapsed = measure(filter_gps_metadata, paths, args.jobs)
+        print 'filter_gps_metadata: {:.3f}s ({:.0f} files/s)'.format(
+            elapsed, args.count / elapsed)
+
+        if find_executable('exiftool'):
+            elapsed = measure(
+                filter_gps_metadata, paths, args.jobs, native=False)
+            print 'filter_gps_metadata (exiftool only): {:.3f}s ' \
+                '({:.0f} files/s)'.format(elapsed, args.count / elapsed)
+        else:
+            print 'exiftool not found, skipping exiftool benchmark'
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmark JPEG file detection methods on a mixed media tree.
+
+Usage::
+
+    python benchmarks/file_detection.py [--count N]
+
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from PIL import Image
+
+from pic2map.fs import (
+    DETECTORS,
+    TreeExplorer,
+)
+
+# Extension and first bytes of the files that aren't JPEG pictures
+OTHER_FILES = [
+    ('.mp4', '\x00\x00\x00\x18ftypmp42'),
+    ('.mov', '\x00\x00\x00\x14ftypqt  '),
+    ('.cr2', 'II*\x00\x10\x00\x00\x00CR'),
+    ('.nef', 'MM\x00*\x00\x00\x00\x08'),
+    ('.xmp', '<x:xmpmeta xmlns:x="adobe:ns:meta/">'),
+    ('.dat', 'some unknown data'),
+]
+
+
+def create_tree(directory, count):
+    """Create a tree with pictures, videos, raw pictures and sidecar files.
+
+    :param directory: Directory under which the tree is created
+    :type directory: str
+    :param count: Number of files of each type to create
+    :type count: int
+
+    """
+    template = os.path.join(directory, 'template.jpg')
+    Image.new('RGB', (640, 480)).save(template, 'JPEG')
+
+    for index in range(count):
+        subdirectory = os.path.join(directory, str(index % 100))
+        if not os.path.isdir(subdirectory):
+            os.mkdir(subdirectory)
+
+        shutil.copyfile(
+            template, os.path.join(subdirectory, '{}.jpg'.format(index)))
+        for extension, header in OTHER_FILES:
+            filename = os.path.join(
+                subdirectory, '{}{}'.format(index, extension))
+            with open(filename, 'wb') as file_:
+                file_.write(header + '\x00' * 4096)
+
+    os.remove(template)
+
+
+def main():
+    """Run benchmark and print results."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=1000)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        create_tree(directory, args.count)
+        file_count = args.count * (len(OTHER_FILES) + 1)
+        for detection in sorted(DETECTORS):
+            start = time.time()
+            paths = TreeExplorer(directory, detection).paths()
+            elapsed = time.time() - start
+            print '{}: {} pictures in {:.3f}s ({:.0f} files/s)'.format(
+                detection, len(paths), elapsed, file_count / elapsed)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,323 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmark every stage of the indexing pipeline on a synthetic tree.
+
+Results are written as JSON, so that they can be compared across versions
+to catch regressions::
+
+    python benchmarks/pipeline.py [--count N] --output before.json
+    python benchmarks/pipeline.py [--count N] --compare before.json
+
+When comparing, the exit status is 1 if any stage is slower than the
+baseline by more than the threshold.
+
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+from PIL import Image
+from xdg import BaseDirectory
+
+from exif_reader import build_gps_exif
+
+import pic2map
+
+from pic2map.db import (
+    LocationDB,
+    transform_metadata_to_row,
+)
+from pic2map.fs import TreeExplorer
+from pic2map.gps import filter_gps_metadata
+from pic2map.server.app import (
+    app,
+    response_cache,
+)
+
+# Version of the results format
+RESULTS_VERSION = 1
+
+# Cities around which pictures are located
+CITIES = [
+    (40.4, -3.7),
+    (48.9, 2.4),
+    (40.7, -74.0),
+    (35.7, 139.7),
+    (-33.9, 151.2),
+]
+
+# Relative slowdown over the baseline considered a regression
+DEFAULT_THRESHOLD = 0.25
+
+
+def to_dms(value):
+    """Convert decimal degrees to degrees, minutes and seconds.
+
+    :param value: Decimal degrees
+    :type value: float
+    :returns: Reference sign, degrees, minutes and seconds
+    :rtype: tuple(bool, tuple(int, int, int))
+
+    """
+    seconds = int(round(abs(value) * 3600))
+    return value >= 0, (seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+def jpeg_with_exif(template, exif):
+    """Insert EXIF segment in JPEG data.
+
+    The segment is inserted after the JFIF segment, if any, as Pillow does.
+
+    :param template: JPEG data without EXIF segment
+    :type template: str
+    :param exif: EXIF segment data
+    :type exif: str
+    :returns: JPEG data with EXIF segment
+    :rtype: str
+
+    """
+    offset = 2
+    if template[2:4] == '\xff\xe0':
+        offset += 2 + struct.unpack('>H', template[4:6])[0]
+    segment = '\xff\xe1' + struct.pack('>H', len(exif) + 2) + exif
+    return template[:offset] + segment + template[offset:]
+
+
+def create_tree(directory, count, gps_ratio):
+    """Create a tree with pictures with and without GPS metadata.
+
+    Pictures with GPS metadata are spread around a few cities.
+
+    :param directory: Directory under which the tree is created
+    :type directory: str
+    :param count: Number of pictures to create
+    :type count: int
+    :param gps_ratio: Fraction of pictures with GPS metadata
+    :type gps_ratio: float
+
+    """
+    data = io.BytesIO()
+    Image.new('RGB', (640, 480)).save(data, 'JPEG')
+    template = data.getvalue()
+
+    random.seed(0)
+    for index in range(count):
+        subdirectory = os.path.join(directory, str(index % 100))
+        if not os.path.isdir(subdirectory):
+            os.mkdir(subdirectory)
+
+        picture = template
+        if random.random() < gps_ratio:
+            latitude, longitude = random.choice(CITIES)
+            north, latitude_dms = to_dms(random.gauss(latitude, 0.5))
+            east, longitude_dms = to_dms(random.gauss(longitude, 0.5))
+            picture = jpeg_with_exif(template, build_gps_exif(
+                latitude_dms, 'N' if north else 'S',
+                longitude_dms, 'E' if east else 'W'))
+
+        path = os.path.join(subdirectory, '{}.jpg'.format(index))
+        with open(path, 'wb') as file_:
+            file_.write(picture)
+
+
+def measure(function, *args, **kwargs):
+    """Measure how much time a function call takes.
+
+    :returns: Result of the call and elapsed time in seconds
+    :rtype: tuple(object, float)
+
+    """
+    start = time.time()
+    result = function(*args, **kwargs)
+    return result, time.time() - start
+
+
+def run_stages(directory, data_directory, jobs):
+    """Run every stage once.
+
+    :param directory: Directory with the pictures
+    :type directory: str
+    :param data_directory: Directory where the location database is created
+    :type data_directory: str
+    :param jobs: Number of exiftool processes to use
+    :type jobs: int
+    :returns: Elapsed time and number of items processed by each stage
+    :rtype: dict(str, tuple(float, int))
+
+    """
+    timings = {}
+
+    paths, timings['tree_explorer'] = measure(
+        TreeExplorer(directory).paths)
+    items = {'tree_explorer': len(paths)}
+
+    metadata_records, timings['filter_gps_metadata'] = measure(
+        filter_gps_metadata, paths, jobs)
+    items['filter_gps_metadata'] = len(paths)
+
+    rows, timings['transform_metadata_to_row'] = measure(
+        lambda: [
+            transform_metadata_to_row(metadata_record)
+            for metadata_record in metadata_records
+        ])
+    items['transform_metadata_to_row'] = len(rows)
+
+    # Make the database and the server use a new data directory
+    BaseDirectory.xdg_data_home = data_directory
+    with LocationDB() as database:
+        _, timings['insert'] = measure(database.insert, rows)
+        _, timings['upsert'] = measure(database.upsert, rows)
+        _, timings['select_all'] = measure(
+            lambda: database.select_all().fetchall())
+        _, timings['select_columns'] = measure(database.select_columns)
+    for stage in ['insert', 'upsert', 'select_all', 'select_columns']:
+        items[stage] = len(rows)
+
+    client = app.test_client()
+    for stage, url in [
+            ('index', '/'),
+            ('locations', '/api/locations?bbox=-180,-90,180,90&zoom=3'),
+            ('locations_binary', '/api/locations.bin'),
+    ]:
+        response_cache.clear()
+        response, timings[stage] = measure(client.get, url)
+        if response.status_code != 200:
+            raise RuntimeError(
+                '{} returned {}'.format(url, response.status_code))
+        items[stage] = len(rows)
+
+    return dict(
+        (stage, (elapsed, items[stage]))
+        for stage, elapsed in timings.iteritems()
+    )
+
+
+def git_revision():
+    """Get git revision of the working tree.
+
+    :returns: Revision or None if it's not a git working tree
+    :rtype: str | None
+
+    """
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(
+                ['git', 'rev-parse', '--short', 'HEAD'],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                stderr=devnull,
+            ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    """Compare results with a baseline.
+
+    :param results: Benchmark results
+    :type results: dict(str)
+    :param baseline: Baseline benchmark results
+    :type baseline: dict(str)
+    :param threshold: Relative slowdown considered a regression
+    :type threshold: float
+    :returns: Stages slower than the baseline by more than the threshold
+    :rtype: list(str)
+
+    """
+    regressions = []
+    for stage, result in sorted(results['stages'].iteritems()):
+        baseline_result = baseline['stages'].get(stage)
+        if baseline_result is None:
+            print '{}: not in baseline'.format(stage)
+            continue
+
+        ratio = result['seconds'] / baseline_result['seconds']
+        regression = ratio > 1 + threshold
+        if regression:
+            regressions.append(stage)
+        print '{}: {:.3f}s vs {:.3f}s ({:+.0%}){}'.format(
+            stage,
+            result['seconds'],
+            baseline_result['seconds'],
+            ratio - 1,
+            ' REGRESSION' if regression else '')
+    return regressions
+
+
+def main():
+    """Run benchmark and print results."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=10000)
+    parser.add_argument('--gps-ratio', type=float, default=0.8)
+    parser.add_argument('--jobs', type=int, default=1)
+    parser.add_argument(
+        '--repeat', type=int, default=3,
+        help='Times every stage is run (the fastest one is kept)')
+    parser.add_argument('--output', help='File where results are written')
+    parser.add_argument('--compare', help='Baseline results file')
+    parser.add_argument(
+        '--threshold', type=float, default=DEFAULT_THRESHOLD,
+        help='Relative slowdown over the baseline considered a regression')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        tree_directory = os.path.join(directory, 'pictures')
+        os.mkdir(tree_directory)
+        create_tree(tree_directory, args.count, args.gps_ratio)
+
+        best_timings = {}
+        for repeat in range(args.repeat):
+            data_directory = os.path.join(directory, 'data{}'.format(repeat))
+            timings = run_stages(tree_directory, data_directory, args.jobs)
+            for stage, (elapsed, items) in timings.iteritems():
+                best = best_timings.get(stage)
+                if best is None or elapsed < best[0]:
+                    best_timings[stage] = (elapsed, items)
+    finally:
+        shutil.rmtree(directory)
+
+    results = {
+        'format': RESULTS_VERSION,
+        'version': pic2map.__version__,
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'count': args.count,
+        'gps_ratio': args.gps_ratio,
+        'jobs': args.jobs,
+        'stages': dict(
+            (stage, {
+                'seconds': elapsed,
+                'items': items,
+                'rate': items / elapsed if elapsed else None,
+            })
+            for stage, (elapsed, items) in best_timings.iteritems()
+        ),
+    }
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+    else:
+        for stage, result in sorted(results['stages'].iteritems()):
+            print '{}: {} items in {:.3f}s ({:.0f} items/s)'.format(
+                stage, result['items'], result['seconds'], result['rate'])
+
+
+if __name__ == '__main__':
+    main()
@@ -6,12 +6,21 @@ import logging
 import os
 import sys
 
-from pic2map.db import (
-    LocationDB,
-    transform_metadata_to_row,
+from pic2map.db import LocationDB
+from pic2map.exif_cache import ExifCache
+from pic2map.fs import DETECTORS
+from pic2map.jobs import (
+    DEFAULT_OPTIONS,
+    JobQueue,
+    job_progress,
+    run_job,
+)
+from pic2map.watch import (
+    POLL_INTERVAL,
+    apply_changes,
+    create_watcher,
+    iter_batches,
 )
-from pic2map.fs import TreeExplorer
-from pic2map.gps import filter_gps_metadata
 from pic2map.server.app import app
 
 
@@ -29,23 +38,101 @@ def main(argv=None):
 
 def add(args):
     """Add location information for pictures under directory."""
-    logger.info('Adding image files from %r...', args.directory)
-    tree_explorer = TreeExplorer(args.directory)
-    paths = tree_explorer.paths()
+    options = {
+        option_name: getattr(args, option_name)
+        for option_name in DEFAULT_OPTIONS
+    }
+
+    with LocationDB() as database:
+        job_queue = JobQueue(database)
+        if args.queue:
+            # The worker may run from a different working directory
+            directory = os.path.abspath(args.directory)
+            job_id = job_queue.submit(directory, options)
+            logger.info(
+                'Job %d queued to add image files from %r', job_id, directory)
+            return
+
+        logger.info('Adding image files from %r...', args.directory)
+        job_id = job_queue.submit(args.directory, options)
+        job = run_job(database, job_queue, job_queue.claim(job_id))
 
-    gps_metadata_records = filter_gps_metadata(paths)
     logger.info(
-        '%d picture files with GPS metadata found under %s',
-        len(gps_metadata_records),
-        args.directory)
+        '%d picture files with GPS metadata found under %s '
+        '(%d new, %d updated, %d unchanged)',
+        job['rows_inserted'] + job['rows_updated'] + job['rows_unchanged'],
+        args.directory,
+        job['rows_inserted'],
+        job['rows_updated'],
+        job['rows_unchanged'])
+
+
+def worker(_args):
+    """Run queued jobs and resume the interrupted ones."""
+    with LocationDB() as database:
+        job_queue = JobQueue(database)
+        job_count = 0
+        job = job_queue.claim()
+        while job is not None:
+            try:
+                run_job(database, job_queue, job)
+            except Exception:  # pylint:disable=broad-except
+                logger.exception('Job %d failed', job['id'])
+            job_count += 1
+            job = job_queue.claim()
+
+    logger.info('%d jobs run', job_count)
+
+
+def status(args):
+    """Show progress of indexing jobs."""
+    with LocationDB() as database:
+        job_queue = JobQueue(database)
+        progresses = [
+            job_progress(job, job_queue.expected_file_count(job))
+            for job in job_queue.jobs(args.limit)
+        ]
+
+    for progress in progresses:
+        print format_progress(progress)
 
-    location_rows = [
-        transform_metadata_to_row(metadata)
-        for metadata in gps_metadata_records
-    ]
-    if location_rows:
-        with LocationDB() as database:
-            database.insert(location_rows)
+
+def format_progress(progress):
+    """Format job progress to be displayed.
+
+    :param progress: Progress information as returned by ``job_progress``
+    :type progress: dict(str)
+    :returns: Progress in a single line
+    :rtype: str
+
+    """
+    text = (
+        '{id:>4} {state:<8} {directory}: {files_seen} files seen, '
+        '{files_extracted} extracted, {rows_inserted} inserted, '
+        '{rows_updated} updated'
+        .format(**progress))
+    if progress['rate'] is not None:
+        text += ' ({:.1f} files/s'.format(progress['rate'])
+        if progress['eta'] is not None:
+            text += ', ETA {:.0f}s'.format(progress['eta'])
+        text += ')'
+    if progress['error'] is not None:
+        text += ': {}'.format(progress['error'])
+    return text
+
+
+def watch(args):
+    """Index pictures under directory as they are added or removed."""
+    watcher = create_watcher(args.directory, args.poll, args.interval)
+    with LocationDB() as database, watcher:
+        cache = ExifCache(database)
+        logger.info('Watching %r for changes...', args.directory)
+        try:
+            for changes in iter_batches(watcher):
+                apply_changes(
+                    database, changes, args.detection, args.jobs, cache)
+        except KeyboardInterrupt:
+            logger.info('Stopped watching %r', args.directory)
 
 
 def remove(args):
@@ -84,6 +171,20 @@ def valid_directory(path):
     return path
 
 
+def positive_integer(value):
+    """Positive integer validation."""
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+
+    if number <= 0:
+        raise argparse.ArgumentTypeError(
+            '{!r} is not a positive integer'.format(value))
+
+    return number
+
+
 def configure_logging(log_level):
     """Configure logging based on command line argument.
 
@@ -127,8 +228,85 @@ def parse_arguments(argv):
     add_parser = subparsers.add_parser('add', help=add.__doc__)
     add_parser.add_argument(
         'directory', type=valid_directory, help='Base directory')
+    add_parser.add_argument(
+        '-i', '--incremental',
+        action='store_true',
+        help=('Skip files already in the database whose size and '
+              'modification time have not changed'))
+    detection_methods = sorted(DETECTORS)
+    add_parser.add_argument(
+        '-d', '--detection',
+        choices=detection_methods,
+        default='signature',
+        help=('JPEG files detection method. One of {0} or {1} '
+              '(%(default)s by default)'
+              .format(', '.join(detection_methods[:-1]),
+                      detection_methods[-1])))
+    add_parser.add_argument(
+        '-w', '--walk-threads',
+        dest='walk_threads',
+        type=positive_integer,
+        default=1,
+        help=('Number of threads used to list directories in parallel '
+              '(%(default)s by default)'))
+    add_parser.add_argument(
+        '-j', '--jobs',
+        type=positive_integer,
+        default=1,
+        help=('Number of exiftool processes used to extract metadata '
+              '(%(default)s by default)'))
+    add_parser.add_argument(
+        '--no-sync',
+        dest='no_sync',
+        action='store_true',
+        help=('Do not sync data to disk while loading rows (faster, but the '
+              'database may get corrupted on power loss)'))
+    add_parser.add_argument(
+        '-q', '--queue',
+        action='store_true',
+        help='Queue job to be run later by the worker command')
     add_parser.set_defaults(func=add)
 
+    worker_parser = subparsers.add_parser('worker', help=worker.__doc__)
+    worker_parser.set_defaults(func=worker)
+
+    status_parser = subparsers.add_parser('status', help=status.__doc__)
+    status_parser.add_argument(
+        '-n', '--limit',
+        type=positive_integer,
+        default=10,
+        help='Number of most recent jobs to show (%(default)s by default)')
+    status_parser.set_defaults(func=status)
+
+    watch_parser = subparsers.add_parser('watch', help=watch.__doc__)
+    watch_parser.add_argument(
+        'directory', type=valid_directory, help='Base directory')
+    watch_parser.add_argument(
+        '-d', '--detection',
+        choices=detection_methods,
+        default='signature',
+        help=('JPEG files detection method. One of {0} or {1} '
+              '(%(default)s by default)'
+              .format(', '.join(detection_methods[:-1]),
+                      detection_methods[-1])))
+    watch_parser.add_argument(
+        '-j', '--jobs',
+        type=positive_integer,
+        default=1,
+        help=('Number of exiftool processes used to extract metadata '
+              '(%(default)s by default)'))
+    watch_parser.add_argument(
+        '-p', '--poll',
+        action='store_true',
+        help='Scan directory periodically even if inotify is available')
+    watch_parser.add_argument(
+        '--interval',
+        type=positive_integer,
+        default=POLL_INTERVAL,
+        help=('Seconds between directory scans when polling '
+              '(%(default)s by default)'))
+    watch_parser.set_defaults(func=watch)
+
     remove_parser = subparsers.add_parser('remove', help=remove.__doc__)
     remove_parser.add_argument(
         'directory', type=valid_directory, help='Base directory')
@@ -1,8 +1,16 @@
 # -*- coding: utf-8 -*-
 """Location database."""
 
+import datetime
 import logging
+import math
 import os
+import sqlite3
+import time
+
+from array import array
+from collections import namedtuple
+from contextlib import contextmanager
 
 import arrow
 
@@ -10,18 +18,628 @@ from sqlalchemy import (
     Column,
     MetaData,
     Table,
+    and_,
+    bindparam,
+    case,
+    cast,
     create_engine,
+    event,
+    func,
+    literal_column,
+    or_,
     select,
+    text,
+    union_all,
 )
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.pool import SingletonThreadPool
 from sqlalchemy.types import (
+    Boolean,
     DateTime,
     Float,
+    Integer,
     String,
 )
 from xdg import BaseDirectory
 
+from pic2map.util import (
+    centroid_from_sums,
+    chunks,
+)
+
 logger = logging.getLogger(__name__)
 
+# Number of rows inserted in a single transaction
+INSERT_CHUNK_SIZE = 10000
+
+# Page cache size in KiB used while bulk loading rows
+BULK_LOAD_CACHE_SIZE = 64 * 1024
+
+# Number of rows fetched at once when selecting locations in chunks
+FETCH_CHUNK_SIZE = 10000
+
+# Timestamp stored in location columns for rows without a datetime
+MISSING_TIMESTAMP = -2 ** 63
+
+# Maximum number of filenames used in a single query
+# (SQLite limits the number of host parameters per statement)
+MAX_QUERY_FILENAMES = 500
+
+# Statements used to create an R*Tree index on the location coordinates that
+# is kept in sync with the location table using triggers
+SPATIAL_INDEX_DDL = [
+    """
+    CREATE VIRTUAL TABLE location_rtree
+    USING rtree(id, min_lat, max_lat, min_lon, max_lon)
+    """,
+    """
+    CREATE TRIGGER location_rtree_insert AFTER INSERT ON location
+    WHEN new.latitude IS NOT NULL AND new.longitude IS NOT NULL
+    BEGIN
+        INSERT INTO location_rtree VALUES (
+            new.rowid,
+            new.latitude, new.latitude,
+            new.longitude, new.longitude
+        );
+    END
+    """,
+    """
+    CREATE TRIGGER location_rtree_update
+    AFTER UPDATE OF latitude, longitude ON location
+    BEGIN
+        DELETE FROM location_rtree WHERE id = old.rowid;
+        INSERT INTO location_rtree
+        SELECT new.rowid,
+            new.latitude, new.latitude,
+            new.longitude, new.longitude
+        WHERE new.latitude IS NOT NULL AND new.longitude IS NOT NULL;
+    END
+    """,
+    """
+    CREATE TRIGGER location_rtree_delete AFTER DELETE ON location
+    BEGIN
+        DELETE FROM location_rtree WHERE id = old.rowid;
+    END
+    """,
+    """
+    INSERT INTO location_rtree
+    SELECT rowid, latitude, latitude, longitude, longitude
+    FROM location
+    WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+    """,
+]
+
+# Highest zoom level for which locations are clustered. At higher zoom
+# levels, locations are returned individually.
+MAX_CLUSTER_ZOOM = 16
+
+# Number of cluster grid cells per axis in a 256 pixels map tile, that is,
+# cells are 64 pixels wide
+CLUSTER_CELLS_PER_TILE = 4
+
+# Cluster grid cell for a location at every zoom level in the
+# location_cluster_zoom table. Cells are equally sized in degrees, so they
+# are squares at the equator and get taller in the map closer to the poles.
+CLUSTER_CELL_X = (
+    'MIN(CAST(({longitude} + 180.0) / 360.0 * location_cluster_zoom.x_cells'
+    ' AS INTEGER), location_cluster_zoom.x_cells - 1)'
+)
+CLUSTER_CELL_Y = (
+    'MIN(CAST((90.0 - {latitude}) / 180.0 * location_cluster_zoom.y_cells'
+    ' AS INTEGER), location_cluster_zoom.y_cells - 1)'
+)
+
+
+def _cluster_cell_sql(prefix):
+    """Get SQL expressions for the cluster grid cell of a location.
+
+    :param prefix: Prefix used to refer to the location row in the trigger
+    :type prefix: str
+    :returns: Cell column and row expressions
+    :rtype: dict(str, str)
+
+    """
+    return {
+        'x': CLUSTER_CELL_X.format(longitude=prefix + '.longitude'),
+        'y': CLUSTER_CELL_Y.format(latitude=prefix + '.latitude'),
+    }
+
+
+# Statements to record the locations added to and removed from the cluster
+# grid. Triggers only append the changed locations to a log table, which is
+# applied set-wise to the grid cells after every chunk of changed rows, or
+# less often during bulk loads, because updating the cells of every zoom
+# level for each row is slow.
+CLUSTER_LOG_SQL = """
+    INSERT INTO location_cluster_change (id, latitude, longitude, sign)
+    SELECT {prefix}.rowid, {prefix}.latitude, {prefix}.longitude, {sign}
+    WHERE {prefix}.latitude IS NOT NULL AND {prefix}.longitude IS NOT NULL;
+"""
+CLUSTER_ADD_SQL = CLUSTER_LOG_SQL.format(prefix='new', sign=1)
+CLUSTER_REMOVE_SQL = CLUSTER_LOG_SQL.format(prefix='old', sign=-1)
+
+CLUSTER_DELETE_TRIGGER_DDL = """
+    CREATE TRIGGER location_cluster_delete AFTER DELETE ON location
+    BEGIN
+        {}
+    END
+""".format(CLUSTER_REMOVE_SQL)
+
+# Statements to create the cluster change log table, the table where changes
+# are aggregated and the triggers that fill the log
+CLUSTER_TRIGGER_DDL = [
+    """
+    CREATE TABLE location_cluster_change (
+        id INTEGER NOT NULL,
+        latitude FLOAT NOT NULL,
+        longitude FLOAT NOT NULL,
+        sign INTEGER NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE location_cluster_delta (
+        x INTEGER NOT NULL,
+        y INTEGER NOT NULL,
+        count INTEGER NOT NULL,
+        lat_sum FLOAT NOT NULL,
+        lon_sum FLOAT NOT NULL,
+        id_sum INTEGER NOT NULL
+    )
+    """,
+    """
+    CREATE TRIGGER location_cluster_insert AFTER INSERT ON location
+    BEGIN
+        {}
+    END
+    """.format(CLUSTER_ADD_SQL),
+    """
+    CREATE TRIGGER location_cluster_update
+    AFTER UPDATE OF latitude, longitude ON location
+    WHEN old.latitude IS NOT new.latitude
+    OR old.longitude IS NOT new.longitude
+    BEGIN
+        {}
+        {}
+    END
+    """.format(CLUSTER_REMOVE_SQL, CLUSTER_ADD_SQL),
+    CLUSTER_DELETE_TRIGGER_DDL,
+]
+
+# Statements to apply the cluster change log to the grid cells of every
+# zoom level. Changes that cancel out, like rows updated with the same
+# location, are discarded and the rest are aggregated in the cells of the
+# highest zoom level first. Cells are split in two along each axis at every
+# zoom level, so the cells of lower zoom levels are derived from those by
+# shifting their column and row. That way, the number of rows sorted
+# depends on the number of cells changed instead of the number of
+# locations.
+#
+# The sum of location row ids is stored as well, so that when a cell
+# contains a single location, its row can be retrieved. Every change
+# increments the cell version, which is used to detect stale map tiles.
+CLUSTER_APPLY_SQL = [
+    """
+    INSERT INTO location_cluster_delta
+    SELECT {x}, {y}, SUM(sign), SUM(sign * latitude),
+        SUM(sign * longitude), SUM(sign * id)
+    FROM (
+        SELECT id, latitude, longitude, SUM(sign) AS sign
+        FROM location_cluster_change
+        GROUP BY id, latitude, longitude
+        HAVING SUM(sign) != 0
+    ) AS logged, location_cluster_zoom
+    WHERE zoom = {max_zoom}
+    GROUP BY 1, 2
+    """.format(max_zoom=MAX_CLUSTER_ZOOM, **_cluster_cell_sql('logged')),
+] + [
+    """
+    INSERT INTO location_cluster
+        (zoom, x, y, count, lat_sum, lon_sum, id_sum, version)
+    SELECT {zoom}, x >> {shift}, y >> {shift},
+        SUM(count), SUM(lat_sum), SUM(lon_sum), SUM(id_sum), 1
+    FROM location_cluster_delta
+    WHERE 1
+    GROUP BY 2, 3
+    ON CONFLICT(zoom, x, y) DO UPDATE SET
+        count = count + excluded.count,
+        lat_sum = CASE WHEN count + excluded.count = 0 THEN 0.0
+            ELSE lat_sum + excluded.lat_sum END,
+        lon_sum = CASE WHEN count + excluded.count = 0 THEN 0.0
+            ELSE lon_sum + excluded.lon_sum END,
+        id_sum = id_sum + excluded.id_sum,
+        version = version + 1
+    """.format(zoom=zoom, shift=MAX_CLUSTER_ZOOM - zoom)
+    for zoom in range(MAX_CLUSTER_ZOOM + 1)
+] + [
+    'DELETE FROM location_cluster_delta',
+    'DELETE FROM location_cluster_change',
+]
+
+# Maximum number of rows changed during a bulk load before the cluster
+# change log is applied. Applying it once for many rows is cheaper, since
+# the cells of lower zoom levels are updated only once, but clusters are
+# out of date until then.
+CLUSTER_APPLY_SIZE = 100000
+
+# Statements used to create a grid of clusters for each zoom level that is
+# kept in sync with the location table using the change log. Empty cells are
+# kept in the table to make updates cheaper and to never reset their
+# version.
+CLUSTER_INDEX_DDL = [
+    """
+    CREATE TABLE location_cluster_zoom (
+        zoom INTEGER PRIMARY KEY,
+        x_cells INTEGER NOT NULL,
+        y_cells INTEGER NOT NULL
+    )
+    """,
+    'INSERT INTO location_cluster_zoom VALUES {}'.format(', '.join(
+        '({}, {}, {})'.format(
+            zoom,
+            CLUSTER_CELLS_PER_TILE * 2 ** zoom,
+            CLUSTER_CELLS_PER_TILE * 2 ** zoom / 2,
+        )
+        for zoom in range(MAX_CLUSTER_ZOOM + 1)
+    )),
+    """
+    CREATE TABLE location_cluster (
+        zoom INTEGER NOT NULL,
+        x INTEGER NOT NULL,
+        y INTEGER NOT NULL,
+        count INTEGER NOT NULL,
+        lat_sum FLOAT NOT NULL,
+        lon_sum FLOAT NOT NULL,
+        id_sum INTEGER NOT NULL,
+        version INTEGER NOT NULL,
+        PRIMARY KEY (zoom, x, y)
+    )
+    """,
+    """
+    INSERT INTO location_cluster
+    SELECT zoom, x, y, COUNT(*), SUM(latitude), SUM(longitude), SUM(id), 1
+    FROM (
+        SELECT zoom, {x} AS x, {y} AS y,
+            location.latitude, location.longitude, location.rowid AS id
+        FROM location, location_cluster_zoom
+        WHERE location.latitude IS NOT NULL
+        AND location.longitude IS NOT NULL
+    )
+    GROUP BY zoom, x, y
+    """.format(**_cluster_cell_sql('location')),
+] + CLUSTER_TRIGGER_DDL
+
+# Components of the 3D unit vector of a location, whose sum is used to
+# calculate the centroid of the locations
+UNIT_VECTOR_SQL = {
+    'x': 'cos(radians({latitude})) * cos(radians({longitude}))',
+    'y': 'cos(radians({latitude})) * sin(radians({longitude}))',
+    'z': 'sin(radians({latitude}))',
+}
+
+
+def _unit_vector_sql(prefix):
+    """Get SQL expressions for the unit vector of a location.
+
+    :param prefix: Prefix used to refer to the location row in the trigger
+    :type prefix: str
+    :returns: Vector component expressions
+    :rtype: dict(str, str)
+
+    """
+    return {
+        name: expression.format(
+            latitude=prefix + '.latitude', longitude=prefix + '.longitude')
+        for name, expression in UNIT_VECTOR_SQL.iteritems()
+    }
+
+
+# Math functions used in the unit vector expressions that may be missing
+# when SQLite has been built without them
+MATH_FUNCTIONS = {
+    'cos': math.cos,
+    'sin': math.sin,
+    'radians': math.radians,
+}
+
+
+def _register_math_functions(dbapi_connection, _connection_record):
+    """Register math functions if SQLite doesn't provide them.
+
+    :param dbapi_connection: SQLite connection
+    :type dbapi_connection: sqlite3.Connection
+
+    """
+    try:
+        dbapi_connection.execute('SELECT cos(0.0), sin(0.0), radians(0.0)')
+    except sqlite3.OperationalError:
+        logger.debug('Registering SQLite math functions...')
+        for name, function in MATH_FUNCTIONS.iteritems():
+            dbapi_connection.create_function(
+                name, 1, _null_safe(function))
+
+
+def _null_safe(function):
+    """Wrap function so that it returns NULL for NULL arguments.
+
+    :param function: Function of a single argument
+    :type function: callable
+    :returns: Wrapped function
+    :rtype: callable
+
+    """
+    def wrapper(value):
+        """Call function unless the value is NULL."""
+        if value is None:
+            return None
+        return function(value)
+    return wrapper
+
+
+# Statements to add and remove a location from the summary. Bounds are
+# extended when a location is added, but they can't be shrunk when one is
+# removed without scanning the table, so they're flagged as stale instead
+# when the removed location was on the edge and recalculated when needed.
+SUMMARY_ADD_SQL = """
+    UPDATE location_summary SET
+        row_count = row_count + 1,
+        location_count = location_count + {located},
+        x_sum = x_sum + CASE WHEN {located} THEN {x} ELSE 0 END,
+        y_sum = y_sum + CASE WHEN {located} THEN {y} ELSE 0 END,
+        z_sum = z_sum + CASE WHEN {located} THEN {z} ELSE 0 END,
+        min_lat = CASE WHEN {located}
+            THEN MIN(COALESCE(min_lat, new.latitude), new.latitude)
+            ELSE min_lat END,
+        max_lat = CASE WHEN {located}
+            THEN MAX(COALESCE(max_lat, new.latitude), new.latitude)
+            ELSE max_lat END,
+        min_lon = CASE WHEN {located}
+            THEN MIN(COALESCE(min_lon, new.longitude), new.longitude)
+            ELSE min_lon END,
+        max_lon = CASE WHEN {located}
+            THEN MAX(COALESCE(max_lon, new.longitude), new.longitude)
+            ELSE max_lon END,
+        min_datetime = CASE WHEN new.datetime IS NOT NULL
+            THEN MIN(COALESCE(min_datetime, new.datetime), new.datetime)
+            ELSE min_datetime END,
+        max_datetime = CASE WHEN new.datetime IS NOT NULL
+            THEN MAX(COALESCE(max_datetime, new.datetime), new.datetime)
+            ELSE max_datetime END;
+""".format(
+    located='(new.latitude IS NOT NULL AND new.longitude IS NOT NULL)',
+    **_unit_vector_sql('new'))
+SUMMARY_REMOVE_SQL = """
+    UPDATE location_summary SET
+        row_count = row_count - 1,
+        location_count = location_count - {located},
+        x_sum = CASE WHEN {located}
+            THEN CASE WHEN location_count = 1 THEN 0.0 ELSE x_sum - {x} END
+            ELSE x_sum END,
+        y_sum = CASE WHEN {located}
+            THEN CASE WHEN location_count = 1 THEN 0.0 ELSE y_sum - {y} END
+            ELSE y_sum END,
+        z_sum = CASE WHEN {located}
+            THEN CASE WHEN location_count = 1 THEN 0.0 ELSE z_sum - {z} END
+            ELSE z_sum END,
+        bounds_stale = bounds_stale
+            OR ({located} AND (
+                old.latitude <= min_lat OR old.latitude >= max_lat
+                OR old.longitude <= min_lon OR old.longitude >= max_lon))
+            OR (old.datetime IS NOT NULL AND (
+                old.datetime <= min_datetime OR old.datetime >= max_datetime));
+""".format(
+    located='(old.latitude IS NOT NULL AND old.longitude IS NOT NULL)',
+    **_unit_vector_sql('old'))
+
+SUMMARY_DELETE_TRIGGER_DDL = """
+    CREATE TRIGGER location_summary_delete AFTER DELETE ON location
+    BEGIN
+        {}
+    END
+""".format(SUMMARY_REMOVE_SQL)
+
+# Statements used to create a single row table with aggregated values for
+# all the rows in the location table that is kept in sync using triggers
+SUMMARY_DDL = [
+    """
+    CREATE TABLE location_summary (
+        row_count INTEGER NOT NULL,
+        location_count INTEGER NOT NULL,
+        x_sum FLOAT NOT NULL,
+        y_sum FLOAT NOT NULL,
+        z_sum FLOAT NOT NULL,
+        min_lat FLOAT,
+        max_lat FLOAT,
+        min_lon FLOAT,
+        max_lon FLOAT,
+        min_datetime DATETIME,
+        max_datetime DATETIME,
+        bounds_stale BOOLEAN NOT NULL
+    )
+    """,
+    """
+    CREATE TRIGGER location_summary_insert AFTER INSERT ON location
+    BEGIN
+        {}
+    END
+    """.format(SUMMARY_ADD_SQL),
+    """
+    CREATE TRIGGER location_summary_update
+    AFTER UPDATE OF latitude, longitude, datetime ON location
+    BEGIN
+        {}
+        {}
+    END
+    """.format(SUMMARY_REMOVE_SQL, SUMMARY_ADD_SQL),
+    SUMMARY_DELETE_TRIGGER_DDL,
+    """
+    INSERT INTO location_summary
+    SELECT COUNT(*), COUNT(latitude), COALESCE(SUM({x}), 0.0),
+        COALESCE(SUM({y}), 0.0), COALESCE(SUM({z}), 0.0),
+        NULL, NULL, NULL, NULL, NULL, NULL, 1
+    FROM (
+        SELECT
+            CASE WHEN longitude IS NOT NULL THEN latitude END AS latitude,
+            CASE WHEN latitude IS NOT NULL THEN longitude END AS longitude
+        FROM location
+    ) AS located
+    """.format(**_unit_vector_sql('located')),
+]
+
+# Statements to remove the rows under a directory from the summary and the
+# cluster grid set-wise. They're used instead of the delete triggers, which
+# are dropped while the rows are deleted, because updating the summary and
+# logging cluster changes for each row is slow for big directories.
+DIRECTORY_CONDITION_SQL = 'filename >= :prefix AND filename < :upper_bound'
+SUMMARY_REMOVE_DIRECTORY_SQL = """
+    UPDATE location_summary SET
+        row_count = location_summary.row_count - removed.row_count,
+        location_count =
+            location_summary.location_count - removed.location_count,
+        x_sum = CASE
+            WHEN location_summary.location_count = removed.location_count
+            THEN 0.0 ELSE location_summary.x_sum - removed.x_sum END,
+        y_sum = CASE
+            WHEN location_summary.location_count = removed.location_count
+            THEN 0.0 ELSE location_summary.y_sum - removed.y_sum END,
+        z_sum = CASE
+            WHEN location_summary.location_count = removed.location_count
+            THEN 0.0 ELSE location_summary.z_sum - removed.z_sum END,
+        bounds_stale = location_summary.bounds_stale
+            OR COALESCE(
+                removed.min_lat <= location_summary.min_lat
+                OR removed.max_lat >= location_summary.max_lat
+                OR removed.min_lon <= location_summary.min_lon
+                OR removed.max_lon >= location_summary.max_lon, 0)
+            OR COALESCE(
+                removed.min_datetime <= location_summary.min_datetime
+                OR removed.max_datetime >= location_summary.max_datetime, 0)
+    FROM (
+        SELECT COUNT(*) AS row_count, COUNT(latitude) AS location_count,
+            COALESCE(SUM({x}), 0.0) AS x_sum,
+            COALESCE(SUM({y}), 0.0) AS y_sum,
+            COALESCE(SUM({z}), 0.0) AS z_sum,
+            MIN(latitude) AS min_lat, MAX(latitude) AS max_lat,
+            MIN(longitude) AS min_lon, MAX(longitude) AS max_lon,
+            MIN(datetime) AS min_datetime, MAX(datetime) AS max_datetime
+        FROM (
+            SELECT
+                CASE WHEN longitude IS NOT NULL THEN latitude END
+                    AS latitude,
+                CASE WHEN latitude IS NOT NULL THEN longitude END
+                    AS longitude,
+                datetime
+            FROM location
+            WHERE {condition}
+        ) AS located
+    ) AS removed
+""".format(condition=DIRECTORY_CONDITION_SQL, **_unit_vector_sql('located'))
+CLUSTER_REMOVE_DIRECTORY_SQL = """
+    INSERT INTO location_cluster_change (id, latitude, longitude, sign)
+    SELECT rowid, latitude, longitude, -1
+    FROM location
+    WHERE {condition}
+    AND latitude IS NOT NULL AND longitude IS NOT NULL
+""".format(condition=DIRECTORY_CONDITION_SQL)
+
+# Tables derived from the location table, the location table columns they
+# depend on and the statements to create them
+INDEX_DDL = [
+    ('location_rtree', ('latitude', 'longitude'), SPATIAL_INDEX_DDL),
+    ('location_cluster', ('latitude', 'longitude'), CLUSTER_INDEX_DDL),
+    ('location_summary', ('latitude', 'longitude', 'datetime'), SUMMARY_DDL),
+]
+
+UpsertCounts = namedtuple('UpsertCounts', 'inserted updated unchanged')
+
+
+class LocationColumns(object):
+
+    """Location information stored in columns.
+
+    Row identifiers and timestamps are stored in arrays of 64 bits integers
+    (C long on the supported platforms), with ``MISSING_TIMESTAMP`` for
+    missing datetimes, and timestamps are seconds since the epoch in UTC.
+    Coordinates are stored in arrays of 64 bits floats, with NaN for missing
+    values. Filenames are split in a directory, which is stored only once
+    for all the files in it, and a basename.
+
+    """
+
+    def __init__(self):
+        """Initialize empty columns."""
+        self.ids = array('l')
+        self.directories = []
+        self.directory_indexes = {}
+        self.directory_ids = array('l')
+        self.basenames = []
+        self.latitudes = array('d')
+        self.longitudes = array('d')
+        self.timestamps = array('l')
+
+    def __len__(self):
+        """Get number of locations."""
+        return len(self.basenames)
+
+    def extend(self, rows):
+        """Add locations to the columns.
+
+        :param rows:
+            Row identifier, filename, latitude, longitude and timestamp
+            tuples
+        :type rows: list(tuple(int, unicode, float, float, int))
+
+        """
+        nan = float('nan')
+        directory_indexes = self.directory_indexes
+        directories = self.directories
+        split = os.path.split
+        directory_ids = self.directory_ids
+        basenames = self.basenames
+        for _row_id, filename, _latitude, _longitude, _timestamp in rows:
+            directory, basename = split(filename)
+            directory_id = directory_indexes.get(directory)
+            if directory_id is None:
+                directory_id = directory_indexes[directory] = len(directories)
+                directories.append(directory)
+            directory_ids.append(directory_id)
+            basenames.append(basename)
+
+        self.ids.extend(row[0] for row in rows)
+        self.latitudes.extend(
+            nan if row[2] is None else row[2] for row in rows)
+        self.longitudes.extend(
+            nan if row[3] is None else row[3] for row in rows)
+        self.timestamps.extend(
+            MISSING_TIMESTAMP if row[4] is None else row[4] for row in rows)
+
+    def filename(self, index):
+        """Get filename of a location.
+
+        :param index: Location index
+        :type index: int
+        :returns: Location filename
+        :rtype: unicode
+
+        """
+        return os.path.join(
+            self.directories[self.directory_ids[index]],
+            self.basenames[index],
+        )
+
+    def datetime(self, index):
+        """Get datetime of a location.
+
+        :param index: Location index
+        :type index: int
+        :returns: Location datetime in UTC or None if not available
+        :rtype: datetime.datetime | None
+
+        """
+        timestamp = self.timestamps[index]
+        if timestamp == MISSING_TIMESTAMP:
+            return None
+        return datetime.datetime.utcfromtimestamp(timestamp)
+
 
 class Database(object):
 
@@ -83,6 +701,53 @@ class Database(object):
         return table
 
 
+def location_db_filename():
+    """Get path to the location database file.
+
+    :returns: Path to the database file
+    :rtype: str
+
+    """
+    base_directory = BaseDirectory.save_data_path('pic2map')
+    return os.path.join(base_directory, 'location.db')
+
+
+# Engines used to read the generation counter by database filename
+_generation_engines = {}
+
+
+def location_generation():
+    """Get generation counter of the location database.
+
+    This is much cheaper than getting it from a ``LocationDB`` object,
+    since it reuses one connection per thread and doesn't reflect or check
+    any table, which matters when it's called for every request.
+
+    :returns: Generation counter
+    :rtype: int
+
+    """
+    db_filename = location_db_filename()
+    if os.path.isfile(db_filename):
+        engine = _generation_engines.get(db_filename)
+        if engine is None:
+            engine = _generation_engines[db_filename] = create_engine(
+                'sqlite:///{}'.format(db_filename),
+                poolclass=SingletonThreadPool,
+            )
+        try:
+            generation = engine.execute(
+                'SELECT generation FROM location_generation').scalar()
+        except OperationalError:
+            generation = None
+        if generation is not None:
+            return generation
+
+    # Database or generation table not created yet
+    with LocationDB() as location_db:
+        return location_db.generation()
+
+
 class LocationDB(Database):
 
     """Location database.
@@ -93,12 +758,18 @@ class LocationDB(Database):
 
     def __init__(self):
         """Create database if needed."""
-        base_directory = BaseDirectory.save_data_path('pic2map')
-        db_filename = os.path.join(base_directory, 'location.db')
+        db_filename = location_db_filename()
         Database.__init__(self, db_filename)
+        event.listen(self.engine, 'connect', _register_math_functions)
+        self.loaded_row_count = 0
+
+        # Number of changed rows whose cluster changes haven't been applied
+        # yet during a bulk load or None when not bulk loading
+        self.pending_cluster_row_count = None
 
         if os.path.isfile(db_filename):
             self.location_table = self['location']
+            self._upgrade_location_table()
         else:
             logger.debug('Creating location database %r...', db_filename)
 
@@ -109,19 +780,394 @@ class LocationDB(Database):
                 Column('latitude', Float),
                 Column('longitude', Float),
                 Column('datetime', DateTime),
+                Column('size', Integer),
+                Column('mtime', Float),
             )
             self.location_table.create()
 
-    def insert(self, rows):
+        self._drop_outdated_summary()
+        self._upgrade_cluster_triggers()
+        columns = self.location_table.columns
+        for table_name, column_names, statements in INDEX_DDL:
+            if (all(column_name in columns for column_name in column_names)
+                    and not self.engine.has_table(table_name)):
+                self._create_index(table_name, statements)
+
+        # Index tables are created with SQL, so their columns are declared
+        # here only to build queries
+        self.rtree_table = Table(
+            'location_rtree',
+            self.metadata,
+            Column('id', Integer, primary_key=True),
+            Column('min_lat', Float),
+            Column('max_lat', Float),
+            Column('min_lon', Float),
+            Column('max_lon', Float),
+        )
+        self.cluster_table = Table(
+            'location_cluster',
+            self.metadata,
+            Column('zoom', Integer, primary_key=True),
+            Column('x', Integer, primary_key=True),
+            Column('y', Integer, primary_key=True),
+            Column('count', Integer),
+            Column('lat_sum', Float),
+            Column('lon_sum', Float),
+            Column('id_sum', Integer),
+            Column('version', Integer),
+        )
+        self.summary_table = Table(
+            'location_summary',
+            self.metadata,
+            Column('row_count', Integer),
+            Column('location_count', Integer),
+            Column('x_sum', Float),
+            Column('y_sum', Float),
+            Column('z_sum', Float),
+            Column('min_lat', Float),
+            Column('max_lat', Float),
+            Column('min_lon', Float),
+            Column('max_lon', Float),
+            Column('min_datetime', DateTime),
+            Column('max_datetime', DateTime),
+            Column('bounds_stale', Boolean),
+        )
+        self.has_clusters = self.engine.has_table('location_cluster')
+        self.has_summary = self.engine.has_table('location_summary')
+
+        self.generation_table = Table(
+            'location_generation',
+            self.metadata,
+            Column('generation', Integer, nullable=False),
+        )
+        if not self.engine.has_table('location_generation'):
+            self._create_generation_table()
+
+    def _upgrade_location_table(self):
+        """Add columns missing in location tables from older versions."""
+        new_columns = [
+            Column('size', Integer),
+            Column('mtime', Float),
+        ]
+        missing_columns = [
+            column
+            for column in new_columns
+            if column.name not in self.location_table.columns
+        ]
+        if not missing_columns:
+            return
+
+        dialect = self.engine.dialect
+        for column in missing_columns:
+            logger.debug('Adding column %r to location table...', column.name)
+            self.engine.execute(
+                'ALTER TABLE location ADD COLUMN {} {}'
+                .format(column.name, column.type.compile(dialect=dialect)))
+
+        # Reflect table again to get the new columns
+        self.metadata.remove(self.location_table)
+        self.location_table = self['location']
+
+    def _create_index(self, table_name, statements):
+        """Create table that indexes the rows in the location table.
+
+        :param table_name: Name of the index table
+        :type table_name: str
+        :param statements: Statements used to create and fill the table
+        :type statements: list(str)
+
+        """
+        logger.debug('Creating %s index...', table_name)
+        with self.engine.begin() as connection:
+            for statement in statements:
+                connection.execute(statement)
+
+    def _drop_outdated_summary(self):
+        """Drop summary table from older versions so that it's recreated.
+
+        Older versions stored sums of latitudes and longitudes instead of
+        sums of unit vectors.
+
+        """
+        if not self.engine.has_table('location_summary'):
+            return
+        column_names = [
+            row[1]
+            for row in self.engine.execute(
+                'PRAGMA table_info(location_summary)')
+        ]
+        if 'x_sum' in column_names:
+            return
+
+        logger.debug('Dropping outdated location_summary index...')
+        with self.engine.begin() as connection:
+            for trigger_name in ['insert', 'update', 'delete']:
+                connection.execute(
+                    'DROP TRIGGER IF EXISTS location_summary_{}'
+                    .format(trigger_name))
+            connection.execute('DROP TABLE location_summary')
+
+    def _upgrade_cluster_triggers(self):
+        """Replace cluster triggers from older versions.
+
+        Older versions updated the cluster grid cells in the triggers for
+        every row instead of logging the changes to apply them set-wise.
+
+        """
+        if (not self.engine.has_table('location_cluster')
+                or self.engine.has_table('location_cluster_change')):
+            return
+
+        logger.debug('Replacing outdated location_cluster triggers...')
+        with self.engine.begin() as connection:
+            for trigger_name in ['insert', 'update', 'delete']:
+                connection.execute(
+                    'DROP TRIGGER IF EXISTS location_cluster_{}'
+                    .format(trigger_name))
+            for statement in CLUSTER_TRIGGER_DDL:
+                connection.execute(statement)
+
+    def _create_generation_table(self):
+        """Create table with a counter of changes to the location table."""
+        logger.debug('Creating location_generation table...')
+        with self.engine.begin() as connection:
+            self.generation_table.create(bind=connection)
+            connection.execute(
+                self.generation_table.insert(), {'generation': 0})
+
+    def _apply_cluster_changes(self, row_count):
+        """Apply changes logged by the cluster triggers to the grid cells.
+
+        This is expected to be called in the same transaction that changed
+        the rows. During bulk loads, changes are applied only once
+        ``CLUSTER_APPLY_SIZE`` rows have been changed and when the load
+        finishes.
+
+        :param row_count: Number of rows changed
+        :type row_count: int
+
+        """
+        if not self.has_clusters:
+            return
+
+        if self.pending_cluster_row_count is not None:
+            self.pending_cluster_row_count += row_count
+            if self.pending_cluster_row_count < CLUSTER_APPLY_SIZE:
+                return
+            self.pending_cluster_row_count = 0
+
+        for statement in CLUSTER_APPLY_SQL:
+            self.connection.execute(statement)
+
+    def _bump_generation(self, row_count):
+        """Increment generation counter if rows have been changed.
+
+        This is expected to be called in the same transaction that changed
+        the rows.
+
+        :param row_count: Number of rows changed
+        :type row_count: int
+
+        """
+        if row_count > 0:
+            table = self.generation_table
+            self.connection.execute(
+                table.update().values(generation=table.c.generation + 1))
+
+    def generation(self):
+        """Get generation counter for the location table.
+
+        The counter is incremented every time rows are inserted, updated or
+        deleted, so it can be used to check whether data derived from the
+        location table is still valid.
+
+        :returns: Generation counter
+        :rtype: int
+
+        """
+        select_query = select([self.generation_table.c.generation])
+        return self.connection.execute(select_query).scalar()
+
+    def insert(self, rows, chunk_size=INSERT_CHUNK_SIZE):
         """Insert rows in location table.
 
+        Rows are inserted in chunks with one transaction per chunk.
+
         :param rows: Rows to be inserted in the database
         :type rows: list(dict(str))
+        :param chunk_size: Number of rows inserted in each transaction
+        :type chunk_size: int
+        :returns: Number of rows inserted
+        :rtype: int
 
         """
         insert_query = self.location_table.insert()
-        result = self.connection.execute(insert_query, rows)
-        logger.debug('%d rows inserted', result.rowcount)
+        row_count = 0
+        start = time.time()
+        for rows_chunk in chunks(rows, chunk_size):
+            with self.connection.begin():
+                result = self.connection.execute(insert_query, rows_chunk)
+                self._apply_cluster_changes(result.rowcount)
+                self._bump_generation(result.rowcount)
+            row_count += result.rowcount
+
+        logger.debug(
+            '%d rows inserted (%s)',
+            row_count,
+            format_rate(row_count, time.time() - start))
+        self.loaded_row_count += row_count
+        return row_count
+
+    def upsert(self, rows, chunk_size=INSERT_CHUNK_SIZE):
+        """Insert rows in location table or update the existing ones.
+
+        Rows for files already in the table are updated only if some value
+        has changed, so files can be added again without failing on the
+        unique filename constraint.
+
+        :param rows: Rows to be inserted or updated in the database
+        :type rows: list(dict(str))
+        :param chunk_size: Number of rows upserted in each transaction
+        :type chunk_size: int
+        :returns: Number of rows inserted, updated and left unchanged
+        :rtype: UpsertCounts
+
+        """
+        table = self.location_table
+        column_names = table.columns.keys()
+        value_names = [
+            column_name
+            for column_name in column_names
+            if column_name != 'filename'
+        ]
+        upsert_query = text(
+            'INSERT INTO {table} ({columns}) VALUES ({values}) '
+            'ON CONFLICT(filename) DO UPDATE SET {updates} '
+            'WHERE {conditions}'
+            .format(
+                table=table.name,
+                columns=', '.join(column_names),
+                values=', '.join(
+                    ':{}'.format(column_name)
+                    for column_name in column_names),
+                updates=', '.join(
+                    '{0} = excluded.{0}'.format(value_name)
+                    for value_name in value_names),
+                conditions=' OR '.join(
+                    '{0} IS NOT excluded.{0}'.format(value_name)
+                    for value_name in value_names),
+            ),
+            bindparams=[
+                bindparam(column.name, type_=column.type)
+                for column in table.columns
+            ],
+        )
+
+        # New rows get the next rowid, so the number of rows inserted can be
+        # calculated without counting all the rows in the table
+        max_rowid_query = text('SELECT COALESCE(MAX(rowid), 0) FROM {}'
+                               .format(table.name))
+
+        inserted = updated = unchanged = 0
+        start = time.time()
+        for rows_chunk in chunks(rows, chunk_size):
+            parameters = [
+                dict(
+                    (column_name, row.get(column_name))
+                    for column_name in column_names
+                )
+                for row in rows_chunk
+            ]
+            with self.connection.begin():
+                previous_max_rowid = self.connection.execute(
+                    max_rowid_query).scalar()
+                result = self.connection.execute(upsert_query, parameters)
+                chunk_inserted = self.connection.execute(
+                    max_rowid_query).scalar() - previous_max_rowid
+                self._apply_cluster_changes(result.rowcount)
+                self._bump_generation(result.rowcount)
+
+            # Rows that match the ones in the table don't count as changes
+            inserted += chunk_inserted
+            updated += result.rowcount - chunk_inserted
+            unchanged += len(rows_chunk) - result.rowcount
+
+        logger.debug(
+            '%d rows inserted, %d updated and %d unchanged (%s)',
+            inserted,
+            updated,
+            unchanged,
+            format_rate(
+                inserted + updated + unchanged, time.time() - start))
+        self.loaded_row_count += inserted + updated
+        return UpsertCounts(inserted, updated, unchanged)
+
+    @contextmanager
+    def bulk_load(self, synchronous=True):
+        """Tune the database connection to insert many rows.
+
+        Write-ahead logging and a bigger page cache are used while loading.
+        With write-ahead logging, data is synced to disk only at checkpoints,
+        unless synchronous is set to False, in which case it's never synced.
+        That is faster, but the database may get corrupted on power loss.
+        The previous settings, including the journal mode, which is
+        persistent, are restored afterwards.
+
+        Cluster changes are applied in bigger batches while loading (see
+        ``CLUSTER_APPLY_SIZE``) and the remaining ones when it finishes, so
+        clusters may be out of date until then.
+
+        :param synchronous: Whether to sync data to disk at checkpoints
+        :type synchronous: bool
+
+        """
+        connection = self.connection
+        previous_journal_mode = connection.execute(
+            'PRAGMA journal_mode').scalar()
+        previous_cache_size = connection.execute(
+            'PRAGMA cache_size').scalar()
+        previous_synchronous = connection.execute(
+            'PRAGMA synchronous').scalar()
+
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute(
+            'PRAGMA cache_size=-{}'.format(BULK_LOAD_CACHE_SIZE))
+        connection.execute(
+            'PRAGMA synchronous={}'.format('NORMAL' if synchronous else 'OFF'))
+
+        start_row_count = self.loaded_row_count
+        start = time.time()
+        self.pending_cluster_row_count = 0
+        try:
+            yield
+        finally:
+            pending_cluster_row_count = self.pending_cluster_row_count
+            self.pending_cluster_row_count = None
+            if pending_cluster_row_count:
+                # Generation is bumped again, so that data derived from the
+                # clusters before they were up to date isn't used
+                with connection.begin():
+                    self._apply_cluster_changes(pending_cluster_row_count)
+                    self._bump_generation(pending_cluster_row_count)
+
+            connection.execute(
+                'PRAGMA synchronous={}'.format(previous_synchronous))
+            connection.execute(
+                'PRAGMA cache_size={}'.format(previous_cache_size))
+            try:
+                connection.execute(
+                    'PRAGMA journal_mode={}'.format(previous_journal_mode))
+            except OperationalError as exception:
+                # Leaving write-ahead logging requires exclusive access
+                logger.warning(
+                    'Unable to restore journal mode to %r (%s)',
+                    previous_journal_mode, exception)
+
+            row_count = self.loaded_row_count - start_row_count
+            logger.info(
+                '%d rows loaded (%s)',
+                row_count,
+                format_rate(row_count, time.time() - start))
 
     def select_all(self):
         """Get all rows from the location table.
@@ -134,19 +1180,559 @@ class LocationDB(Database):
         result = self.connection.execute(select_query)
         return result
 
-    def delete(self, directory):
-        """Delete rows with a filename under a given directory.
+    def select_bbox(self, min_lat, min_lon, max_lat, max_lon, limit=None):
+        """Get rows from the location table inside a bounding box.
+
+        The R*Tree index is used to find candidate rows and their exact
+        coordinates are checked afterwards, since the index stores them as
+        32-bit floats. A bounding box whose minimum longitude is greater
+        than its maximum longitude is considered to cross the antimeridian.
+
+        :param min_lat: Southern latitude of the bounding box
+        :type min_lat: float
+        :param min_lon: Western longitude of the bounding box
+        :type min_lon: float
+        :param max_lat: Northern latitude of the bounding box
+        :type max_lat: float
+        :param max_lon: Eastern longitude of the bounding box
+        :type max_lon: float
+        :param limit: Maximum number of rows to return
+        :type limit: int | None
+        :returns: Location information rows
+        :rtype: sqlalchemy.engine.result.ResultProxy
 
-        :param directory: Directory to be used as prefix in the delete query
-        :type directory: str
+        """
+        select_query = self._bbox_query(
+            [self.location_table], min_lat, min_lon, max_lat, max_lon, limit)
+        result = self.connection.execute(select_query)
+        return result
+
+    def select_columns(self, bbox=None, limit=None):
+        """Get location information from the location table in columns.
+
+        Rows are read directly from the DBAPI cursor into arrays, so no
+        object is created for each row apart from its file basename.
+
+        :param bbox:
+            South, west, north and east coordinates of the bounding box the
+            locations must be in. If not passed, all rows are returned.
+        :type bbox: tuple(float, float, float, float) | None
+        :param limit: Maximum number of rows to return
+        :type limit: int | None
+        :returns: Location information columns
+        :rtype: LocationColumns
+
+        """
+        location_columns = LocationColumns()
+        for rows in self._select_chunks(
+                self._location_columns(), bbox, limit, FETCH_CHUNK_SIZE):
+            location_columns.extend(rows)
+        return location_columns
+
+    def select_column_chunks(self, bbox=None, limit=None,
+                             chunk_size=FETCH_CHUNK_SIZE):
+        """Get location information from the location table in chunks.
+
+        This is like ``select_columns``, but only one chunk is kept in
+        memory at a time.
+
+        :param bbox:
+            South, west, north and east coordinates of the bounding box the
+            locations must be in. If not passed, all rows are returned.
+        :type bbox: tuple(float, float, float, float) | None
+        :param limit: Maximum number of rows to return
+        :type limit: int | None
+        :param chunk_size: Number of rows fetched at once
+        :type chunk_size: int
+        :returns: Location information columns for each chunk
+        :rtype: iterator(LocationColumns)
+
+        """
+        for rows in self._select_chunks(
+                self._location_columns(), bbox, limit, chunk_size):
+            location_columns = LocationColumns()
+            location_columns.extend(rows)
+            yield location_columns
+
+    def _location_columns(self):
+        """Get columns selected to be stored in location columns.
+
+        :returns:
+            Row identifier, filename, latitude, longitude and timestamp
+            columns. Timestamps are integer seconds since the epoch in UTC.
+        :rtype: list(sqlalchemy.sql.expression.ColumnElement)
+
+        """
+        table = self.location_table
+        return [
+            literal_column('location.rowid'),
+            table.c.filename,
+            table.c.latitude,
+            table.c.longitude,
+            cast(func.strftime('%s', table.c.datetime), Integer),
+        ]
+
+    def select_points(self, bbox=None, limit=None,
+                      chunk_size=FETCH_CHUNK_SIZE):
+        """Get identifiers and coordinates of located rows in chunks.
+
+        This is like ``select_column_chunks``, but rows without coordinates
+        are skipped and only identifiers and coordinates are returned as
+        tuples, so that the location details can be retrieved later with
+        ``select_location``.
+
+        :param bbox:
+            South, west, north and east coordinates of the bounding box the
+            locations must be in. If not passed, all located rows are
+            returned.
+        :type bbox: tuple(float, float, float, float) | None
+        :param limit: Maximum number of rows to return
+        :type limit: int | None
+        :param chunk_size: Number of rows fetched at once
+        :type chunk_size: int
+        :returns: Chunks of row identifier, latitude and longitude tuples
+        :rtype: iterator(list(tuple(int, float, float)))
 
         """
         table = self.location_table
-        delete_query = (
-            table.delete()
-            .where(table.c.filename.startswith(directory))
+        columns = [
+            literal_column('location.rowid'),
+            table.c.latitude,
+            table.c.longitude,
+        ]
+        return self._select_chunks(
+            columns, bbox or (-90.0, -180.0, 90.0, 180.0), limit, chunk_size)
+
+    def _select_chunks(self, columns, bbox, limit, chunk_size):
+        """Get columns from the location table in chunks.
+
+        :param columns: Columns to select
+        :type columns: list(sqlalchemy.sql.expression.ColumnElement)
+        :param bbox: South, west, north and east coordinates or None
+        :type bbox: tuple(float, float, float, float) | None
+        :param limit: Maximum number of rows to return
+        :type limit: int | None
+        :param chunk_size: Number of rows fetched at once
+        :type chunk_size: int
+        :returns: Chunks of rows
+        :rtype: iterator(list(tuple))
+
+        """
+        if bbox is None:
+            select_query = select(columns)
+            if limit is not None:
+                select_query = select_query.limit(limit)
+        else:
+            select_query = self._bbox_query(columns, *bbox, limit=limit)
+
+        result = self.connection.execute(select_query)
+        try:
+            cursor = result.cursor
+            rows = cursor.fetchmany(chunk_size)
+            while rows:
+                yield rows
+                rows = cursor.fetchmany(chunk_size)
+        finally:
+            result.close()
+
+    def _bbox_query(self, columns, min_lat, min_lon, max_lat, max_lon,
+                    limit=None):
+        """Build query for rows in the location table inside a bounding box.
+
+        :param columns: Columns to select
+        :type columns: list(sqlalchemy.sql.expression.ColumnElement)
+        :param min_lat: Southern latitude of the bounding box
+        :type min_lat: float
+        :param min_lon: Western longitude of the bounding box
+        :type min_lon: float
+        :param max_lat: Northern latitude of the bounding box
+        :type max_lat: float
+        :param max_lon: Eastern longitude of the bounding box
+        :type max_lon: float
+        :param limit: Maximum number of rows to return
+        :type limit: int | None
+        :returns: Query for the rows in the bounding box
+        :rtype: sqlalchemy.sql.expression.Select |
+            sqlalchemy.sql.expression.CompoundSelect
+
+        """
+        table = self.location_table
+        rtree_table = self.rtree_table
+
+        if min_lon <= max_lon:
+            lon_ranges = [(min_lon, max_lon)]
+        else:
+            lon_ranges = [(min_lon, 180.0), (-180.0, max_lon)]
+
+        select_queries = [
+            select(columns)
+            .select_from(
+                table.join(
+                    rtree_table,
+                    rtree_table.c.id == literal_column('location.rowid'),
+                )
+            )
+            .where(and_(
+                rtree_table.c.max_lat >= min_lat,
+                rtree_table.c.min_lat <= max_lat,
+                rtree_table.c.max_lon >= range_min_lon,
+                rtree_table.c.min_lon <= range_max_lon,
+                table.c.latitude.between(min_lat, max_lat),
+                table.c.longitude.between(range_min_lon, range_max_lon),
+            ))
+            for range_min_lon, range_max_lon in lon_ranges
+        ]
+        if len(select_queries) == 1:
+            select_query = select_queries[0]
+        else:
+            select_query = union_all(*select_queries)
+        if limit is not None:
+            select_query = select_query.limit(limit)
+        return select_query
+
+    def select_clusters(self, min_lat, min_lon, max_lat, max_lon, zoom):
+        """Get location clusters inside a bounding box.
+
+        The clusters are the cells of the grid for the given zoom level,
+        so their number depends on the size of the bounding box and not on
+        the number of locations. For clusters with a single location, the
+        location row identifier is returned as well, so that its details
+        can be retrieved with ``select_location``.
+
+        :param min_lat: Southern latitude of the bounding box
+        :type min_lat: float
+        :param min_lon: Western longitude of the bounding box
+        :type min_lon: float
+        :param max_lat: Northern latitude of the bounding box
+        :type max_lat: float
+        :param max_lon: Eastern longitude of the bounding box
+        :type max_lon: float
+        :param zoom: Zoom level up to ``MAX_CLUSTER_ZOOM``
+        :type zoom: int
+        :returns:
+            Number of locations, their centroid and, for single locations,
+            their row identifier
+        :rtype: sqlalchemy.engine.result.ResultProxy
+
+        """
+        cluster_table = self.cluster_table
+
+        select_query = (
+            select([
+                cluster_table.c.count,
+                (cluster_table.c.lat_sum / cluster_table.c.count)
+                .label('latitude'),
+                (cluster_table.c.lon_sum / cluster_table.c.count)
+                .label('longitude'),
+                case(
+                    [(cluster_table.c.count == 1, cluster_table.c.id_sum)],
+                    else_=None,
+                ).label('id'),
+            ])
+            .where(and_(
+                self._cluster_cells_condition(
+                    min_lat, min_lon, max_lat, max_lon, zoom),
+                cluster_table.c.count > 0,
+            ))
         )
-        result = self.connection.execute(delete_query)
+        result = self.connection.execute(select_query)
+        return result
+
+    def select_location(self, row_id):
+        """Get location information for a row identifier.
+
+        :param row_id: Row identifier
+        :type row_id: int
+        :returns: Location information row or None if not found
+        :rtype: sqlalchemy.engine.result.RowProxy | None
+
+        """
+        table = self.location_table
+        rowid = literal_column('location.rowid')
+        select_query = (
+            select([
+                rowid.label('id'),
+                table.c.filename,
+                table.c.latitude,
+                table.c.longitude,
+                table.c.datetime,
+            ])
+            .where(rowid == row_id)
+        )
+        return self.connection.execute(select_query).first()
+
+    def cluster_version(self, min_lat, min_lon, max_lat, max_lon, zoom):
+        """Get a version for the location clusters inside a bounding box.
+
+        The version changes every time a location in any of the clusters is
+        added, modified or removed, so it can be used to check whether data
+        derived from those locations is still valid.
+
+        :param min_lat: Southern latitude of the bounding box
+        :type min_lat: float
+        :param min_lon: Western longitude of the bounding box
+        :type min_lon: float
+        :param max_lat: Northern latitude of the bounding box
+        :type max_lat: float
+        :param max_lon: Eastern longitude of the bounding box
+        :type max_lon: float
+        :param zoom: Zoom level up to ``MAX_CLUSTER_ZOOM``
+        :type zoom: int
+        :returns: Version of the clusters
+        :rtype: str
+
+        """
+        cluster_table = self.cluster_table
+        select_query = (
+            select([
+                func.count(),
+                func.coalesce(func.sum(cluster_table.c.version), 0),
+            ])
+            .where(self._cluster_cells_condition(
+                min_lat, min_lon, max_lat, max_lon, zoom))
+        )
+        cell_count, version_sum = (
+            self.connection.execute(select_query).first())
+        return '{}-{}'.format(cell_count, version_sum)
+
+    def _cluster_cells_condition(self, min_lat, min_lon, max_lat, max_lon,
+                                 zoom):
+        """Get condition to select the cluster cells in a bounding box.
+
+        :param min_lat: Southern latitude of the bounding box
+        :type min_lat: float
+        :param min_lon: Western longitude of the bounding box
+        :type min_lon: float
+        :param max_lat: Northern latitude of the bounding box
+        :type max_lat: float
+        :param max_lon: Eastern longitude of the bounding box
+        :type max_lon: float
+        :param zoom: Zoom level up to ``MAX_CLUSTER_ZOOM``
+        :type zoom: int
+        :returns: Condition to use in a where clause
+        :rtype: sqlalchemy.sql.elements.BooleanClauseList
+
+        """
+        cluster_table = self.cluster_table
+        min_x, max_y = cluster_cell(min_lat, min_lon, zoom)
+        max_x, min_y = cluster_cell(max_lat, max_lon, zoom)
+        if min_lon <= max_lon:
+            x_condition = cluster_table.c.x.between(min_x, max_x)
+        else:
+            x_condition = or_(
+                cluster_table.c.x >= min_x,
+                cluster_table.c.x <= max_x,
+            )
+
+        return and_(
+            cluster_table.c.zoom == zoom,
+            x_condition,
+            cluster_table.c.y.between(min_y, max_y),
+        )
+
+    def summary(self):
+        """Get aggregated values for all the rows in the location table.
+
+        Bounds flagged as stale after deleting locations are recalculated
+        before being returned.
+
+        :returns: Row from the location summary table
+        :rtype: sqlalchemy.engine.result.RowProxy
+
+        """
+        summary_table = self.summary_table
+        select_query = select([summary_table])
+        summary = self.connection.execute(select_query).first()
+        if not summary['bounds_stale']:
+            return summary
+
+        logger.debug('Recalculating location bounds...')
+        table = self.location_table
+        located = and_(
+            table.c.latitude.isnot(None), table.c.longitude.isnot(None))
+        update_query = summary_table.update().values(
+            min_lat=select([func.min(table.c.latitude)]).where(located),
+            max_lat=select([func.max(table.c.latitude)]).where(located),
+            min_lon=select([func.min(table.c.longitude)]).where(located),
+            max_lon=select([func.max(table.c.longitude)]).where(located),
+            min_datetime=select([func.min(table.c.datetime)]),
+            max_datetime=select([func.max(table.c.datetime)]),
+            bounds_stale=False,
+        )
+        with self.connection.begin():
+            self.connection.execute(update_query)
+            return self.connection.execute(select_query).first()
+
+    def centroid(self):
+        """Get geographic centroid of the rows in the location table.
+
+        The centroid is calculated from the sum of the unit vectors of the
+        locations, so it's correct for locations around the antimeridian or
+        the poles.
+
+        :returns:
+            Latitude and longitude of the centroid or None if there are no
+            rows or the centroid is undefined
+        :rtype: tuple(float, float) | None
+
+        """
+        if self.has_summary:
+            summary_table = self.summary_table
+            summary_query = select([
+                summary_table.c.location_count,
+                summary_table.c.x_sum,
+                summary_table.c.y_sum,
+                summary_table.c.z_sum,
+            ])
+        else:
+            table = self.location_table
+            located = and_(
+                table.c.latitude.isnot(None), table.c.longitude.isnot(None))
+            vector_sql = _unit_vector_sql('location')
+            summary_query = select([func.count()] + [
+                func.coalesce(
+                    func.sum(literal_column(vector_sql[component])), 0.0)
+                for component in 'xyz'
+            ]).select_from(table).where(located)
+        location_count, x_sum, y_sum, z_sum = (
+            self.connection.execute(summary_query).first())
+        if location_count == 0:
+            return None
+        return centroid_from_sums(x_sum, y_sum, z_sum, location_count)
+
+    def bounds(self):
+        """Get bounding box of the rows in the location table.
+
+        :returns: South, west, north and east coordinates or None if there
+            are no rows
+        :rtype: tuple(float, float, float, float) | None
+
+        """
+        summary = self.summary()
+        if summary['location_count'] == 0:
+            return None
+        return (
+            summary['min_lat'],
+            summary['min_lon'],
+            summary['max_lat'],
+            summary['max_lon'],
+        )
+
+    def date_range(self):
+        """Get range of dates of the rows in the location table.
+
+        :returns: Oldest and newest datetime or None if there are no rows
+            with a datetime
+        :rtype: tuple(datetime.datetime, datetime.datetime) | None
+
+        """
+        summary = self.summary()
+        if summary['min_datetime'] is None:
+            return None
+        return summary['min_datetime'], summary['max_datetime']
+
+    def file_stats(self, filenames):
+        """Get size and modification time stored for the given files.
+
+        :param filenames: Files to look for in the location table
+        :type filenames: list(str)
+        :returns: Size and modification time for the files found
+        :rtype: dict(str, tuple(int, float))
+
+        """
+        table = self.location_table
+        file_stats = {}
+        for index in range(0, len(filenames), MAX_QUERY_FILENAMES):
+            chunk = filenames[index:index + MAX_QUERY_FILENAMES]
+            select_query = (
+                select([table.c.filename, table.c.size, table.c.mtime])
+                .where(table.c.filename.in_(chunk))
+            )
+            result = self.connection.execute(select_query)
+            file_stats.update(
+                (filename, (size, mtime))
+                for filename, size, mtime in result
+            )
+        return file_stats
+
+    def delete_files(self, filenames):
+        """Delete rows for the given files.
+
+        :param filenames: Files to be deleted from the location table
+        :type filenames: list(str)
+        :returns: Number of rows deleted
+        :rtype: int
+
+        """
+        table = self.location_table
+        row_count = 0
+        for index in range(0, len(filenames), MAX_QUERY_FILENAMES):
+            chunk = filenames[index:index + MAX_QUERY_FILENAMES]
+            delete_query = table.delete().where(table.c.filename.in_(chunk))
+            with self.connection.begin():
+                result = self.connection.execute(delete_query)
+                self._apply_cluster_changes(result.rowcount)
+                self._bump_generation(result.rowcount)
+            row_count += result.rowcount
+        logger.debug('%d rows deleted', row_count)
+        return row_count
+
+    def delete(self, directory):
+        """Delete rows with a filename under a given directory.
+
+        Filenames are compared as a range instead of with ``LIKE``, so that
+        the filename index is used and wildcard characters in the directory
+        name are not special.
+
+        The summary and the cluster grid are updated set-wise for all the
+        rows at once instead of in the delete triggers.
+
+        :param directory: Directory whose files are deleted
+        :type directory: str | unicode
+
+        """
+        # Filenames are stored as unicode and SQLite doesn't accept non-ASCII
+        # byte strings
+        if isinstance(directory, str):
+            directory = directory.decode('utf8')
+
+        # All filenames under the directory start with the directory path
+        # and a separator, so they are sorted right after it and before the
+        # same path followed by the next character to the separator
+        prefix = directory
+        if not prefix.endswith(os.sep):
+            prefix += os.sep
+        upper_bound = prefix[:-1] + unichr(ord(os.sep) + 1)
+        parameters = {'prefix': prefix, 'upper_bound': upper_bound}
+
+        # Delete triggers are dropped and created again in the same
+        # transaction, so other connections never see the table without them
+        index_statements = []
+        if self.has_summary:
+            index_statements.append((
+                'location_summary_delete',
+                SUMMARY_REMOVE_DIRECTORY_SQL,
+                SUMMARY_DELETE_TRIGGER_DDL,
+            ))
+        if self.has_clusters:
+            index_statements.append((
+                'location_cluster_delete',
+                CLUSTER_REMOVE_DIRECTORY_SQL,
+                CLUSTER_DELETE_TRIGGER_DDL,
+            ))
+
+        delete_query = text(
+            'DELETE FROM location WHERE {}'.format(DIRECTORY_CONDITION_SQL))
+        with self.connection.begin():
+            for trigger_name, remove_query, _trigger_ddl in index_statements:
+                self.connection.execute(
+                    'DROP TRIGGER {}'.format(trigger_name))
+                self.connection.execute(text(remove_query), parameters)
+            result = self.connection.execute(delete_query, parameters)
+            for _trigger_name, _remove_query, trigger_ddl in index_statements:
+                self.connection.execute(trigger_ddl)
+            self._apply_cluster_changes(result.rowcount)
+            self._bump_generation(result.rowcount)
         logger.debug('%d rows deleted', result.rowcount)
         return result
 
@@ -157,11 +1743,54 @@ class LocationDB(Database):
         :rtype: int
 
         """
-        select_query = self.location_table.count()
+        if self.has_summary:
+            select_query = select([self.summary_table.c.row_count])
+        else:
+            select_query = self.location_table.count()
         result = self.connection.execute(select_query)
         return result.scalar()
 
 
+def cluster_cell(latitude, longitude, zoom):
+    """Get the cluster grid cell for a location.
+
+    This is the same calculation done in SQL by the cluster triggers.
+
+    :param latitude: Location latitude
+    :type latitude: float
+    :param longitude: Location longitude
+    :type longitude: float
+    :param zoom: Zoom level
+    :type zoom: int
+    :returns: Cell column and row
+    :rtype: tuple(int, int)
+
+    """
+    columns = CLUSTER_CELLS_PER_TILE * 2 ** zoom
+    rows = columns / 2
+    x = min(int((longitude + 180.0) / 360.0 * columns), columns - 1)
+    y = min(int((90.0 - latitude) / 180.0 * rows), rows - 1)
+    return max(x, 0), max(y, 0)
+
+
+def format_rate(row_count, elapsed):
+    """Format elapsed time and rows per second for logging.
+
+    :param row_count: Number of rows processed
+    :type row_count: int
+    :param elapsed: Elapsed time in seconds
+    :type elapsed: float
+    :returns: Elapsed time and rate
+    :rtype: str
+
+    """
+    if elapsed > 0:
+        rate = row_count / elapsed
+    else:
+        rate = float(row_count)
+    return '{:.2f}s, {:.0f} rows/s'.format(elapsed, rate)
+
+
 def transform_metadata_to_row(metadata):
     """Transform GPS metadata in database rows.
 
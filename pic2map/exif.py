@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+"""Native EXIF GPS metadata reader.
+
+Only the JPEG segments needed to get to the GPS IFD are parsed, so GPS
+metadata for plain JPEG files can be read without running exiftool.
+
+"""
+
+import logging
+import re
+import struct
+
+logger = logging.getLogger(__name__)
+
+SOI_MARKER = '\xff\xd8'
+SOS_MARKER = 0xda
+EOI_MARKER = 0xd9
+APP1_MARKER = 0xe1
+
+EXIF_HEADER = 'Exif\x00\x00'
+GPS_IFD_POINTER_TAG = 0x8825
+
+# GPS IFD tags supported by the reader and their exiftool names
+GPS_TAGS = {
+    0x0001: 'EXIF:GPSLatitudeRef',
+    0x0002: 'EXIF:GPSLatitude',
+    0x0003: 'EXIF:GPSLongitudeRef',
+    0x0004: 'EXIF:GPSLongitude',
+    0x0007: 'EXIF:GPSTimeStamp',
+    0x001d: 'EXIF:GPSDateStamp',
+}
+SUPPORTED_TAGS = frozenset(GPS_TAGS.itervalues())
+
+# TIFF field types and their sizes in bytes
+ASCII_TYPE = 2
+SHORT_TYPE = 3
+LONG_TYPE = 4
+RATIONAL_TYPE = 5
+TYPE_SIZES = {
+    1: 1,
+    ASCII_TYPE: 1,
+    SHORT_TYPE: 2,
+    LONG_TYPE: 4,
+    RATIONAL_TYPE: 8,
+    7: 1,
+}
+
+DATE_REGEX = re.compile(r'^(\d{4})\D?(\d{2})\D?(\d{2})')
+
+
+class UnsupportedFileError(Exception):
+
+    """File structure not supported by the native reader."""
+
+
+def read_gps_tags(path):
+    """Read GPS tags from a JPEG file.
+
+    :param path: Picture filename
+    :type path: str
+    :returns:
+        Metadata record in the same format used by exiftool or None if the
+        file couldn't be parsed
+    :rtype: dict(str) | None
+
+    """
+    try:
+        with open(path, 'rb') as file_:
+            tags = _read_jpeg(file_)
+    except (IOError,
+            UnicodeDecodeError,
+            UnsupportedFileError,
+            struct.error) as exception:
+        logger.debug(
+            'Unable to read GPS tags natively from %r: %s', path, exception)
+        return None
+
+    metadata_record = {'SourceFile': path}
+    metadata_record.update(tags)
+    return metadata_record
+
+
+def _read_exactly(file_, size):
+    """Read data from file and fail if it's truncated.
+
+    :param file_: File object
+    :type file_: file
+    :param size: Number of bytes to read
+    :type size: int
+    :returns: Data read
+    :rtype: str
+
+    """
+    data = file_.read(size)
+    if len(data) != size:
+        raise UnsupportedFileError('Truncated file')
+    return data
+
+
+def _read_jpeg(file_):
+    """Look for the EXIF segment in a JPEG file and read GPS tags from it.
+
+    :param file_: JPEG file object
+    :type file_: file
+    :returns: GPS tags found
+    :rtype: dict(str)
+
+    """
+    if file_.read(2) != SOI_MARKER:
+        raise UnsupportedFileError('Not a JPEG file')
+
+    while True:
+        prefix, marker = struct.unpack('>BB', _read_exactly(file_, 2))
+        if prefix != 0xff:
+            raise UnsupportedFileError('Unexpected JPEG marker')
+
+        # No EXIF segment before image data means no GPS tags
+        if marker in (SOS_MARKER, EOI_MARKER):
+            return {}
+
+        length = struct.unpack('>H', _read_exactly(file_, 2))[0]
+        if length < 2:
+            raise UnsupportedFileError('Invalid JPEG segment length')
+
+        if marker == APP1_MARKER and length >= 2 + len(EXIF_HEADER):
+            header = _read_exactly(file_, len(EXIF_HEADER))
+            if header == EXIF_HEADER:
+                return _read_tiff(
+                    file_, file_.tell(), length - 2 - len(EXIF_HEADER))
+            file_.seek(length - 2 - len(EXIF_HEADER), 1)
+        else:
+            file_.seek(length - 2, 1)
+
+
+def _read_tiff(file_, base, size):
+    """Read GPS tags from the TIFF structure in the EXIF segment.
+
+    :param file_: JPEG file object
+    :type file_: file
+    :param base: Position in the file where the TIFF structure starts
+    :type base: int
+    :param size: Size of the TIFF structure
+    :type size: int
+    :returns: GPS tags found
+    :rtype: dict(str)
+
+    """
+    def read(offset, length):
+        """Read data using an offset relative to the TIFF header."""
+        if offset + length > size:
+            raise UnsupportedFileError('Offset out of EXIF segment')
+        file_.seek(base + offset)
+        return _read_exactly(file_, length)
+
+    byte_order = read(0, 2)
+    if byte_order == 'II':
+        endianness = '<'
+    elif byte_order == 'MM':
+        endianness = '>'
+    else:
+        raise UnsupportedFileError('Unknown TIFF byte order')
+
+    magic, ifd0_offset = struct.unpack(endianness + 'HI', read(2, 6))
+    if magic != 42:
+        raise UnsupportedFileError('Invalid TIFF header')
+
+    ifd0_entries = _read_ifd(read, endianness, ifd0_offset)
+    if GPS_IFD_POINTER_TAG not in ifd0_entries:
+        return {}
+
+    gps_ifd_pointer = _read_value(
+        read, endianness, *ifd0_entries[GPS_IFD_POINTER_TAG])
+    if not isinstance(gps_ifd_pointer, list) or not gps_ifd_pointer:
+        raise UnsupportedFileError('Invalid GPS IFD pointer')
+    gps_ifd_offset = gps_ifd_pointer[0]
+    gps_ifd_entries = _read_ifd(read, endianness, gps_ifd_offset)
+
+    tags = {}
+    for tag_id, tag_name in GPS_TAGS.iteritems():
+        if tag_id in gps_ifd_entries:
+            value = _read_value(read, endianness, *gps_ifd_entries[tag_id])
+            tags[tag_name] = _convert_value(tag_name, value)
+    return tags
+
+
+def _read_ifd(read, endianness, offset):
+    """Read entries in an image file directory.
+
+    :param read: Function used to read data from the TIFF structure
+    :type read: callable
+    :param endianness: Byte order prefix for the struct module
+    :type endianness: str
+    :param offset: Position of the directory in the TIFF structure
+    :type offset: int
+    :returns: Field type, count and value/offset data for each tag
+    :rtype: dict(int, tuple(int, int, str))
+
+    """
+    entry_count = struct.unpack(endianness + 'H', read(offset, 2))[0]
+    data = read(offset + 2, 12 * entry_count)
+
+    entries = {}
+    for index in range(entry_count):
+        entry = data[12 * index:12 * (index + 1)]
+        tag_id, field_type, count = struct.unpack(
+            endianness + 'HHI', entry[:8])
+        entries[tag_id] = (field_type, count, entry[8:])
+    return entries
+
+
+def _read_value(read, endianness, field_type, count, value_data):
+    """Read the value of an image file directory entry.
+
+    :param read: Function used to read data from the TIFF structure
+    :type read: callable
+    :param endianness: Byte order prefix for the struct module
+    :type endianness: str
+    :param field_type: TIFF field type
+    :type field_type: int
+    :param count: Number of values
+    :type count: int
+    :param value_data: Value or offset to the value if it doesn't fit
+    :type value_data: str
+    :returns: String for ASCII fields or list of numbers otherwise
+    :rtype: unicode | list(int | float)
+
+    """
+    if field_type not in TYPE_SIZES:
+        raise UnsupportedFileError('Unknown TIFF field type')
+
+    length = TYPE_SIZES[field_type] * count
+    if length <= 4:
+        data = value_data[:length]
+    else:
+        data = read(struct.unpack(endianness + 'I', value_data)[0], length)
+
+    if field_type == ASCII_TYPE:
+        return data.split('\x00', 1)[0].decode('ascii')
+    if field_type == SHORT_TYPE:
+        return list(struct.unpack(endianness + 'H' * count, data))
+    if field_type == LONG_TYPE:
+        return list(struct.unpack(endianness + 'I' * count, data))
+    if field_type == RATIONAL_TYPE:
+        numbers = struct.unpack(endianness + 'I' * 2 * count, data)
+        if 0 in numbers[1::2]:
+            raise UnsupportedFileError('Invalid rational number')
+        return [
+            float(numerator) / denominator
+            for numerator, denominator in zip(numbers[::2], numbers[1::2])
+        ]
+    raise UnsupportedFileError('Unexpected TIFF field type')
+
+
+def _convert_value(tag_name, value):
+    """Convert value to the format used by exiftool with the -n option.
+
+    :param tag_name: Exiftool tag name
+    :type tag_name: str
+    :param value: Value read from the GPS image file directory
+    :type value: unicode | list(float)
+    :returns: Converted value
+    :rtype: unicode | float
+
+    """
+    numeric_tag_names = (
+        'EXIF:GPSLatitude', 'EXIF:GPSLongitude', 'EXIF:GPSTimeStamp')
+    if tag_name in numeric_tag_names and not isinstance(value, list):
+        raise UnsupportedFileError('Unexpected {} value'.format(tag_name))
+
+    if tag_name in ('EXIF:GPSLatitude', 'EXIF:GPSLongitude'):
+        return sum(
+            float(number) / 60 ** index
+            for index, number in enumerate(value[:3]))
+
+    if tag_name == 'EXIF:GPSTimeStamp':
+        seconds = sum(
+            float(number) * 60 ** (2 - index)
+            for index, number in enumerate(value[:3]))
+        # Round to nanoseconds before splitting, so that fractions that
+        # round up carry into the seconds, minutes and hours
+        seconds, fraction = divmod(int(round(seconds * 10 ** 9)), 10 ** 9)
+        hours, seconds = divmod(seconds, 3600)
+        minutes, seconds = divmod(seconds, 60)
+        fraction_str = (
+            '.{:09d}'.format(fraction).rstrip('0') if fraction else '')
+        return u'{:02d}:{:02d}:{:02d}{}'.format(
+            hours, minutes, seconds, fraction_str)
+
+    if tag_name == 'EXIF:GPSDateStamp' and isinstance(value, unicode):
+        match = DATE_REGEX.match(value)
+        if match:
+            return u':'.join(match.groups())
+
+    return value
@@ -0,0 +1,312 @@
+# -*- coding: utf-8 -*-
+"""Persistent cache of extracted EXIF metadata.
+
+Metadata is cached by file size, modification time and a hash of the
+beginning and the end of the file contents, not by path, so that files
+that have been moved, renamed or copied preserving their modification time
+don't need to be extracted again. Files without GPS tags are cached as
+well.
+
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+
+from sqlalchemy import (
+    Column,
+    Index,
+    Table,
+    bindparam,
+    func,
+    literal_column,
+    select,
+)
+from sqlalchemy.types import (
+    Float,
+    Integer,
+    String,
+)
+
+logger = logging.getLogger(__name__)
+
+# Number of bytes hashed from the beginning and from the end of each file.
+# EXIF metadata is stored at the beginning of JPEG files.
+HASH_BLOCK_SIZE = 64 * 1024
+
+# Maximum number of files in the cache before the least recently used ones
+# are evicted
+MAX_CACHE_ENTRIES = 1000000
+
+# Fraction of the maximum number of files evicted at once, so that files
+# aren't evicted every time a new one is added to a full cache
+EVICTION_FRACTION = 0.1
+
+# Maximum number of parameters in a single query
+MAX_QUERY_SIZES = 500
+
+# Version of the cached metadata. It must be increased whenever the way
+# metadata is extracted or validated changes, so that the entries cached by
+# older versions are ignored.
+CACHE_VERSION = 2
+
+
+class ExifCache(object):
+
+    """Cache of metadata records stored in the location database.
+
+    :param database: Location database
+    :type database: pic2map.db.LocationDB
+    :param max_entries: Maximum number of files in the cache
+    :type max_entries: int
+
+    """
+
+    def __init__(self, database, max_entries=MAX_CACHE_ENTRIES):
+        """Create cache table if needed."""
+        self.database = database
+        self.max_entries = max_entries
+        self.table = Table(
+            'exif_cache',
+            database.metadata,
+            Column('size', Integer, primary_key=True),
+            Column('mtime', Float, primary_key=True),
+            Column('digest', String, primary_key=True),
+            Column('metadata', String),
+            Column('version', Integer, nullable=False),
+            Column('last_used', Float, nullable=False),
+            Index('exif_cache_last_used', 'last_used'),
+            extend_existing=True,
+        )
+        self._drop_outdated_table()
+        self.table.create(bind=database.engine, checkfirst=True)
+        self.entry_count = self._count()
+        self.hits = self.misses = 0
+
+    def get(self, files):
+        """Get cached metadata records.
+
+        Files are looked up by size and modification time first, so that
+        only the ones that may be in the cache are hashed.
+
+        :param files: Picture filenames and their size and modification time
+        :type files: list(tuple(str, tuple(int, float)))
+        :returns:
+            Metadata records (None for files without GPS tags) for the
+            files found in the cache and the keys of the files that have
+            been hashed
+        :rtype: tuple(dict(str, dict(str) | None),
+            dict(str, tuple(int, float, str)))
+
+        """
+        table = self.table
+        cached_metadata = {}
+        sizes = sorted(set(size for _path, (size, _mtime) in files))
+        for index in range(0, len(sizes), MAX_QUERY_SIZES):
+            select_query = (
+                select([
+                    table.c.size,
+                    table.c.mtime,
+                    table.c.digest,
+                    table.c.metadata,
+                ])
+                .where(table.c.size.in_(sizes[index:index + MAX_QUERY_SIZES]))
+                .where(table.c.version == CACHE_VERSION)
+            )
+            for size, mtime, digest, metadata in (
+                    self.database.connection.execute(select_query)):
+                cached_metadata[(size, mtime, digest)] = metadata
+        cached_file_stats = set(
+            (size, mtime) for size, mtime, _digest in cached_metadata)
+
+        keys = {}
+        metadata_records = {}
+        for path, file_stat in files:
+            if file_stat not in cached_file_stats:
+                continue
+            key = file_key(path, file_stat)
+            if key is None:
+                continue
+            keys[path] = key
+            if key not in cached_metadata:
+                continue
+            metadata = cached_metadata[key]
+            if metadata is None:
+                metadata_records[path] = None
+            else:
+                metadata_records[path] = json.loads(metadata)
+                metadata_records[path]['SourceFile'] = path
+
+        self.hits += len(metadata_records)
+        self.misses += len(files) - len(metadata_records)
+        if metadata_records:
+            self._touch([keys[path] for path in metadata_records])
+        return metadata_records, keys
+
+    def put(self, files, metadata_records, keys=None):
+        """Add metadata records to the cache.
+
+        :param files: Picture filenames and their size and modification time
+        :type files: list(tuple(str, tuple(int, float)))
+        :param metadata_records:
+            Metadata records by path (None for files without GPS tags)
+        :type metadata_records: dict(str, dict(str) | None)
+        :param keys: Keys of files already hashed as returned by ``get``
+        :type keys: dict(str, tuple(int, float, str)) | None
+
+        """
+        keys = keys or {}
+        now = time.time()
+        rows = []
+        for path, file_stat in files:
+            if path not in metadata_records:
+                continue
+            key = keys.get(path) or file_key(path, file_stat)
+            if key is None:
+                continue
+
+            metadata_record = metadata_records[path]
+            if metadata_record is not None:
+                metadata_record = dict(metadata_record)
+                del metadata_record['SourceFile']
+                metadata_record = json.dumps(metadata_record)
+            size, mtime, digest = key
+            rows.append({
+                'size': size,
+                'mtime': mtime,
+                'digest': digest,
+                'metadata': metadata_record,
+                'version': CACHE_VERSION,
+                'last_used': now,
+            })
+        if not rows:
+            return
+
+        connection = self.database.connection
+        with connection.begin():
+            connection.execute(
+                self.table.insert().prefix_with('OR REPLACE'), rows)
+        self.entry_count += len(rows)
+        if self.entry_count > self.max_entries:
+            self._evict()
+
+    def _drop_outdated_table(self):
+        """Drop cache table from older versions so that it's recreated.
+
+        Older versions didn't store the version of the cached metadata.
+
+        """
+        engine = self.database.engine
+        if not engine.has_table('exif_cache'):
+            return
+        column_names = [
+            row[1] for row in engine.execute('PRAGMA table_info(exif_cache)')
+        ]
+        if 'version' in column_names:
+            return
+
+        logger.debug('Dropping outdated exif_cache table...')
+        engine.execute('DROP TABLE exif_cache')
+
+    def _touch(self, keys):
+        """Mark cache entries as used.
+
+        :param keys: Size, modification time and digest of each file
+        :type keys: list(tuple(int, float, str))
+
+        """
+        table = self.table
+        update_query = (
+            table.update()
+            .where(table.c.size == bindparam('key_size'))
+            .where(table.c.mtime == bindparam('key_mtime'))
+            .where(table.c.digest == bindparam('key_digest'))
+            .values(last_used=time.time())
+        )
+        connection = self.database.connection
+        with connection.begin():
+            connection.execute(update_query, [
+                {'key_size': size, 'key_mtime': mtime, 'key_digest': digest}
+                for size, mtime, digest in keys
+            ])
+
+    def _evict(self):
+        """Delete least recently used entries to make room for new ones."""
+        table = self.table
+        connection = self.database.connection
+        self.entry_count = self._count()
+        excess = (
+            self.entry_count - self.max_entries +
+            int(self.max_entries * EVICTION_FRACTION)
+        )
+        if excess <= 0:
+            return
+
+        rowid = literal_column('rowid')
+        oldest_query = (
+            select([rowid])
+            .select_from(table)
+            .order_by(table.c.last_used)
+            .limit(excess)
+        )
+        with connection.begin():
+            result = connection.execute(
+                table.delete().where(rowid.in_(oldest_query)))
+        self.entry_count -= result.rowcount
+        logger.debug('%d files evicted from EXIF cache', result.rowcount)
+
+    def _count(self):
+        """Get number of files in the cache.
+
+        :returns: Number of files
+        :rtype: int
+
+        """
+        return self.database.connection.execute(
+            select([func.count()]).select_from(self.table)).scalar()
+
+
+def file_key(path, file_stat):
+    """Get cache key for a file.
+
+    :param path: Path to the file
+    :type path: str
+    :param file_stat: File size and modification time
+    :type file_stat: tuple(int, float)
+    :returns:
+        Size, modification time and content digest or None if the file
+        couldn't be read
+    :rtype: tuple(int, float, str) | None
+
+    """
+    size, mtime = file_stat
+    digest = content_digest(path, size)
+    if digest is None:
+        return None
+    return size, mtime, digest
+
+
+def content_digest(path, size):
+    """Hash the beginning and the end of a file.
+
+    :param path: Path to the file
+    :type path: str
+    :param size: File size in bytes
+    :type size: int
+    :returns: Hexadecimal digest or None if the file couldn't be read
+    :rtype: str | None
+
+    """
+    content_hash = hashlib.sha1()
+    try:
+        with open(path, 'rb') as file_:
+            content_hash.update(file_.read(HASH_BLOCK_SIZE))
+            if size > 2 * HASH_BLOCK_SIZE:
+                file_.seek(-HASH_BLOCK_SIZE, os.SEEK_END)
+            content_hash.update(file_.read(HASH_BLOCK_SIZE))
+    except IOError as exception:
+        logger.warning('Unable to read file: %r (%s)', path, exception)
+        return None
+    return content_hash.hexdigest()
@@ -3,11 +3,111 @@
 
 import logging
 import os
+import Queue
+
+from multiprocessing.pool import ThreadPool
 
 import magic
 
+from scandir import scandir
+
 logger = logging.getLogger(__name__)
 
+# Extensions used by JPEG picture files
+JPEG_EXTENSIONS = frozenset([
+    '.jfif',
+    '.jpe',
+    '.jpeg',
+    '.jpg',
+])
+
+# Extensions used by files that are not JPEG pictures (videos, raw pictures,
+# sidecar files, ...) that are usually found in picture collections
+SKIPPED_EXTENSIONS = frozenset([
+    '.3gp', '.aae', '.arw', '.avi', '.bmp', '.cr2', '.cr3', '.crw', '.dng',
+    '.gif', '.gpx', '.heic', '.json', '.m2ts', '.m4v', '.mkv', '.mov',
+    '.mp4', '.mpg', '.mts', '.nef', '.orf', '.pef', '.png', '.psd', '.raf',
+    '.rw2', '.srw', '.thm', '.tif', '.tiff', '.txt', '.wav', '.webp', '.xmp',
+])
+
+# Maximum time in seconds to wait for a directory listing. Waiting with a
+# timeout keeps the main thread responsive to keyboard interrupts.
+WAIT_TIMEOUT = 24 * 60 * 60
+
+# Maximum number of directories listed in the background ahead of the one
+# being explored when files are returned in a deterministic order
+ORDERED_LOOKAHEAD = 64
+
+# Start of image marker followed by the first segment marker
+JPEG_SIGNATURE = '\xff\xd8\xff'
+
+
+def is_jpeg_by_extension(path):
+    """Detect JPEG files using only their extension.
+
+    :param path: Path to the file
+    :type path: str
+    :returns: Whether the file is a JPEG picture
+    :rtype: bool
+
+    """
+    return os.path.splitext(path)[1].lower() in JPEG_EXTENSIONS
+
+
+def is_jpeg_by_magic(path):
+    """Detect JPEG files using libmagic.
+
+    :param path: Path to the file
+    :type path: str
+    :returns: Whether the file is a JPEG picture
+    :rtype: bool
+
+    """
+    return 'JPEG image data' in magic.from_file(path)
+
+
+def is_jpeg_by_signature(path):
+    """Detect JPEG files using their extension and their first bytes.
+
+    Files with extensions known not to be used by JPEG pictures are never
+    opened. For the rest of them, the JPEG signature is checked and libmagic
+    is used only when it partially matches or when it doesn't match, but the
+    extension is a JPEG one.
+
+    :param path: Path to the file
+    :type path: str
+    :returns: Whether the file is a JPEG picture
+    :rtype: bool
+
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension in SKIPPED_EXTENSIONS:
+        return False
+
+    try:
+        with open(path, 'rb') as file_:
+            signature = file_.read(len(JPEG_SIGNATURE))
+    except IOError as exception:
+        logger.warning('Unable to read file: %r (%s)', path, exception)
+        return False
+
+    if signature == JPEG_SIGNATURE:
+        return True
+
+    if (signature.startswith(JPEG_SIGNATURE[:2]) or
+            extension in JPEG_EXTENSIONS):
+        return is_jpeg_by_magic(path)
+
+    return False
+
+
+# Functions that can be used to detect JPEG files
+DETECTORS = {
+    'extension': is_jpeg_by_extension,
+    'magic': is_jpeg_by_magic,
+    'signature': is_jpeg_by_signature,
+}
+
 
 class TreeExplorer(object):
 
@@ -15,12 +115,25 @@ class TreeExplorer(object):
 
     :param directory: Base directory for the tree to be explored.
     :type directory: str
+    :param detection:
+        Method used to detect JPEG files. One of the keys in ``DETECTORS``.
+    :type detection: str
+    :param threads: Number of threads used to list directories in parallel
+    :type threads: int
+    :param ordered:
+        Whether files should be returned in a deterministic order, that is,
+        sorted by their path components
+    :type ordered: bool
 
     """
 
-    def __init__(self, directory):
+    def __init__(self, directory, detection='signature', threads=1,
+                 ordered=False):
         """Initialize tree explorer."""
         self.directory = directory
+        self.is_jpeg = DETECTORS[detection]
+        self.threads = threads
+        self.ordered = ordered
 
     def paths(self):
         """Return paths to picture files found under directory.
@@ -29,35 +142,219 @@ class TreeExplorer(object):
         :rtype: list(str)
 
         """
-        paths = self._explore()
+        return list(self.iter_paths())
+
+    def iter_paths(self):
+        """Yield paths to picture files while the directory is explored.
+
+        :return: Paths to picture files
+        :rtype: iterator(str)
+
+        """
+        for path, _file_stat in self.iter_files():
+            yield path
+
+    def iter_files(self):
+        """Yield picture files and their stat information.
+
+        The size and modification time are taken from the stat call made
+        while exploring the directory, so that later stages don't need to
+        call stat again to detect changes in files.
+
+        :return: Paths to picture files and their size and modification time
+        :rtype: iterator(tuple(str, tuple(int, float)))
+
+        """
+        if self.ordered:
+            files = self._explore_ordered()
+        elif self.threads > 1:
+            files = self._explore_parallel()
+        else:
+            files = self._explore()
+
+        file_count = 0
+        for path, stat in files:
+            file_count += 1
+            yield path, (stat.st_size, stat.st_mtime)
+
         logger.info(
             '%d picture files found under %s',
-            len(paths),
+            file_count,
             self.directory)
 
-        return paths
-
     def _explore(self):
-        """Walk from base directory and return files that match pattern.
+        """Walk from base directory and yield files that match pattern.
 
-        :returns: Image files found under directory
-        :rtype: list(str)
+        :returns: Image files found under directory and their stat result
+        :rtype: iterator(tuple(str, posix.stat_result))
+
+        """
+        directories = [self.directory]
+        while directories:
+            entries = self._list_directory(directories.pop())
+
+            subdirectories = []
+            for is_directory, path, stat in entries:
+                if is_directory:
+                    subdirectories.append(path)
+                else:
+                    yield path, stat
+
+            # Explore subdirectories in the same order they were listed
+            directories.extend(reversed(subdirectories))
+
+    def _explore_parallel(self):
+        """Walk from base directory listing directories in parallel.
+
+        Files are returned as soon as the directory they belong to has been
+        listed, so their order depends on how fast each directory is listed.
+
+        :returns: Image files found under directory and their stat result
+        :rtype: iterator(tuple(str, posix.stat_result))
+
+        """
+        listings = Queue.Queue()
+        thread_pool = ThreadPool(self.threads)
+
+        def list_directory(dirpath):
+            """List directory and queue the result or the exception."""
+            try:
+                listings.put((self._list_directory(dirpath), None))
+            except Exception as exception:  # pylint:disable=broad-except
+                listings.put((None, exception))
+
+        try:
+            thread_pool.apply_async(list_directory, (self.directory,))
+            pending_count = 1
+            while pending_count:
+                entries, exception = listings.get(True, WAIT_TIMEOUT)
+                pending_count -= 1
+                if exception is not None:
+                    raise exception
+
+                for is_directory, path, stat in entries:
+                    if is_directory:
+                        thread_pool.apply_async(list_directory, (path,))
+                        pending_count += 1
+                    else:
+                        yield path, stat
+        finally:
+            thread_pool.terminate()
+
+    def _explore_ordered(self):
+        """Walk from base directory and yield files in a deterministic order.
+
+        Files are sorted by their path components (that is, a depth first
+        traversal with entries sorted by name). The next subdirectories to
+        be explored are listed in the background, but only up to
+        ``ORDERED_LOOKAHEAD`` of them at a time, so that the memory used
+        doesn't depend on the size of the tree.
+
+        :returns: Image files found under directory and their stat result
+        :rtype: iterator(tuple(str, posix.stat_result))
 
         """
-        paths = []
-        for (dirpath, _dirnames, filenames) in os.walk(self.directory):
-            logger.debug('Exploring %s...', dirpath)
+        thread_pool = ThreadPool(self.threads)
+
+        # Entries of every directory being explored, the position of the
+        # next entry to return and the position of the next one to check
+        # for listing in the background
+        stack = []
+        listings = {}
+
+        def list_ahead():
+            """Start listing the next subdirectories to be explored."""
+            for frame in reversed(stack):
+                entries = frame['entries']
+                frame['ahead'] = max(frame['ahead'], frame['next'])
+                while frame['ahead'] < len(entries):
+                    if len(listings) >= ORDERED_LOOKAHEAD:
+                        return
+                    is_directory, path, _stat = entries[frame['ahead']]
+                    frame['ahead'] += 1
+                    if is_directory:
+                        listings[path] = thread_pool.apply_async(
+                            self._list_directory, (path,))
 
-            # Check if any filename is a picture file
-            for filename in filenames:
-                path = os.path.join(dirpath, filename).decode('utf8')
+        def enter(entries):
+            """Start exploring the entries of a directory."""
+            stack.append({'entries': entries, 'next': 0, 'ahead': 0})
+            list_ahead()
 
-                # Skip missing files like broken symbolic links
-                if not os.path.isfile(path):
-                    logger.warning('Unable to access file: %r', path)
+        try:
+            enter(self._list_directory(self.directory))
+            while stack:
+                frame = stack[-1]
+                if frame['next'] == len(frame['entries']):
+                    stack.pop()
                     continue
 
-                if 'JPEG image data' in magic.from_file(path):
-                    paths.append(path)
+                is_directory, path, stat = frame['entries'][frame['next']]
+                frame['next'] += 1
+                if not is_directory:
+                    yield path, stat
+                    continue
+
+                listing = listings.pop(path, None)
+                if listing is None:
+                    enter(self._list_directory(path))
+                else:
+                    enter(listing.get(WAIT_TIMEOUT))
+        finally:
+            thread_pool.terminate()
+
+    def _list_directory(self, dirpath):
+        """List directory entries and get files that match pattern.
+
+        Directory entries are used to avoid additional stat calls to check
+        whether each entry is a file or a directory. Symbolic links to
+        directories are not followed.
+
+        :param dirpath: Directory to list
+        :type dirpath: str | unicode
+        :returns:
+            Whether each entry is a directory, its path and its stat result
+            (only for image files)
+        :rtype: list(tuple(bool, str, posix.stat_result | None))
+
+        """
+        logger.debug('Exploring %s...', dirpath)
+        try:
+            entries = list(scandir(dirpath))
+        except OSError as exception:
+            logger.warning(
+                'Unable to explore directory: %r (%s)', dirpath, exception)
+            return []
+
+        if self.ordered:
+            entries.sort(key=lambda entry: entry.name)
+
+        result = []
+        for entry in entries:
+            if entry.is_dir():
+                if not entry.is_symlink():
+                    result.append((True, entry.path, None))
+                continue
+
+            # Paths are returned as unicode when the directory listed is
+            # unicode (for example, when it comes from the database)
+            path = entry.path
+            if isinstance(path, str):
+                path = path.decode('utf8')
+
+            # Skip missing files like broken symbolic links
+            if not entry.is_file():
+                logger.warning('Unable to access file: %r', path)
+                continue
+
+            if not self.is_jpeg(path):
+                continue
+
+            try:
+                stat = entry.stat()
+            except OSError:
+                logger.warning('Unable to access file: %r', path)
+                continue
 
-        return paths
+            result.append((False, path, stat))
+        return result
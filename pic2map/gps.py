@@ -1,6 +1,11 @@
 # -*- coding: utf-8 -*-
 """GPS data model and validation."""
 import logging
+import Queue
+
+from collections import deque
+from itertools import chain
+from multiprocessing.pool import ThreadPool
 
 import exiftool
 
@@ -14,6 +19,12 @@ from voluptuous import (
     Schema,
 )
 
+from pic2map.exif import (
+    SUPPORTED_TAGS as NATIVE_SUPPORTED_TAGS,
+    read_gps_tags,
+)
+from pic2map.util import chunks
+
 logger = logging.getLogger(__name__)
 
 # Interesting tags with GPS information
@@ -26,6 +37,9 @@ TAGS = [
     'EXIF:GPSTimeStamp',
 ]
 
+# Number of files sent to an exiftool process in a single request
+CHUNK_SIZE = 100
+
 POSITIVE_NUMBER = All(Any(int, float), Range(min=0))
 
 SCHEMA = Schema({
@@ -58,22 +72,218 @@ def validate_gps_metadata(exif_metadata):
     return True
 
 
-def filter_gps_metadata(paths):
+class ExifToolPool(object):
+
+    """Pool of long-lived exiftool processes.
+
+    Paths are split in chunks that are sent in parallel to the exiftool
+    processes, so that more than one core is used to extract metadata.
+
+    Unless disabled, the native reader is tried first and exiftool is used
+    only for the files it cannot parse. Exiftool processes are launched the
+    first time they are needed.
+
+    :param processes: Maximum number of exiftool processes to launch
+    :type processes: int
+    :param native: Whether to try the native reader first
+    :type native: bool
+
+    """
+
+    def __init__(self, processes, native=True):
+        """Initialize pool."""
+        self.processes = processes
+        self.native = native
+        self.tools = Queue.Queue()
+        self.thread_pool = None
+
+    def __enter__(self):
+        """Create worker threads on entering context."""
+        # Exiftool processes are launched lazily
+        for _ in range(self.processes):
+            self.tools.put(None)
+        self.thread_pool = ThreadPool(self.processes)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Terminate exiftool processes on exiting context."""
+        self.thread_pool.close()
+        self.thread_pool.join()
+        while not self.tools.empty():
+            tool = self.tools.get()
+            if tool is not None:
+                tool.terminate()
+
+    def get_tags_batch(self, tags, paths, chunk_size=CHUNK_SIZE):
+        """Get tags from a list of files.
+
+        :param tags: Tags to retrieve from each file
+        :type tags: list(str)
+        :param paths: Picture filenames to get metadata from
+        :type paths: list(str)
+        :param chunk_size: Number of files sent to a process at once
+        :type chunk_size: int
+        :returns: Metadata records in the same order as the chunks
+        :rtype: list(dict(str))
+
+        """
+        return [
+            metadata_record
+            for metadata_records in self.iter_tags(
+                tags, chunks(paths, chunk_size))
+            for metadata_record in metadata_records
+        ]
+
+    def iter_tags(self, tags, path_chunks):
+        """Get tags from chunks of files as they are being generated.
+
+        Only a few chunks per process are in flight at any time, so the
+        chunks generator isn't consumed faster than metadata is extracted.
+
+        :param tags: Tags to retrieve from each file
+        :type tags: list(str)
+        :param path_chunks: Chunks of picture filenames
+        :type path_chunks: iterator(list(str))
+        :returns: Metadata records for each chunk in the same order
+        :rtype: iterator(list(dict(str)))
+
+        """
+        max_pending = 2 * self.processes
+        pending = deque()
+        for paths in path_chunks:
+            pending.append(
+                self.thread_pool.apply_async(
+                    self._get_tags_chunk, (tags, paths)))
+            if len(pending) >= max_pending:
+                yield pending.popleft().get()
+
+        while pending:
+            yield pending.popleft().get()
+
+    def _get_tags_chunk(self, tags, paths):
+        """Get tags from a chunk of files.
+
+        :param tags: Tags to retrieve from each file
+        :type tags: list(str)
+        :param paths: Picture filenames to get metadata from
+        :type paths: list(str)
+        :returns: Metadata records in the same order as the paths
+        :rtype: list(dict(str))
+
+        """
+        metadata_records = [None] * len(paths)
+        fallback_indexes = range(len(paths))
+        if self.native and NATIVE_SUPPORTED_TAGS.issuperset(tags):
+            fallback_indexes = []
+            for index, path in enumerate(paths):
+                metadata_record = read_gps_tags(path)
+                if metadata_record is None:
+                    fallback_indexes.append(index)
+                else:
+                    metadata_records[index] = metadata_record
+
+        if fallback_indexes:
+            tool = self.tools.get()
+            try:
+                if tool is None:
+                    logger.debug('Launching exiftool process...')
+                    tool = exiftool.ExifTool()
+                    try:
+                        tool.start()
+                    except Exception:
+                        # Return an empty slot, so that the process is
+                        # launched again next time
+                        tool = None
+                        raise
+                fallback_records = tool.get_tags_batch(
+                    tags, [paths[index] for index in fallback_indexes])
+            finally:
+                self.tools.put(tool)
+
+            if len(fallback_records) == len(fallback_indexes):
+                for index, metadata_record in zip(
+                        fallback_indexes, fallback_records):
+                    metadata_records[index] = metadata_record
+            else:
+                # Exiftool doesn't return a record for the files it cannot
+                # read, so records are matched by filename instead
+                fallback_positions = dict(
+                    (paths[index], index) for index in fallback_indexes)
+                for metadata_record in fallback_records:
+                    index = fallback_positions.get(
+                        metadata_record.get('SourceFile'))
+                    if index is not None:
+                        metadata_records[index] = metadata_record
+                metadata_records = [
+                    metadata_record
+                    for metadata_record in metadata_records
+                    if metadata_record is not None
+                ]
+
+        return metadata_records
+
+
+def filter_gps_metadata(paths, jobs=1, native=True):
     """Filter out metadata records that don't have GPS information.
 
     :param paths: Picture filenames to get metadata from
     :type paths: list(str)
+    :param jobs: Number of exiftool processes to use
+    :type jobs: int
+    :param native: Whether to try the native reader before exiftool
+    :type native: bool
     :returns: Picture files with GPS data
     :rtype: list(dict(str))
 
     """
-    with exiftool.ExifTool() as tool:
-        metadata_records = tool.get_tags_batch(TAGS, paths)
+    return list(iter_gps_metadata(paths, jobs, native=native))
+
 
-    gps_metadata_records = [
-        metadata_record
-        for metadata_record in metadata_records
-        if validate_gps_metadata(metadata_record)
-    ]
+def iter_gps_metadata(paths, jobs=1, chunk_size=CHUNK_SIZE, native=True):
+    """Yield metadata records with GPS information as they are extracted.
+
+    :param paths: Picture filenames to get metadata from
+    :type paths: list(str) | iterator(str)
+    :param jobs: Number of exiftool processes to use
+    :type jobs: int
+    :param chunk_size: Number of files sent to a process at once
+    :type chunk_size: int
+    :param native: Whether to try the native reader before exiftool
+    :type native: bool
+    :returns: Picture files with GPS data
+    :rtype: iterator(dict(str))
+
+    """
+    path_chunks = chunks(paths, chunk_size)
+    for metadata_records in iter_metadata_chunks(
+            path_chunks, jobs, native=native):
+        for metadata_record in metadata_records:
+            if validate_gps_metadata(metadata_record):
+                yield metadata_record
+
+
+def iter_metadata_chunks(path_chunks, jobs=1, native=True):
+    """Yield GPS tags for each chunk of files as they are extracted.
+
+    :param path_chunks: Chunks of picture filenames
+    :type path_chunks: iterator(list(str))
+    :param jobs: Number of exiftool processes to use
+    :type jobs: int
+    :param native: Whether to try the native reader before exiftool
+    :type native: bool
+    :returns: Metadata records for each chunk in the same order
+    :rtype: iterator(list(dict(str)))
+
+    """
+    path_chunks = iter(path_chunks)
+
+    # Don't launch any exiftool process if there are no paths at all
+    try:
+        first_chunk = next(path_chunks)
+    except StopIteration:
+        return
 
-    return gps_metadata_records
+    with ExifToolPool(jobs, native) as pool:
+        for metadata_records in pool.iter_tags(
+                TAGS, chain([first_chunk], path_chunks)):
+            yield metadata_records
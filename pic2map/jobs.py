@@ -0,0 +1,459 @@
+# -*- coding: utf-8 -*-
+"""Indexing jobs.
+
+Directories to index are queued as jobs in the location database and run
+by a worker that keeps their progress up to date, so that it can be
+queried while they run. Files are walked in a deterministic order and the
+last file processed is stored as a checkpoint, so that a job that has been
+interrupted is resumed from where it stopped.
+
+"""
+
+import errno
+import json
+import logging
+import os
+import time
+
+from itertools import dropwhile
+
+from sqlalchemy import (
+    Column,
+    Table,
+    and_,
+    or_,
+    select,
+)
+from sqlalchemy.types import (
+    Float,
+    Integer,
+    String,
+)
+
+from pic2map.db import INSERT_CHUNK_SIZE
+from pic2map.exif_cache import ExifCache
+from pic2map.fs import TreeExplorer
+from pic2map.pipeline import (
+    extract_gps_metadata_chunks,
+    skip_unchanged_files,
+    transform_to_rows,
+)
+
+logger = logging.getLogger(__name__)
+
+# Job states
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# Options used to run a job when not passed explicitly
+DEFAULT_OPTIONS = {
+    'detection': 'signature',
+    'incremental': False,
+    'jobs': 1,
+    'no_sync': False,
+    'walk_threads': 1,
+}
+
+
+class JobQueue(object):
+
+    """Queue of indexing jobs stored in the location database.
+
+    :param database: Location database
+    :type database: pic2map.db.LocationDB
+
+    """
+
+    def __init__(self, database):
+        """Create job table if needed."""
+        self.database = database
+        self.table = Table(
+            'index_job',
+            database.metadata,
+            Column('id', Integer, primary_key=True),
+            Column('directory', String, nullable=False),
+            Column('options', String, nullable=False),
+            Column('state', String, nullable=False),
+            Column('pid', Integer),
+            Column('created', Float, nullable=False),
+            Column('updated', Float, nullable=False),
+            Column('elapsed', Float, nullable=False, default=0.0),
+            Column('checkpoint', String),
+            Column('files_seen', Integer, nullable=False, default=0),
+            Column('files_extracted', Integer, nullable=False, default=0),
+            Column('rows_inserted', Integer, nullable=False, default=0),
+            Column('rows_updated', Integer, nullable=False, default=0),
+            Column('rows_unchanged', Integer, nullable=False, default=0),
+            Column('error', String),
+            extend_existing=True,
+        )
+        self.table.create(bind=database.engine, checkfirst=True)
+
+    def submit(self, directory, options=None):
+        """Add job to the queue.
+
+        :param directory: Directory to index
+        :type directory: str | unicode
+        :param options: Options used to run the job (see ``DEFAULT_OPTIONS``)
+        :type options: dict(str) | None
+        :returns: Job identifier
+        :rtype: int
+
+        """
+        # Directories are stored as unicode like the paths under them
+        if isinstance(directory, str):
+            directory = directory.decode('utf8')
+
+        job_options = dict(DEFAULT_OPTIONS)
+        job_options.update(options or {})
+        now = time.time()
+        result = self.database.connection.execute(
+            self.table.insert(),
+            directory=directory,
+            options=json.dumps(job_options, sort_keys=True),
+            state=PENDING,
+            created=now,
+            updated=now,
+        )
+        job_id = result.inserted_primary_key[0]
+        logger.debug('Job %d submitted to index %r', job_id, directory)
+        return job_id
+
+    def get(self, job_id):
+        """Get job.
+
+        :param job_id: Job identifier
+        :type job_id: int
+        :returns: Job row or None if not found
+        :rtype: sqlalchemy.engine.result.RowProxy | None
+
+        """
+        select_query = select([self.table]).where(self.table.c.id == job_id)
+        return self.database.connection.execute(select_query).first()
+
+    def jobs(self, limit=None):
+        """Get jobs, most recent first.
+
+        :param limit: Maximum number of jobs to return
+        :type limit: int | None
+        :returns: Job rows
+        :rtype: list(sqlalchemy.engine.result.RowProxy)
+
+        """
+        select_query = select([self.table]).order_by(self.table.c.id.desc())
+        if limit is not None:
+            select_query = select_query.limit(limit)
+        return self.database.connection.execute(select_query).fetchall()
+
+    def claim(self, job_id=None):
+        """Mark the oldest job that can be run as run by this process.
+
+        Jobs that can be run are the pending ones and the ones marked as
+        running by a process that doesn't exist anymore, which are resumed.
+
+        :param job_id: Identifier of the job to claim, if a specific job
+            should be claimed
+        :type job_id: int | None
+        :returns: Claimed job row or None if there are no jobs to run
+        :rtype: sqlalchemy.engine.result.RowProxy | None
+
+        """
+        table = self.table
+        select_query = (
+            select([table])
+            .where(table.c.state.in_([PENDING, RUNNING]))
+            .order_by(table.c.id)
+        )
+        if job_id is not None:
+            select_query = select_query.where(table.c.id == job_id)
+
+        connection = self.database.connection
+        with connection.begin():
+            for job in connection.execute(select_query).fetchall():
+                if job['state'] == RUNNING and _process_exists(job['pid']):
+                    continue
+
+                # The state and process are checked again in case another
+                # worker claimed the job in the meantime
+                update_query = (
+                    table.update()
+                    .where(and_(
+                        table.c.id == job['id'],
+                        table.c.state == job['state'],
+                        or_(
+                            table.c.pid == job['pid'],
+                            table.c.pid.is_(None),
+                        ),
+                    ))
+                    .values(
+                        state=RUNNING, pid=os.getpid(), updated=time.time())
+                )
+                if connection.execute(update_query).rowcount:
+                    if job['state'] == RUNNING:
+                        logger.info(
+                            'Resuming job %d after %r',
+                            job['id'], job['checkpoint'])
+                    return self.get(job['id'])
+        return None
+
+    def update(self, job_id, **values):
+        """Update job.
+
+        :param job_id: Job identifier
+        :type job_id: int
+        :param values: Column values to update
+
+        """
+        values['updated'] = time.time()
+        self.database.connection.execute(
+            self.table.update()
+            .where(self.table.c.id == job_id)
+            .values(**values))
+
+    def expected_file_count(self, job):
+        """Get number of files that a job is expected to find.
+
+        The number of files found by the last job that indexed the same
+        directory is used as an estimate.
+
+        :param job: Job row
+        :type job: sqlalchemy.engine.result.RowProxy
+        :returns: Expected number of files or None if unknown
+        :rtype: int | None
+
+        """
+        table = self.table
+        select_query = (
+            select([table.c.files_seen])
+            .where(and_(
+                table.c.directory == job['directory'],
+                table.c.state == DONE,
+                table.c.id != job['id'],
+            ))
+            .order_by(table.c.id.desc())
+            .limit(1)
+        )
+        return self.database.connection.execute(select_query).scalar()
+
+
+def run_job(database, job_queue, job):
+    """Index the files in the directory of a job.
+
+    Rows are upserted in chunks of up to ``INSERT_CHUNK_SIZE`` rows or
+    files extracted, and progress is stored in the job after every chunk.
+
+    :param database: Location database
+    :type database: pic2map.db.LocationDB
+    :param job_queue: Queue the job belongs to
+    :type job_queue: JobQueue
+    :param job: Job row as returned by ``JobQueue.claim``
+    :type job: sqlalchemy.engine.result.RowProxy
+    :returns: Job row after running it
+    :rtype: sqlalchemy.engine.result.RowProxy
+
+    """
+    job_id = job['id']
+    directory = job['directory']
+    options = json.loads(job['options'])
+    logger.info('Running job %d to index %r...', job_id, directory)
+
+    counters = {
+        'files_seen': job['files_seen'],
+        'files_extracted': job['files_extracted'],
+        'rows_inserted': job['rows_inserted'],
+        'rows_updated': job['rows_updated'],
+        'rows_unchanged': job['rows_unchanged'],
+    }
+    previous_elapsed = job['elapsed']
+    start = time.time()
+
+    def count_seen(files):
+        """Count files found while walking the tree."""
+        for file_ in files:
+            counters['files_seen'] += 1
+            yield file_
+
+    def flush(rows, file_count, checkpoint):
+        """Upsert rows and store progress up to the checkpoint."""
+        upsert_counts = database.upsert(rows)
+        counters['files_extracted'] += file_count
+        counters['rows_inserted'] += upsert_counts.inserted
+        counters['rows_updated'] += upsert_counts.updated
+        counters['rows_unchanged'] += upsert_counts.unchanged
+        job_queue.update(
+            job_id,
+            checkpoint=checkpoint,
+            elapsed=previous_elapsed + time.time() - start,
+            **counters)
+
+    # The directory is listed as an encoded string, so that it doesn't
+    # depend on the filesystem encoding of the locale
+    tree_explorer = TreeExplorer(
+        directory.encode('utf8'),
+        options['detection'],
+        threads=options['walk_threads'],
+        ordered=True,
+    )
+    cache = ExifCache(database)
+    try:
+        with database.bulk_load(synchronous=not options['no_sync']):
+            files = skip_processed_files(
+                tree_explorer.iter_files(), directory, job['checkpoint'])
+            files = count_seen(files)
+            if options['incremental']:
+                files = skip_unchanged_files(database, files)
+
+            # Extracted chunks are small, so their rows are grouped to be
+            # upserted in bigger transactions
+            rows = []
+            file_count = 0
+            for files_chunk, gps_metadata_files in extract_gps_metadata_chunks(
+                    files, options['jobs'], cache=cache):
+                rows.extend(transform_to_rows(gps_metadata_files))
+                file_count += len(files_chunk)
+                checkpoint = files_chunk[-1][0]
+                if (len(rows) >= INSERT_CHUNK_SIZE or
+                        file_count >= INSERT_CHUNK_SIZE):
+                    flush(rows, file_count, checkpoint)
+                    rows = []
+                    file_count = 0
+            if file_count:
+                flush(rows, file_count, checkpoint)
+    except Exception as exception:
+        error = _error_message(exception)
+        logger.error('Job %d failed: %s', job_id, error)
+        job_queue.update(
+            job_id,
+            state=FAILED,
+            error=error,
+            elapsed=previous_elapsed + time.time() - start,
+            **counters)
+        raise
+
+    job_queue.update(
+        job_id,
+        state=DONE,
+        elapsed=previous_elapsed + time.time() - start,
+        **counters)
+    return job_queue.get(job_id)
+
+
+def skip_processed_files(files, directory, checkpoint):
+    """Skip files processed before a job was interrupted.
+
+    Files must be walked in the same deterministic order as in the
+    interrupted run, that is, sorted by their path components.
+
+    :param files: Picture filenames and their size and modification time
+    :type files: iterator(tuple(str, tuple(int, float)))
+    :param directory: Directory being indexed
+    :type directory: str
+    :param checkpoint: Last file processed or None if no file was processed
+    :type checkpoint: str | None
+    :returns: Files after the checkpoint
+    :rtype: iterator(tuple(str, tuple(int, float)))
+
+    """
+    if checkpoint is None:
+        return files
+
+    checkpoint_key = _path_key(checkpoint, directory)
+
+    def processed(file_):
+        """Check whether file was walked before the checkpoint."""
+        path, _file_stat = file_
+        return _path_key(path, directory) <= checkpoint_key
+
+    return dropwhile(processed, files)
+
+
+def job_progress(job, expected_file_count=None):
+    """Get progress information for a job.
+
+    :param job: Job row
+    :type job: sqlalchemy.engine.result.RowProxy
+    :param expected_file_count: Number of files the job is expected to find
+    :type expected_file_count: int | None
+    :returns:
+        Job counters, its rate in files per second and the estimated time
+        to finish in seconds, if it can be estimated
+    :rtype: dict(str)
+
+    """
+    progress = {
+        key: job[key]
+        for key in [
+            'id',
+            'directory',
+            'state',
+            'elapsed',
+            'files_seen',
+            'files_extracted',
+            'rows_inserted',
+            'rows_updated',
+            'rows_unchanged',
+            'error',
+        ]
+    }
+    rate = job['files_seen'] / job['elapsed'] if job['elapsed'] else None
+    progress['rate'] = rate
+
+    eta = None
+    if job['state'] == DONE:
+        eta = 0.0
+    elif rate and expected_file_count is not None:
+        eta = max(expected_file_count - job['files_seen'], 0) / rate
+    progress['eta'] = eta
+    return progress
+
+
+def _path_key(path, directory):
+    """Get key used to sort paths in the same order as they are walked.
+
+    :param path: Path under directory
+    :type path: str
+    :param directory: Base directory
+    :type directory: str
+    :returns: Path components relative to the directory
+    :rtype: tuple(str)
+
+    """
+    return tuple(os.path.relpath(path, directory).split(os.sep))
+
+
+def _error_message(exception):
+    """Get message of an exception as unicode.
+
+    Messages may be unicode or encoded strings, such as those that include
+    a path, and both may be non-ASCII.
+
+    :param exception: Exception raised while running a job
+    :type exception: Exception
+    :returns: Exception message
+    :rtype: unicode
+
+    """
+    try:
+        return unicode(exception)
+    except UnicodeDecodeError:
+        return str(exception).decode('utf8', 'replace')
+
+
+def _process_exists(pid):
+    """Check whether a process exists.
+
+    :param pid: Process identifier
+    :type pid: int | None
+    :returns: Whether the process exists
+    :rtype: bool
+
+    """
+    if pid is None:
+        return False
+    try:
+        os.kill(pid, 0)
+    except OSError as exception:
+        return exception.errno == errno.EPERM
+    return True
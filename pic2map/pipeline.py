@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""Indexing pipeline.
+
+Every stage is a generator, so picture files are walked, extracted and
+upserted in bounded chunks instead of building whole-tree lists in memory.
+
+"""
+
+import logging
+
+from collections import deque
+
+from pic2map.db import (
+    UpsertCounts,
+    transform_metadata_to_row,
+)
+from pic2map.gps import (
+    CHUNK_SIZE as EXTRACT_CHUNK_SIZE,
+    TAGS as GPS_TAGS,
+    iter_metadata_chunks,
+    validate_gps_metadata,
+)
+from pic2map.util import chunks
+
+logger = logging.getLogger(__name__)
+
+# Number of rows checked/upserted in the database at once
+CHUNK_SIZE = 1000
+
+
+def skip_unchanged_files(database, files, chunk_size=CHUNK_SIZE):
+    """Skip files already in the database that haven't been modified.
+
+    Rows for files that have been modified are deleted, so that they can be
+    inserted again with the new metadata.
+
+    :param database: Location database
+    :type database: pic2map.db.LocationDB
+    :param files: Picture filenames and their size and modification time
+    :type files: iterator(tuple(str, tuple(int, float)))
+    :param chunk_size: Number of files checked in the database at once
+    :type chunk_size: int
+    :returns: New or modified files
+    :rtype: iterator(tuple(str, tuple(int, float)))
+
+    """
+    for files_chunk in chunks(files, chunk_size):
+        indexed_file_stats = database.file_stats(
+            [path for path, _file_stat in files_chunk])
+        changed_files = [
+            (path, file_stat)
+            for path, file_stat in files_chunk
+            if indexed_file_stats.get(path) != file_stat
+        ]
+        logger.debug(
+            '%d picture files unchanged since last scan',
+            len(files_chunk) - len(changed_files))
+
+        # Rows for modified files are replaced with the new metadata
+        database.delete_files([
+            path
+            for path, _file_stat in changed_files
+            if path in indexed_file_stats
+        ])
+
+        for changed_file in changed_files:
+            yield changed_file
+
+
+def extract_gps_metadata(files, jobs=1, chunk_size=EXTRACT_CHUNK_SIZE,
+                         cache=None):
+    """Extract GPS metadata from files and filter out the ones without it.
+
+    :param files: Picture filenames and their size and modification time
+    :type files: iterator(tuple(str, tuple(int, float)))
+    :param jobs: Number of exiftool processes to use
+    :type jobs: int
+    :param chunk_size: Number of files sent to an exiftool process at once
+    :type chunk_size: int
+    :param cache: Cache used to avoid extracting metadata again
+    :type cache: pic2map.exif_cache.ExifCache | None
+    :returns: GPS metadata and size and modification time for each file
+    :rtype: iterator(tuple(dict(str), tuple(int, float)))
+
+    """
+    for _files_chunk, gps_metadata_files in extract_gps_metadata_chunks(
+            files, jobs, chunk_size, cache):
+        for gps_metadata_file in gps_metadata_files:
+            yield gps_metadata_file
+
+
+def extract_gps_metadata_chunks(files, jobs=1, chunk_size=EXTRACT_CHUNK_SIZE,
+                                cache=None):
+    """Extract GPS metadata from files chunk by chunk.
+
+    This is like ``extract_gps_metadata``, but every chunk of files is
+    returned along with the GPS metadata found in it, so that callers know
+    which files have already been processed.
+
+    When a cache is passed, only the files that aren't in it are sent to
+    exiftool and the metadata extracted from them is added to it.
+
+    :param files: Picture filenames and their size and modification time
+    :type files: iterator(tuple(str, tuple(int, float)))
+    :param jobs: Number of exiftool processes to use
+    :type jobs: int
+    :param chunk_size: Number of files sent to an exiftool process at once
+    :type chunk_size: int
+    :param cache: Cache used to avoid extracting metadata again
+    :type cache: pic2map.exif_cache.ExifCache | None
+    :returns:
+        Chunks of files and GPS metadata and size and modification time for
+        the files in each chunk that have it
+    :rtype: iterator(tuple(list(tuple(str, tuple(int, float))),
+        list(tuple(dict(str), tuple(int, float)))))
+
+    """
+    # Chunks being processed in the same order as they are sent to the
+    # exiftool processes, along with their cache keys and cached metadata
+    pending_chunks = deque()
+
+    def path_chunks():
+        """Split files in chunks and keep track of them."""
+        for files_chunk in chunks(files, chunk_size):
+            cached_records = {}
+            keys = {}
+            if cache is not None:
+                cached_records, keys = cache.get(files_chunk)
+            pending_chunks.append((files_chunk, keys, cached_records))
+
+            # Chunks are sent even if they are empty to keep them in order
+            yield [
+                path
+                for path, _file_stat in files_chunk
+                if path not in cached_records
+            ]
+
+    for metadata_records in iter_metadata_chunks(path_chunks(), jobs):
+        files_chunk, keys, cached_records = pending_chunks.popleft()
+        extracted_records = {}
+        cacheable_records = {}
+        for metadata_record in metadata_records:
+            source_file = metadata_record['SourceFile']
+            if isinstance(source_file, str):
+                metadata_record = dict(
+                    metadata_record, SourceFile=source_file.decode('utf8'))
+
+            if validate_gps_metadata(metadata_record):
+                extracted_records[source_file] = metadata_record
+                cacheable_records[source_file] = metadata_record
+                continue
+
+            # Files without GPS tags are cached as None, but not the ones
+            # whose tags are invalid, so that they're extracted again if
+            # validation changes
+            extracted_records[source_file] = None
+            if not any(tag in metadata_record for tag in GPS_TAGS):
+                cacheable_records[source_file] = None
+        if cache is not None:
+            cache.put(files_chunk, cacheable_records, keys)
+
+        gps_metadata_records = dict(cached_records)
+        gps_metadata_records.update(extracted_records)
+        yield files_chunk, [
+            (gps_metadata_records[path], file_stat)
+            for path, file_stat in files_chunk
+            if gps_metadata_records.get(path) is not None
+        ]
+
+    if cache is not None:
+        logger.debug(
+            'EXIF cache: %d hits, %d misses', cache.hits, cache.misses)
+
+
+def transform_to_rows(gps_metadata_files):
+    """Transform GPS metadata in database rows.
+
+    :param gps_metadata_files:
+        GPS metadata and size and modification time for each file
+    :type gps_metadata_files: iterator(tuple(dict(str), tuple(int, float)))
+    :returns: Database rows
+    :rtype: iterator(dict(str))
+
+    """
+    for metadata, (size, mtime) in gps_metadata_files:
+        row = transform_metadata_to_row(metadata)
+        row['size'] = size
+        row['mtime'] = mtime
+        yield row
+
+
+def upsert_rows(database, rows, chunk_size=CHUNK_SIZE):
+    """Insert rows in the database in chunks or update the existing ones.
+
+    :param database: Location database
+    :type database: pic2map.db.LocationDB
+    :param rows: Database rows
+    :type rows: iterator(dict(str))
+    :param chunk_size: Number of rows upserted at once
+    :type chunk_size: int
+    :returns: Number of rows inserted, updated and left unchanged
+    :rtype: pic2map.db.UpsertCounts
+
+    """
+    inserted = updated = unchanged = 0
+    for rows_chunk in chunks(rows, chunk_size):
+        upsert_counts = database.upsert(rows_chunk)
+        inserted += upsert_counts.inserted
+        updated += upsert_counts.updated
+        unchanged += upsert_counts.unchanged
+    return UpsertCounts(inserted, updated, unchanged)
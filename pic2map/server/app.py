@@ -2,36 +2,396 @@
 """Web application server."""
 
 import json
-
-from operator import itemgetter
+import math
+import os
+import time
 
 from flask import (
     Flask,
+    Response,
+    abort,
+    jsonify,
     render_template,
+    request,
 )
+from xdg import BaseDirectory
 
-from pic2map.db import LocationDB
-from pic2map.util import average
+from pic2map.db import (
+    MAX_CLUSTER_ZOOM,
+    MISSING_TIMESTAMP,
+    LocationDB,
+    location_generation,
+)
+from pic2map.jobs import (
+    JobQueue,
+    job_progress,
+)
+from pic2map.server.binary import encode_points
+from pic2map.server.cache import (
+    ResponseCache,
+    cached,
+)
+from pic2map.server.tiles import (
+    TileCache,
+    get_tile,
+    is_valid_tile,
+)
 
 # Note: python and javascript don't seem to agree on what %c, %x
 # and %X are, so it's better to be explicit in the time formatting
 DATE_EXCHANGE_FORMAT = '%Y/%m/%d %H:%M:%S'
 
+# Map center used when there are no locations in the database
+DEFAULT_CENTER = (0.0, 0.0)
+
+# Maximum number of locations returned for a single viewport
+MAX_LOCATIONS = 10000
+
+# Zoom levels supported by the map
+MIN_ZOOM = 0
+MAX_ZOOM = 30
+
+# Media type for Mapbox Vector Tiles
+MVT_MIMETYPE = 'application/vnd.mapbox-vector-tile'
+
+# Media types for streamed locations
+STREAM_MIMETYPES = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+}
+
+# Media type for binary encoded location points
+POINTS_MIMETYPE = 'application/octet-stream'
+
+# Number of jobs returned by default
+DEFAULT_JOB_LIMIT = 10
+
+# Location encoded as a JSON object
+LOCATION_JSON = (
+    '{{"filename": {}, "latitude": {}, "longitude": {}, "datetime": {}}}')
+
 app = Flask(__name__)
+response_cache = ResponseCache()
+tile_cache = TileCache(
+    os.path.join(BaseDirectory.xdg_cache_home, 'pic2map', 'tiles'))
+
+
+def database_generation():
+    """Get generation counter of the location database.
+
+    :returns: Generation counter
+    :rtype: int
+
+    """
+    return location_generation()
 
 
 @app.route('/')
+@cached(response_cache, database_generation)
 def index():
-    """Application main page."""
+    """Application main page.
+
+    The map is initially fit to the bounds of all the locations in the
+    database. The centroid is used instead if there are no locations.
+
+    """
     with LocationDB() as location_db:
-        db_rows = list(location_db.select_all())
-        centroid = json.dumps([
-            average(db_rows, itemgetter('latitude')),
-            average(db_rows, itemgetter('longitude')),
-        ])
-        rows = json.dumps([row_to_serializable(db_row) for db_row in db_rows])
+        centroid = location_db.centroid() or DEFAULT_CENTER
+        bounds = location_db.bounds()
+
+    if bounds is not None:
+        south, west, north, east = bounds
+        bounds = [[south, west], [north, east]]
+
+    return render_template(
+        'index.html',
+        centroid=json.dumps(centroid),
+        bounds=json.dumps(bounds),
+        max_cluster_zoom=MAX_CLUSTER_ZOOM,
+    )
+
+
+@app.route('/api/locations')
+@cached(response_cache, database_generation)
+def locations():
+    """Locations inside the map viewport.
+
+    The viewport is passed in the ``bbox`` argument as
+    ``west,south,east,north`` (the format used by Leaflet's
+    ``LatLngBounds.toBBoxString``) and the map zoom level in the ``zoom``
+    argument.
+
+    Up to ``MAX_CLUSTER_ZOOM``, locations close to each other are grouped
+    in clusters, so the response size depends on the viewport size. At
+    higher zoom levels or if no zoom level is passed, locations are
+    returned individually, but at most ``MAX_LOCATIONS`` of them and, if
+    there are more in the viewport, the response is flagged as truncated.
+
+    Only the identifier and coordinates of each location are returned.
+    The rest of the location information can be retrieved from
+    ``/api/locations/<id>`` when needed.
+
+    """
+    try:
+        bbox = parse_bbox(request.args.get('bbox', ''))
+        zoom = parse_zoom(request.args.get('zoom'))
+    except ValueError as exception:
+        abort(400, str(exception))
 
-    return render_template('index.html', centroid=centroid, rows=rows)
+    with LocationDB() as location_db:
+        if zoom is not None and zoom <= MAX_CLUSTER_ZOOM:
+            clusters = []
+            rows = []
+            for row in location_db.select_clusters(*bbox, zoom=zoom):
+                if row['count'] == 1:
+                    rows.append(point_to_serializable(
+                        (row['id'], row['latitude'], row['longitude'])))
+                else:
+                    clusters.append(cluster_to_serializable(row))
+            truncated = False
+        else:
+            clusters = []
+            columns = location_db.select_columns(
+                bbox, limit=MAX_LOCATIONS + 1)
+            truncated = len(columns) > MAX_LOCATIONS
+            points = zip(columns.ids, columns.latitudes, columns.longitudes)
+            rows = [
+                point_to_serializable(point)
+                for point in points[:MAX_LOCATIONS]
+            ]
+
+    return jsonify(
+        zoom=zoom,
+        truncated=truncated,
+        clusters=clusters,
+        locations=rows,
+    )
+
+
+@app.route('/api/locations/<int:location_id>')
+@cached(response_cache, database_generation)
+def location(location_id):
+    """Location information for a single location.
+
+    This is used to show the details of a location in its popup.
+
+    """
+    with LocationDB() as location_db:
+        row = location_db.select_location(location_id)
+
+    if row is None:
+        abort(404)
+    return jsonify(row_to_serializable(row))
+
+
+@app.route('/api/locations.bin')
+@cached(response_cache, database_generation)
+def locations_binary():
+    """All locations, or those in the ``bbox`` argument, in binary format.
+
+    See ``pic2map.server.binary`` for a description of the format.
+    Filenames and datetimes aren't included, but they can be retrieved
+    with the row identifiers from ``/api/locations/<id>``.
+
+    """
+    bbox_str = request.args.get('bbox')
+    try:
+        bbox = None if bbox_str is None else parse_bbox(bbox_str)
+    except ValueError as exception:
+        abort(400, str(exception))
+
+    with LocationDB() as location_db:
+        data = encode_points(location_db.select_points(bbox))
+
+    return Response(data, mimetype=POINTS_MIMETYPE)
+
+
+@app.route('/api/locations.<any(json, ndjson):format_>')
+def locations_stream(format_):
+    """All locations streamed as a JSON array or as newline delimited JSON.
+
+    Locations are encoded as they are read from the database, so memory
+    usage doesn't depend on the number of locations. They can be
+    restricted to a viewport by passing it in the ``bbox`` argument as in
+    ``/api/locations``.
+
+    """
+    bbox_str = request.args.get('bbox')
+    try:
+        bbox = None if bbox_str is None else parse_bbox(bbox_str)
+    except ValueError as exception:
+        abort(400, str(exception))
+
+    return Response(
+        generate_locations(bbox, format_),
+        mimetype=STREAM_MIMETYPES[format_],
+    )
+
+
+def generate_locations(bbox, format_):
+    """Generate encoded locations chunk by chunk.
+
+    :param bbox: South, west, north and east coordinates or None
+    :type bbox: tuple(float, float, float, float) | None
+    :param format_: Either ``json`` or ``ndjson``
+    :type format_: str
+    :returns: Encoded location chunks
+    :rtype: iterator(str)
+
+    """
+    with LocationDB() as location_db:
+        if format_ == 'ndjson':
+            for columns in location_db.select_column_chunks(bbox):
+                yield ''.join(
+                    encode_location(columns, index) + '\n'
+                    for index in xrange(len(columns)))
+            return
+
+        yield '['
+        separator = '\n'
+        for columns in location_db.select_column_chunks(bbox):
+            yield separator + ',\n'.join(
+                encode_location(columns, index)
+                for index in xrange(len(columns)))
+            separator = ',\n'
+        yield '\n]\n'
+
+
+def encode_location(columns, index):
+    """Encode location as a JSON object.
+
+    This is faster than building a dictionary for each location and
+    serializing it with the json module.
+
+    :param columns: Location information columns
+    :type columns: pic2map.db.LocationColumns
+    :param index: Location index
+    :type index: int
+    :returns: Location information in JSON format
+    :rtype: str
+
+    """
+    latitude = columns.latitudes[index]
+    longitude = columns.longitudes[index]
+    timestamp = columns.timestamps[index]
+    return LOCATION_JSON.format(
+        json.dumps(columns.filename(index)),
+        'null' if math.isnan(latitude) else repr(latitude),
+        'null' if math.isnan(longitude) else repr(longitude),
+        'null' if timestamp == MISSING_TIMESTAMP else '"{}"'.format(
+            time.strftime(DATE_EXCHANGE_FORMAT, time.gmtime(timestamp))),
+    )
+
+
+@app.route('/api/jobs')
+def jobs():
+    """Progress of the most recent indexing jobs.
+
+    Jobs progress while they run, so responses aren't cached. The number
+    of jobs can be changed with the ``limit`` argument.
+
+    """
+    try:
+        limit = int(request.args.get('limit', DEFAULT_JOB_LIMIT))
+    except ValueError:
+        abort(400, 'Invalid limit: {!r}'.format(request.args['limit']))
+
+    with LocationDB() as location_db:
+        job_queue = JobQueue(location_db)
+        progresses = [
+            job_progress(job, job_queue.expected_file_count(job))
+            for job in job_queue.jobs(limit)
+        ]
+
+    return jsonify({'jobs': progresses})
+
+
+@app.route('/tiles/<int:zoom>/<int:x>/<int:y>.pbf')
+@cached(response_cache, database_generation)
+def tile(zoom, x, y):
+    """Vector tile with the locations in a map tile.
+
+    Tiles are rendered from the database and cached on disk until any of
+    the locations in them changes.
+
+    """
+    if not MIN_ZOOM <= zoom <= MAX_ZOOM or not is_valid_tile(zoom, x, y):
+        abort(404)
+
+    with LocationDB() as location_db:
+        data = get_tile(location_db, tile_cache, zoom, x, y)
+
+    return Response(data, mimetype=MVT_MIMETYPE)
+
+
+def parse_bbox(bbox_str):
+    """Parse bounding box argument.
+
+    Longitudes are wrapped to the [-180, 180] range, since the map can be
+    panned beyond the antimeridian, and latitudes are clamped to the
+    [-90, 90] range.
+
+    :param bbox_str: Bounding box as ``west,south,east,north``
+    :type bbox_str: str
+    :returns: South, west, north and east coordinates
+    :rtype: tuple(float, float, float, float)
+    :raises ValueError: If the bounding box is not valid
+
+    """
+    try:
+        west, south, east, north = [
+            float(value) for value in bbox_str.split(',')]
+    except ValueError:
+        raise ValueError('Invalid bbox: {!r}'.format(bbox_str))
+
+    if south > north or west > east:
+        raise ValueError('Invalid bbox: {!r}'.format(bbox_str))
+
+    south = max(south, -90.0)
+    north = min(north, 90.0)
+    if east - west >= 360:
+        west, east = -180.0, 180.0
+    else:
+        west, east = wrap_longitude(west), wrap_longitude(east)
+        if east == -180.0:
+            east = 180.0
+
+    return south, west, north, east
+
+
+def parse_zoom(zoom_str):
+    """Parse zoom level argument.
+
+    :param zoom_str: Map zoom level
+    :type zoom_str: str | None
+    :returns: Zoom level or None if it wasn't passed
+    :rtype: int | None
+    :raises ValueError: If the zoom level is not valid
+
+    """
+    if zoom_str is None:
+        return None
+
+    try:
+        zoom = int(zoom_str)
+    except ValueError:
+        raise ValueError('Invalid zoom: {!r}'.format(zoom_str))
+
+    if not MIN_ZOOM <= zoom <= MAX_ZOOM:
+        raise ValueError('Invalid zoom: {!r}'.format(zoom_str))
+    return zoom
+
+
+def wrap_longitude(longitude):
+    """Wrap longitude to the [-180, 180) range.
+
+    :param longitude: Longitude in degrees
+    :type longitude: float
+    :returns: Equivalent longitude in the [-180, 180) range
+    :rtype: float
+
+    """
+    return (longitude + 180.0) % 360.0 - 180.0
 
 
 def row_to_serializable(row):
@@ -51,5 +411,37 @@ def row_to_serializable(row):
     return row
 
 
+def point_to_serializable(row):
+    """Transform location point to make it json serializable.
+
+    :param row: Row identifier, latitude and longitude
+    :type row: tuple
+    :returns: Location identifier and coordinates
+    :rtype: dict(str)
+
+    """
+    return {
+        'id': row[0],
+        'latitude': row[1],
+        'longitude': row[2],
+    }
+
+
+def cluster_to_serializable(row):
+    """Transform cluster row to make it json serializable.
+
+    :param row: Database row with cluster information
+    :type row: sqlalchemy.engine.result.RowProxy
+    :returns: Cluster centroid and number of locations
+    :rtype: dict(str)
+
+    """
+    return {
+        'latitude': row['latitude'],
+        'longitude': row['longitude'],
+        'count': row['count'],
+    }
+
+
 if __name__ == '__main__':
     app.run(debug=True)
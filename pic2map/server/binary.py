@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""Compact binary encoding of location points.
+
+Points are encoded column by column, so that clients can read each column
+as a typed array without parsing anything. All values are little endian:
+
+- Header: 4 bytes magic string and uint32 number of points.
+- float64 latitudes.
+- float64 longitudes.
+- uint32 row identifiers, used to get filenames when needed.
+
+Every section starts at a multiple of its item size, as required by
+typed arrays.
+
+"""
+
+import struct
+import sys
+
+from array import array
+
+# Magic string at the beginning of encoded points
+MAGIC = 'P2MP'
+
+
+def encode_points(chunks):
+    """Encode location points.
+
+    :param chunks: Chunks of row identifier, latitude and longitude
+        tuples, as returned by ``LocationDB.select_points``
+    :type chunks: iterator(list(tuple(int, float, float)))
+    :returns: Encoded points
+    :rtype: str
+
+    """
+    latitudes = array('d')
+    longitudes = array('d')
+    ids = array('I')
+
+    for rows in chunks:
+        for row_id, latitude, longitude in rows:
+            ids.append(row_id)
+            latitudes.append(latitude)
+            longitudes.append(longitude)
+
+    header = struct.pack('<4sI', MAGIC, len(ids))
+    columns = [latitudes, longitudes, ids]
+    if sys.byteorder == 'big':
+        for column in columns:
+            column.byteswap()
+    return header + ''.join(column.tostring() for column in columns)
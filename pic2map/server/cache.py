@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""Response cache.
+
+Responses are cached in memory along with their gzip compressed version and
+an entity tag. They are keyed on the request path and a generation counter
+that changes every time the data changes, so stale responses are never
+returned and don't need to be invalidated explicitly.
+
+"""
+
+import functools
+import hashlib
+import logging
+import threading
+import zlib
+
+from collections import (
+    OrderedDict,
+    namedtuple,
+)
+
+from flask import (
+    Response,
+    make_response,
+    request,
+)
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of responses kept in a cache
+MAX_ENTRIES = 256
+
+# Window bits value used to get zlib to write a gzip header
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+CachedResponse = namedtuple(
+    'CachedResponse', 'etag data gzip_data mimetype')
+
+
+class ResponseCache(object):
+
+    """Least recently used cache of responses.
+
+    :param max_entries: Maximum number of responses kept in the cache
+    :type max_entries: int
+
+    """
+
+    def __init__(self, max_entries=MAX_ENTRIES):
+        """Initialize empty cache."""
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Get response from cache.
+
+        :param key: Cache key
+        :type key: tuple
+        :returns: Cached response or None if not found
+        :rtype: CachedResponse | None
+
+        """
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.entries[key] = entry
+            return entry
+
+    def set(self, key, entry):
+        """Store response in cache.
+
+        :param key: Cache key
+        :type key: tuple
+        :param entry: Response to cache
+        :type entry: CachedResponse
+
+        """
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = entry
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        """Remove all responses from cache."""
+        with self.lock:
+            self.entries.clear()
+
+
+def cached(cache, get_generation):
+    """Decorate view to cache its responses.
+
+    Only successful responses are cached. Clients get an entity tag, so
+    that they can revalidate cached responses with ``If-None-Match``, and
+    the gzip compressed response if they accept it.
+
+    :param cache: Cache where responses are stored
+    :type cache: ResponseCache
+    :param get_generation: Function that returns the data generation
+    :type get_generation: callable
+    :returns: View decorator
+    :rtype: callable
+
+    """
+    def decorator(view):
+        """Wrap view."""
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            """Return cached response or call view to get it."""
+            key = (request.full_path, get_generation())
+            entry = cache.get(key)
+            if entry is None:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                entry = to_cached_response(response)
+                cache.set(key, entry)
+            return from_cached_response(entry)
+        return wrapper
+    return decorator
+
+
+def to_cached_response(response):
+    """Get response data to be cached.
+
+    :param response: Response returned by a view
+    :type response: flask.Response
+    :returns: Response data, its compressed version and entity tag
+    :rtype: CachedResponse
+
+    """
+    data = response.get_data()
+    compressor = zlib.compressobj(
+        zlib.Z_BEST_COMPRESSION, zlib.DEFLATED, GZIP_WBITS)
+    gzip_data = compressor.compress(data) + compressor.flush()
+    return CachedResponse(
+        etag=hashlib.md5(data).hexdigest(),
+        data=data,
+        gzip_data=gzip_data,
+        mimetype=response.mimetype,
+    )
+
+
+def from_cached_response(entry):
+    """Build response for the current request from cached data.
+
+    :param entry: Cached response
+    :type entry: CachedResponse
+    :returns: Response to the current request
+    :rtype: flask.Response
+
+    """
+    # Compressed and uncompressed bodies are different representations, so
+    # they need different entity tags
+    if 'gzip' in request.accept_encodings:
+        etag = entry.etag + '-gzip'
+        data = entry.gzip_data
+        content_encoding = 'gzip'
+    else:
+        etag = entry.etag
+        data = entry.data
+        content_encoding = None
+
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = Response(data, mimetype=entry.mimetype)
+        if content_encoding is not None:
+            response.content_encoding = content_encoding
+
+    response.set_etag(etag)
+    response.vary.add('Accept-Encoding')
+
+    # Clients may store responses, but must check that they're still valid
+    response.cache_control.no_cache = True
+    return response
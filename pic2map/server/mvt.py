@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""Mapbox Vector Tile encoding.
+
+Only what is needed to encode point features is implemented, so that tiles
+can be generated without depending on a protocol buffers library.
+
+See: https://github.com/mapbox/vector-tile-spec/tree/master/2.1
+
+"""
+
+import struct
+
+# Version of the vector tile specification
+VERSION = 2
+
+# Size of the tile in its own coordinate system
+EXTENT = 4096
+
+# Protocol buffers wire types
+VARINT = 0
+FIXED64 = 1
+LENGTH_DELIMITED = 2
+
+# Geometry types and commands
+POINT = 1
+MOVE_TO = 1
+
+
+class Layer(object):
+
+    """Vector tile layer with point features.
+
+    :param name: Layer name
+    :type name: str
+    :param extent: Size of the tile in its own coordinate system
+    :type extent: int
+
+    """
+
+    def __init__(self, name, extent=EXTENT):
+        """Initialize empty layer."""
+        self.name = name
+        self.extent = extent
+        self.features = []
+        self.keys = {}
+        self.values = {}
+
+    def add_point(self, x, y, properties, feature_id=None):
+        """Add point feature to layer.
+
+        :param x: Horizontal position in tile coordinates
+        :type x: int
+        :param y: Vertical position in tile coordinates
+        :type y: int
+        :param properties: Feature properties
+        :type properties: dict(str, str | int | float | bool)
+        :param feature_id: Feature identifier
+        :type feature_id: int | None
+
+        """
+        tags = []
+        for key, value in sorted(properties.iteritems()):
+            if value is None:
+                continue
+            tags.append(self.keys.setdefault(key, len(self.keys)))
+            # Booleans are compared with integers as equal, so the value type
+            # is part of the key
+            tags.append(
+                self.values.setdefault((type(value), value), len(self.values)))
+
+        geometry = [
+            _command(MOVE_TO, 1),
+            _zigzag(x),
+            _zigzag(y),
+        ]
+
+        feature = ''
+        if feature_id is not None:
+            feature += _varint_field(1, feature_id)
+        if tags:
+            feature += _packed_field(2, tags)
+        feature += _varint_field(3, POINT)
+        feature += _packed_field(4, geometry)
+        self.features.append(feature)
+
+    def encode(self):
+        """Encode layer.
+
+        :returns: Layer message
+        :rtype: str
+
+        """
+        keys = sorted(self.keys, key=self.keys.get)
+        values = sorted(self.values, key=self.values.get)
+        return ''.join([
+            _varint_field(15, VERSION),
+            _bytes_field(1, _encode_string(self.name)),
+            ''.join(_bytes_field(2, feature) for feature in self.features),
+            ''.join(_bytes_field(3, _encode_string(key)) for key in keys),
+            ''.join(
+                _bytes_field(4, _encode_value(value))
+                for _value_type, value in values),
+            _varint_field(5, self.extent),
+        ])
+
+
+def encode_tile(layers):
+    """Encode vector tile.
+
+    :param layers: Tile layers
+    :type layers: list(Layer)
+    :returns: Tile message
+    :rtype: str
+
+    """
+    return ''.join(_bytes_field(3, layer.encode()) for layer in layers)
+
+
+def _encode_string(value):
+    """Encode string as UTF-8.
+
+    :param value: String to encode
+    :type value: str | unicode
+    :returns: Encoded string
+    :rtype: str
+
+    """
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def _encode_value(value):
+    """Encode feature property value.
+
+    :param value: Property value
+    :type value: str | unicode | int | float | bool
+    :returns: Value message
+    :rtype: str
+
+    """
+    if isinstance(value, bool):
+        return _varint_field(7, int(value))
+    if isinstance(value, (int, long)):
+        if value < 0:
+            return _varint_field(6, _zigzag(value))
+        return _varint_field(5, value)
+    if isinstance(value, float):
+        return _key(3, FIXED64) + struct.pack('<d', value)
+    return _bytes_field(1, _encode_string(value))
+
+
+def _command(command_id, count):
+    """Encode geometry command.
+
+    :param command_id: Command identifier
+    :type command_id: int
+    :param count: Number of times the command is repeated
+    :type count: int
+    :returns: Command integer
+    :rtype: int
+
+    """
+    return (command_id & 0x7) | (count << 3)
+
+
+def _zigzag(value):
+    """Encode signed integer so that small absolute values are small.
+
+    :param value: Signed integer
+    :type value: int
+    :returns: Unsigned integer
+    :rtype: int
+
+    """
+    if value < 0:
+        return (-value << 1) - 1
+    return value << 1
+
+
+def _varint(value):
+    """Encode unsigned integer as a variable length integer.
+
+    :param value: Unsigned integer
+    :type value: int
+    :returns: Encoded integer
+    :rtype: str
+
+    """
+    data = []
+    while value > 0x7f:
+        data.append(chr((value & 0x7f) | 0x80))
+        value >>= 7
+    data.append(chr(value))
+    return ''.join(data)
+
+
+def _key(field_number, wire_type):
+    """Encode field key.
+
+    :param field_number: Field number in the message
+    :type field_number: int
+    :param wire_type: Field wire type
+    :type wire_type: int
+    :returns: Encoded key
+    :rtype: str
+
+    """
+    return _varint((field_number << 3) | wire_type)
+
+
+def _varint_field(field_number, value):
+    """Encode variable length integer field.
+
+    :param field_number: Field number in the message
+    :type field_number: int
+    :param value: Unsigned integer
+    :type value: int
+    :returns: Encoded field
+    :rtype: str
+
+    """
+    return _key(field_number, VARINT) + _varint(value)
+
+
+def _bytes_field(field_number, data):
+    """Encode length delimited field.
+
+    :param field_number: Field number in the message
+    :type field_number: int
+    :param data: Field data
+    :type data: str
+    :returns: Encoded field
+    :rtype: str
+
+    """
+    return _key(field_number, LENGTH_DELIMITED) + _varint(len(data)) + data
+
+
+def _packed_field(field_number, values):
+    """Encode packed repeated unsigned integer field.
+
+    :param field_number: Field number in the message
+    :type field_number: int
+    :param values: Unsigned integers
+    :type values: list(int)
+    :returns: Encoded field
+    :rtype: str
+
+    """
+    return _bytes_field(
+        field_number, ''.join(_varint(value) for value in values))
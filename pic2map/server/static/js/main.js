@@ -1,26 +1,163 @@
 // Avoid jslint errors for known globals
 /*global L*/
 var LocationMap = {
-  'initialize': function initialize(elementId, initialCenter) {
-    this.map = L.map(elementId).setView(initialCenter, 3);
-    this.markerCluster = L.markerClusterGroup();
+  'initialize': function initialize(elementId, initialCenter, initialBounds,
+                                    urls, maxClusterZoom) {
+    this.map = L.map(elementId);
+    if (initialBounds) {
+      this.map.fitBounds(initialBounds, {'maxZoom': 16});
+    } else {
+      this.map.setView(initialCenter, 3);
+    }
+    this.clusterLayer = L.layerGroup();
+    this.markerLayer = L.layerGroup();
+    this.markers = {};
+    this.urls = urls;
+    this.maxClusterZoom = maxClusterZoom;
+    this.lastRequestId = 0;
 
     L.tileLayer('http://{s}.tile.osm.org/{z}/{x}/{y}.png', {
         attribution: '&copy; <a href="http://osm.org/copyright">OpenStreetMap</a> contributors'
     }).addTo(this.map);
-    this.map.addLayer(this.markerCluster);
+    this.map.addLayer(this.clusterLayer);
+    this.map.addLayer(this.markerLayer);
+    this.map.on('moveend', this.update, this);
+    this.update();
   },
-  'addMarkers': function addMarkers(markersData) {
-    console.log('Adding ' + markersData.length + ' markers');
+  'update': function update() {
+    // Responses for older viewports are discarded when they arrive late
+    var requestId = ++this.lastRequestId;
+    var bbox = this.map.getBounds().toBBoxString();
+    var zoom = this.map.getZoom();
+    var request = new XMLHttpRequest();
+
+    // Clusters aren't needed when zoomed in, so locations are fetched in
+    // binary format, which is much faster to parse than JSON
+    if (zoom > this.maxClusterZoom) {
+      request.onload = function onload() {
+        if (requestId !== this.lastRequestId || request.status !== 200) {
+          return;
+        }
+        this.setClusters([]);
+        this.setMarkers(this.decodePoints(request.response));
+      }.bind(this);
+      request.open('GET', this.urls.points + '?bbox=' + bbox);
+      request.responseType = 'arraybuffer';
+      request.send();
+      return;
+    }
+
+    request.onload = function onload() {
+      if (requestId !== this.lastRequestId || request.status !== 200) {
+        return;
+      }
+      var response = JSON.parse(request.responseText);
+      if (response.truncated) {
+        console.log('Too many locations in viewport, zoom in to see all');
+      }
+      this.setClusters(response.clusters);
+      this.setMarkers(response.locations);
+    }.bind(this);
+    request.open('GET', this.urls.locations + '?bbox=' + bbox + '&zoom=' + zoom);
+    request.send();
+  },
+  'decodePoints': function decodePoints(buffer) {
+    // See pic2map.server.binary for a description of the format
+    var count = new DataView(buffer, 0, 8).getUint32(4, true);
+    var offset = 8;
+    var latitudes = new Float64Array(buffer, offset, count);
+    offset += count * 8;
+    var longitudes = new Float64Array(buffer, offset, count);
+    offset += count * 8;
+    var ids = new Uint32Array(buffer, offset, count);
+
+    var points = [];
+    for (var index = 0; index < count; index++) {
+      points.push({
+        'id': ids[index],
+        'latitude': latitudes[index],
+        'longitude': longitudes[index]
+      });
+    }
+    return points;
+  },
+  'setClusters': function setClusters(clustersData) {
+    // Clusters depend on the zoom level, so they are always replaced
+    this.clusterLayer.clearLayers();
+    clustersData.forEach(function(clusterData) {
+      this.clusterLayer.addLayer(this.createCluster(clusterData));
+    }, this);
+  },
+  'setMarkers': function setMarkers(markersData) {
+    // Keep markers that are still visible and replace the rest
+    var markers = {};
+    var addedCount = 0;
     markersData.forEach(function(markerData) {
-        var marker = L.marker([markerData.latitude, markerData.longitude]);
-        var text = 'Filename: ' + markerData.filename;
-        if (markerData.datetime) {
-          text += '<br>GPS datetime: ' + markerData.datetime;
+        var marker = this.markers[markerData.id];
+        if (marker) {
+          delete this.markers[markerData.id];
+        } else {
+          marker = this.createMarker(markerData);
+          this.markerLayer.addLayer(marker);
+          addedCount++;
         }
+        markers[markerData.id] = marker;
+    }, this);
 
-        marker.bindPopup(text);
-        this.markerCluster.addLayer(marker);
+    var removedIds = Object.keys(this.markers);
+    removedIds.forEach(function(id) {
+      this.markerLayer.removeLayer(this.markers[id]);
     }, this);
+    this.markers = markers;
+    console.log(
+      'Showing ' + markersData.length + ' markers (' +
+      addedCount + ' added, ' + removedIds.length + ' removed)');
+  },
+  'createCluster': function createCluster(clusterData) {
+    var size = 'large';
+    if (clusterData.count < 10) {
+      size = 'small';
+    } else if (clusterData.count < 100) {
+      size = 'medium';
+    }
+    var latLng = L.latLng(clusterData.latitude, clusterData.longitude);
+    var cluster = L.marker(latLng, {
+      'icon': L.divIcon({
+        'html': '<div><span>' + clusterData.count + '</span></div>',
+        'className': 'marker-cluster marker-cluster-' + size,
+        'iconSize': L.point(40, 40)
+      })
+    });
+
+    cluster.on('click', function zoomIn() {
+      this.map.setView(latLng, this.map.getZoom() + 2);
+    }, this);
+    return cluster;
+  },
+  'createMarker': function createMarker(markerData) {
+    // Markers only have an identifier and coordinates, so the location
+    // details are fetched the first time the popup is opened
+    var marker = L.marker([markerData.latitude, markerData.longitude]);
+    marker.bindPopup('Loading...');
+    marker.once('popupopen', function fetchDetails() {
+      var request = new XMLHttpRequest();
+      request.onload = function onload() {
+        if (request.status !== 200) {
+          return;
+        }
+        marker.setPopupContent(popupText(JSON.parse(request.responseText)));
+      };
+      request.open('GET', this.urls.locations + '/' + markerData.id);
+      request.send();
+    }, this);
+    return marker;
   }
 };
+
+function popupText(locationData) {
+  var text = 'Filename: ' + locationData.filename;
+  if (locationData.datetime) {
+    text += '<br>GPS datetime: ' + locationData.datetime;
+  }
+  return text;
+}
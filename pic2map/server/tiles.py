@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+"""Map tiles with location points.
+
+Tiles follow the XYZ scheme used by web maps: at zoom level ``z``, the
+world in the Web Mercator projection is split in a grid of ``2 ** z`` by
+``2 ** z`` tiles, starting from the north west corner.
+
+"""
+
+import errno
+import logging
+import math
+import os
+import tempfile
+
+from pic2map.db import MAX_CLUSTER_ZOOM
+from pic2map.server import mvt
+
+logger = logging.getLogger(__name__)
+
+# Latitude limit of the Web Mercator projection
+MAX_LATITUDE = math.degrees(math.atan(math.sinh(math.pi)))
+
+# Maximum number of individual locations in a tile
+MAX_TILE_FEATURES = 10000
+
+# Name of the layer with location points in vector tiles
+LAYER_NAME = 'locations'
+
+# Version of the tile contents, which is part of the cached tiles version
+# so that tiles rendered by older versions aren't returned
+TILE_FORMAT_VERSION = 2
+
+
+class TileCache(object):
+
+    """On-disk cache for map tiles.
+
+    Every tile is stored along with a version string and it's considered
+    stale when it's requested with a different version.
+
+    :param directory: Directory where tiles are stored
+    :type directory: str
+
+    """
+
+    def __init__(self, directory):
+        """Initialize cache."""
+        self.directory = directory
+
+    def get(self, zoom, x, y, version):
+        """Get tile from cache.
+
+        :param zoom: Tile zoom level
+        :type zoom: int
+        :param x: Tile column
+        :type x: int
+        :param y: Tile row
+        :type y: int
+        :param version: Expected tile version
+        :type version: str
+        :returns: Tile data or None if not found or stale
+        :rtype: str | None
+
+        """
+        try:
+            with open(self._path(zoom, x, y), 'rb') as file_:
+                cached_version = file_.readline().rstrip('\n')
+                if cached_version != version:
+                    return None
+                return file_.read()
+        except IOError as exception:
+            if exception.errno != errno.ENOENT:
+                logger.warning('Unable to read cached tile: %s', exception)
+            return None
+
+    def set(self, zoom, x, y, version, data):
+        """Store tile in cache.
+
+        The tile is written to a temporary file first and then renamed, so
+        that concurrent requests never get a partially written tile.
+
+        :param zoom: Tile zoom level
+        :type zoom: int
+        :param x: Tile column
+        :type x: int
+        :param y: Tile row
+        :type y: int
+        :param version: Tile version
+        :type version: str
+        :param data: Tile data
+        :type data: str
+
+        """
+        path = self._path(zoom, x, y)
+        directory = os.path.dirname(path)
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            file_descriptor, temp_path = tempfile.mkstemp(dir=directory)
+            with os.fdopen(file_descriptor, 'wb') as file_:
+                file_.write(version + '\n')
+                file_.write(data)
+            os.rename(temp_path, path)
+        except OSError as exception:
+            logger.warning('Unable to cache tile: %s', exception)
+
+    def _path(self, zoom, x, y):
+        """Get path to the cached tile file.
+
+        :param zoom: Tile zoom level
+        :type zoom: int
+        :param x: Tile column
+        :type x: int
+        :param y: Tile row
+        :type y: int
+        :returns: Path to the tile file
+        :rtype: str
+
+        """
+        return os.path.join(
+            self.directory, str(zoom), str(x), '{}.pbf'.format(y))
+
+
+def is_valid_tile(zoom, x, y):
+    """Check whether tile coordinates exist.
+
+    :param zoom: Tile zoom level
+    :type zoom: int
+    :param x: Tile column
+    :type x: int
+    :param y: Tile row
+    :type y: int
+    :returns: Whether the tile exists
+    :rtype: bool
+
+    """
+    tile_count = 2 ** zoom
+    return 0 <= x < tile_count and 0 <= y < tile_count
+
+
+def tile_bbox(zoom, x, y):
+    """Get tile bounding box.
+
+    :param zoom: Tile zoom level
+    :type zoom: int
+    :param x: Tile column
+    :type x: int
+    :param y: Tile row
+    :type y: int
+    :returns: South, west, north and east coordinates
+    :rtype: tuple(float, float, float, float)
+
+    """
+    tile_count = 2.0 ** zoom
+
+    def latitude(row):
+        """Get latitude for the northern edge of a tile row."""
+        return math.degrees(
+            math.atan(math.sinh(math.pi * (1 - 2 * row / tile_count))))
+
+    return (
+        latitude(y + 1),
+        x / tile_count * 360.0 - 180.0,
+        latitude(y),
+        (x + 1) / tile_count * 360.0 - 180.0,
+    )
+
+
+def project(latitude, longitude, zoom, x, y, extent=mvt.EXTENT):
+    """Project coordinates to tile coordinates.
+
+    :param latitude: Location latitude
+    :type latitude: float
+    :param longitude: Location longitude
+    :type longitude: float
+    :param zoom: Tile zoom level
+    :type zoom: int
+    :param x: Tile column
+    :type x: int
+    :param y: Tile row
+    :type y: int
+    :param extent: Size of the tile in its own coordinate system
+    :type extent: int
+    :returns: Horizontal and vertical position in the tile
+    :rtype: tuple(int, int)
+
+    """
+    tile_count = 2.0 ** zoom
+    latitude = max(min(latitude, MAX_LATITUDE), -MAX_LATITUDE)
+    sin_latitude = math.sin(math.radians(latitude))
+    world_x = (longitude + 180.0) / 360.0
+    world_y = 0.5 - math.log(
+        (1 + sin_latitude) / (1 - sin_latitude)) / (4 * math.pi)
+    return (
+        int(math.floor((world_x * tile_count - x) * extent)),
+        int(math.floor((world_y * tile_count - y) * extent)),
+    )
+
+
+def tile_version(location_db, zoom, x, y):
+    """Get version of the locations in a tile.
+
+    :param location_db: Location database
+    :type location_db: pic2map.db.LocationDB
+    :param zoom: Tile zoom level
+    :type zoom: int
+    :param x: Tile column
+    :type x: int
+    :param y: Tile row
+    :type y: int
+    :returns: Version of the tile
+    :rtype: str
+
+    """
+    cluster_version = location_db.cluster_version(
+        *tile_bbox(zoom, x, y), zoom=min(zoom, MAX_CLUSTER_ZOOM))
+    return '{}-{}'.format(TILE_FORMAT_VERSION, cluster_version)
+
+
+def render_tile(location_db, zoom, x, y):
+    """Render vector tile with the locations in it.
+
+    Up to ``MAX_CLUSTER_ZOOM``, locations are grouped in clusters and each
+    cluster is added to the tile whose area contains its centroid. Single
+    locations use their row identifier as feature identifier, so that their
+    details can be retrieved from the location API.
+
+    :param location_db: Location database
+    :type location_db: pic2map.db.LocationDB
+    :param zoom: Tile zoom level
+    :type zoom: int
+    :param x: Tile column
+    :type x: int
+    :param y: Tile row
+    :type y: int
+    :returns: Vector tile data
+    :rtype: str
+
+    """
+    bbox = tile_bbox(zoom, x, y)
+    if zoom <= MAX_CLUSTER_ZOOM:
+        points = (
+            (row['count'], row['id'], row['latitude'], row['longitude'])
+            for row in location_db.select_clusters(*bbox, zoom=zoom)
+        )
+    else:
+        points = (
+            (1, row_id, latitude, longitude)
+            for chunk in location_db.select_points(
+                bbox, limit=MAX_TILE_FEATURES)
+            for row_id, latitude, longitude in chunk
+        )
+
+    layer = mvt.Layer(LAYER_NAME)
+    for count, row_id, latitude, longitude in points:
+        point_x, point_y = project(
+            latitude, longitude, zoom, x, y, layer.extent)
+        if not (0 <= point_x < layer.extent and 0 <= point_y < layer.extent):
+            continue
+        layer.add_point(point_x, point_y, {'count': count}, row_id)
+    return mvt.encode_tile([layer])
+
+
+def get_tile(location_db, tile_cache, zoom, x, y):
+    """Get vector tile from cache or render it if needed.
+
+    :param location_db: Location database
+    :type location_db: pic2map.db.LocationDB
+    :param tile_cache: Tile cache
+    :type tile_cache: TileCache
+    :param zoom: Tile zoom level
+    :type zoom: int
+    :param x: Tile column
+    :type x: int
+    :param y: Tile row
+    :type y: int
+    :returns: Vector tile data
+    :rtype: str
+
+    """
+    version = tile_version(location_db, zoom, x, y)
+    data = tile_cache.get(zoom, x, y, version)
+    if data is None:
+        logger.debug('Rendering tile %d/%d/%d...', zoom, x, y)
+        data = render_tile(location_db, zoom, x, y)
+        tile_cache.set(zoom, x, y, version, data)
+    return data
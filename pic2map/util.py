@@ -1,6 +1,18 @@
 # -*- coding: utf-8 -*-
 """Utility functionality."""
 
+import math
+
+from itertools import (
+    islice,
+    izip,
+    repeat,
+)
+
+# Relative length under which the sum of unit vectors is considered zero
+CENTROID_TOLERANCE = 1e-12
+
+
 def average(collection, function=None):
     """Calculate the average of values in a collection.
 
@@ -17,3 +29,91 @@ def average(collection, function=None):
 
     total = float(sum(function(element) for element in collection))
     return total / len(collection)
+
+
+def centroid(coordinates, weights=None):
+    """Calculate the geographic centroid of a collection of coordinates.
+
+    Coordinates are converted to 3D unit vectors and their sum is converted
+    back to coordinates, so that, unlike averaging latitudes and longitudes,
+    the result is correct for locations around the antimeridian or the
+    poles. Coordinates are consumed in a single pass, so they can be
+    streamed from an iterator.
+
+    :param coordinates: Latitude and longitude pairs in degrees
+    :type coordinates: list(tuple(float, float)) | iterator
+    :param weights:
+        Weight of each location. If not passed, all locations have the same
+        weight.
+    :type weights: list(float) | iterator
+    :returns:
+        Latitude and longitude of the centroid or None if there are no
+        locations or the centroid is undefined (for example, when locations
+        are evenly spread around the globe)
+    :rtype: tuple(float, float) | None
+
+    """
+    if weights is None:
+        weights = repeat(1.0)
+
+    # Local names make a difference in the loop
+    cos, sin, radians = math.cos, math.sin, math.radians
+    x = y = z = total_weight = 0.0
+    for (latitude, longitude), weight in izip(coordinates, weights):
+        latitude = radians(latitude)
+        longitude = radians(longitude)
+        weighted_cos_latitude = weight * cos(latitude)
+        x += weighted_cos_latitude * cos(longitude)
+        y += weighted_cos_latitude * sin(longitude)
+        z += weight * sin(latitude)
+        total_weight += weight
+
+    return centroid_from_sums(x, y, z, total_weight)
+
+
+def centroid_from_sums(x, y, z, total_weight):
+    """Calculate the geographic centroid from a sum of unit vectors.
+
+    This is useful when the sum of the unit vectors of the locations has
+    already been calculated somewhere else, such as in the database.
+
+    :param x: Sum of the x components of the unit vectors
+    :type x: float
+    :param y: Sum of the y components of the unit vectors
+    :type y: float
+    :param z: Sum of the z components of the unit vectors
+    :type z: float
+    :param total_weight: Sum of the weights of the locations
+    :type total_weight: float
+    :returns:
+        Latitude and longitude of the centroid or None if it's undefined
+    :rtype: tuple(float, float) | None
+
+    """
+    # The direction of a vector that is too short compared with the total
+    # weight is just rounding noise
+    horizontal = math.hypot(x, y)
+    if math.hypot(horizontal, z) <= CENTROID_TOLERANCE * total_weight:
+        return None
+    return (
+        math.degrees(math.atan2(z, horizontal)),
+        math.degrees(math.atan2(y, x)),
+    )
+
+
+def chunks(iterable, size):
+    """Split an iterable in chunks without consuming it all at once.
+
+    :param iterable: The elements to split
+    :type iterable: list | iterator
+    :param size: Maximum number of elements in each chunk
+    :type size: int
+    :returns: Chunks of elements
+    :rtype: iterator(list)
+
+    """
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
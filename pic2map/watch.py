@@ -0,0 +1,539 @@
+# -*- coding: utf-8 -*-
+"""Filesystem watch mode.
+
+Changes under a directory are detected with inotify, or by polling the
+directory tree when inotify isn't available, and applied to the location
+database in batches, so that new pictures are indexed without exploring
+the whole tree again.
+
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import time
+
+from scandir import (
+    scandir,
+    walk,
+)
+
+from pic2map.fs import DETECTORS
+from pic2map.pipeline import (
+    extract_gps_metadata,
+    skip_unchanged_files,
+    transform_to_rows,
+    upsert_rows,
+)
+
+logger = logging.getLogger(__name__)
+
+# Seconds without new changes after which a batch is applied
+BATCH_DELAY = 1.0
+
+# Maximum number of seconds a change waits to be applied
+MAX_BATCH_DELAY = 10.0
+
+# Seconds between directory tree scans when polling
+POLL_INTERVAL = 5
+
+# inotify constants from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0x00080000
+
+# Events watched in every directory. Files are updated when they are closed
+# after being written, not when they are created, to avoid reading them
+# while they're being written.
+WATCH_MASK = (
+    IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE |
+    IN_ONLYDIR | IN_DONT_FOLLOW
+)
+
+# Watch descriptor, mask, cookie and name length of each event
+EVENT_STRUCT = struct.Struct('iIII')
+
+# Size of the buffer used to read events
+EVENT_BUFFER_SIZE = 64 * 1024
+
+
+def _load_libc():
+    """Load C library if it provides inotify.
+
+    :returns: C library or None if inotify is not available
+    :rtype: ctypes.CDLL | None
+
+    """
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        for function_name in [
+                'inotify_init1', 'inotify_add_watch', 'inotify_rm_watch']:
+            getattr(libc, function_name)
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+LIBC = _load_libc()
+
+
+def _decode_path(path):
+    """Decode path to unicode like the tree explorer does.
+
+    :param path: Path as returned by the filesystem
+    :type path: str | unicode
+    :returns: Decoded path
+    :rtype: unicode
+
+    """
+    if isinstance(path, str):
+        return path.decode('utf8')
+    return path
+
+
+class ChangeSet(object):
+
+    """Files updated and deleted under a directory.
+
+    Changes are merged in the order they are received, so that only the
+    last change to each file is applied.
+
+    """
+
+    def __init__(self):
+        """Initialize empty change set."""
+        self.updated = set()
+        self.deleted = set()
+        self.deleted_directories = set()
+
+    def __len__(self):
+        """Get number of changes."""
+        return (
+            len(self.updated) +
+            len(self.deleted) +
+            len(self.deleted_directories)
+        )
+
+    def update_file(self, path):
+        """Add file that has been created or modified.
+
+        :param path: Path to the file
+        :type path: str | unicode
+
+        """
+        path = _decode_path(path)
+        self.deleted.discard(path)
+        self.updated.add(path)
+
+    def delete_file(self, path):
+        """Add file that has been deleted.
+
+        :param path: Path to the file
+        :type path: str | unicode
+
+        """
+        path = _decode_path(path)
+        self.updated.discard(path)
+        self.deleted.add(path)
+
+    def delete_directory(self, path):
+        """Add directory that has been deleted.
+
+        Changes to files under the directory are discarded, since all of
+        them are deleted.
+
+        :param path: Path to the directory
+        :type path: str | unicode
+
+        """
+        path = _decode_path(path)
+        prefix = os.path.join(path, u'')
+        self.updated = set(
+            file_path
+            for file_path in self.updated
+            if not file_path.startswith(prefix)
+        )
+        self.deleted = set(
+            file_path
+            for file_path in self.deleted
+            if not file_path.startswith(prefix)
+        )
+        self.deleted_directories.add(path)
+
+
+class InotifyWatcher(object):
+
+    """Watch a directory tree using inotify.
+
+    inotify watches aren't recursive, so every subdirectory is watched as
+    well, including the ones created or moved into the tree later.
+
+    :param directory: Base directory
+    :type directory: str
+    :raises OSError: If inotify isn't available or can't watch the tree
+
+    """
+
+    def __init__(self, directory):
+        """Start watching directory tree."""
+        if LIBC is None:
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+
+        self.directory = directory
+        self.fd = _check(LIBC.inotify_init1(IN_CLOEXEC))
+        self.watches = {}
+        try:
+            self._add_watches(directory)
+        except OSError:
+            self.close()
+            raise
+
+    def __enter__(self):
+        """Return watcher on entering context."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Stop watching on exiting context."""
+        self.close()
+
+    def close(self):
+        """Stop watching directory tree."""
+        os.close(self.fd)
+
+    def read(self, changes, timeout=None):
+        """Read events and add them to a change set.
+
+        :param changes: Change set to add changes to
+        :type changes: ChangeSet
+        :param timeout: Seconds to wait for events or None to wait forever
+        :type timeout: float | None
+        :returns: Number of events read
+        :rtype: int
+
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return 0
+
+        data = os.read(self.fd, EVENT_BUFFER_SIZE)
+        event_count = 0
+        offset = 0
+        while offset < len(data):
+            wd, mask, _cookie, length = EVENT_STRUCT.unpack_from(data, offset)
+            offset += EVENT_STRUCT.size
+            name = data[offset:offset + length].rstrip('\0')
+            offset += length
+            event_count += 1
+            self._handle_event(changes, wd, mask, name)
+        return event_count
+
+    def _handle_event(self, changes, wd, mask, name):
+        """Add change for an event.
+
+        :param changes: Change set to add changes to
+        :type changes: ChangeSet
+        :param wd: Watch descriptor of the directory the event happened in
+        :type wd: int
+        :param mask: Event mask
+        :type mask: int
+        :param name: Name of the entry the event happened to
+        :type name: str
+
+        """
+        if mask & IN_Q_OVERFLOW:
+            # Events have been lost, so every file is checked again
+            logger.warning(
+                'Too many changes under %s, scanning it again...',
+                self.directory)
+            for path in self._add_watches(self.directory):
+                changes.update_file(path)
+            return
+
+        if mask & IN_IGNORED:
+            self.watches.pop(wd, None)
+            return
+
+        directory = self.watches.get(wd)
+        if directory is None:
+            return
+        path = os.path.join(directory, name)
+
+        if mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                # Files may have been added before the directory is watched
+                for file_path in self._add_watches(path):
+                    changes.update_file(file_path)
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                self._remove_watches(path)
+                changes.delete_directory(path)
+        elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+            changes.update_file(path)
+        elif mask & (IN_DELETE | IN_MOVED_FROM):
+            changes.delete_file(path)
+
+    def _add_watches(self, directory):
+        """Watch directory and its subdirectories.
+
+        :param directory: Directory to watch
+        :type directory: str
+        :returns: Files found under the directory
+        :rtype: list(str)
+
+        """
+        paths = []
+        directories = [directory]
+        while directories:
+            dirpath = directories.pop()
+            wd = LIBC.inotify_add_watch(self.fd, dirpath, WATCH_MASK)
+            if wd < 0:
+                error = ctypes.get_errno()
+                # Directories may be removed before they're watched
+                if error in (errno.ENOENT, errno.ENOTDIR):
+                    continue
+                raise OSError(error, os.strerror(error), dirpath)
+            self.watches[wd] = dirpath
+
+            try:
+                entries = list(scandir(dirpath))
+            except OSError as exception:
+                logger.warning(
+                    'Unable to list directory: %r (%s)', dirpath, exception)
+                continue
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    directories.append(entry.path)
+                elif entry.is_file():
+                    paths.append(entry.path)
+        return paths
+
+    def _remove_watches(self, directory):
+        """Stop watching directory and its subdirectories.
+
+        :param directory: Directory moved out of the tree or deleted
+        :type directory: str
+
+        """
+        prefix = os.path.join(directory, '')
+        for wd, dirpath in self.watches.items():
+            if dirpath == directory or dirpath.startswith(prefix):
+                # Fails if the watch was removed with the deleted directory
+                LIBC.inotify_rm_watch(self.fd, wd)
+                del self.watches[wd]
+
+
+class PollingWatcher(object):
+
+    """Watch a directory tree by scanning it periodically.
+
+    The size and modification time of every file are compared with the
+    ones from the previous scan to detect changes.
+
+    :param directory: Base directory
+    :type directory: str
+    :param interval: Seconds between scans
+    :type interval: float
+
+    """
+
+    def __init__(self, directory, interval=POLL_INTERVAL):
+        """Scan directory tree for the first time."""
+        self.directory = directory
+        self.interval = interval
+        self.file_stats = self._scan()
+
+    def __enter__(self):
+        """Return watcher on entering context."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Nothing to clean up on exiting context."""
+
+    def read(self, changes, timeout=None):
+        """Scan directory tree and add changes to a change set.
+
+        The tree is scanned after waiting for the polling interval, which is
+        used instead of the timeout.
+
+        :param changes: Change set to add changes to
+        :type changes: ChangeSet
+        :param timeout: Ignored
+        :type timeout: float | None
+        :returns: Number of files changed
+        :rtype: int
+
+        """
+        time.sleep(self.interval)
+        file_stats = self._scan()
+
+        change_count = 0
+        for path, file_stat in file_stats.iteritems():
+            if self.file_stats.get(path) != file_stat:
+                changes.update_file(path)
+                change_count += 1
+        for path in set(self.file_stats) - set(file_stats):
+            changes.delete_file(path)
+            change_count += 1
+
+        self.file_stats = file_stats
+        return change_count
+
+    def _scan(self):
+        """Get size and modification time of every file in the tree.
+
+        :returns: Size and modification time by path
+        :rtype: dict(str, tuple(int, float))
+
+        """
+        file_stats = {}
+        for dirpath, _dirnames, filenames in walk(self.directory):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                file_stats[path] = (stat.st_size, stat.st_mtime)
+        return file_stats
+
+
+def create_watcher(directory, poll=False, interval=POLL_INTERVAL):
+    """Create watcher for a directory tree.
+
+    The directory is watched as an encoded string, so that the paths of the
+    files under it can be built from the names returned by inotify, and
+    decoded to unicode when changes are added to a ``ChangeSet``.
+
+    :param directory: Base directory
+    :type directory: str | unicode
+    :param poll: Whether to poll even if inotify is available
+    :type poll: bool
+    :param interval: Seconds between scans when polling
+    :type interval: float
+    :returns: Directory tree watcher
+    :rtype: InotifyWatcher | PollingWatcher
+
+    """
+    if isinstance(directory, unicode):
+        directory = directory.encode('utf8')
+
+    if not poll:
+        try:
+            return InotifyWatcher(directory)
+        except OSError as exception:
+            logger.warning(
+                'Unable to use inotify, polling instead (%s)', exception)
+    return PollingWatcher(directory, interval)
+
+
+def iter_batches(watcher, delay=BATCH_DELAY, max_delay=MAX_BATCH_DELAY):
+    """Yield batches of changes detected by a watcher.
+
+    A batch is yielded when there are no more changes for some time, so
+    that files copied together are indexed together, or when its oldest
+    change has waited for too long.
+
+    :param watcher: Directory tree watcher
+    :type watcher: InotifyWatcher | PollingWatcher
+    :param delay: Seconds without new changes after which a batch is yielded
+    :type delay: float
+    :param max_delay: Maximum number of seconds a change waits in a batch
+    :type max_delay: float
+    :returns: Batches of changes
+    :rtype: iterator(ChangeSet)
+
+    """
+    while True:
+        changes = ChangeSet()
+        while not changes:
+            watcher.read(changes)
+
+        deadline = time.time() + max_delay
+        while time.time() < deadline and watcher.read(changes, delay):
+            pass
+        yield changes
+
+
+def apply_changes(database, changes, detection='signature', jobs=1,
+                  cache=None):
+    """Update location database with a batch of changes.
+
+    Paths are decoded to unicode, since that's what the GPS metadata
+    schema expects.
+
+    :param database: Location database
+    :type database: pic2map.db.LocationDB
+    :param changes: Changes under the directory tree
+    :type changes: ChangeSet
+    :param detection:
+        Method used to detect JPEG files. One of the keys in
+        ``pic2map.fs.DETECTORS``.
+    :type detection: str
+    :param jobs: Number of exiftool processes to use
+    :type jobs: int
+    :param cache:
+        Cache used to avoid extracting metadata again from files that have
+        been moved
+    :type cache: pic2map.exif_cache.ExifCache | None
+    :returns: Number of rows inserted, updated and left unchanged
+    :rtype: pic2map.db.UpsertCounts
+
+    """
+    for directory in sorted(changes.deleted_directories):
+        database.delete(_decode_path(directory))
+
+    # Files that aren't pictures anymore are deleted as well
+    is_jpeg = DETECTORS[detection]
+    deleted = set(_decode_path(path) for path in changes.deleted)
+    files = []
+    for path in sorted(_decode_path(path) for path in changes.updated):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            deleted.add(path)
+            continue
+        if is_jpeg(path):
+            files.append((path, (stat.st_size, stat.st_mtime)))
+        else:
+            deleted.add(path)
+    database.delete_files(sorted(deleted))
+
+    gps_metadata_files = extract_gps_metadata(
+        skip_unchanged_files(database, files), jobs, cache=cache)
+    upsert_counts = upsert_rows(
+        database, transform_to_rows(gps_metadata_files))
+    logger.info(
+        '%d picture files with GPS metadata changed '
+        '(%d new, %d updated, %d unchanged)',
+        sum(upsert_counts),
+        upsert_counts.inserted,
+        upsert_counts.updated,
+        upsert_counts.unchanged)
+    return upsert_counts
+
+
+def _check(result):
+    """Raise error if a C library call failed.
+
+    :param result: Value returned by the call
+    :type result: int
+    :returns: The same value if the call succeeded
+    :rtype: int
+    :raises OSError: If the call failed
+
+    """
+    if result < 0:
+        error = ctypes.get_errno()
+        raise OSError(error, os.strerror(error))
+    return result
@@ -26,6 +26,7 @@ requirements = [
     'arrow',
     'python-magic',
     'pyxdg',
+    'scandir',
     'voluptuous',
 ]
 
@@ -8,46 +8,390 @@ from datetime import datetime
 
 from mock import patch
 
+from pic2map.db import (
+    MAX_CLUSTER_ZOOM,
+    LocationColumns,
+)
 from pic2map.server.app import (
+    DEFAULT_CENTER,
+    app,
+    encode_location,
     index,
+    parse_bbox,
+    parse_zoom,
+    point_to_serializable,
+    response_cache,
     row_to_serializable,
+    tile_cache,
+    wrap_longitude,
 )
 
+
+def location_columns(rows):
+    """Store rows in location columns.
+
+    :param rows:
+        Row identifier, filename, latitude, longitude and timestamp tuples
+    :type rows: list(tuple(int, unicode, float, float, int))
+    :returns: Location information columns
+    :rtype: pic2map.db.LocationColumns
+
+    """
+    columns = LocationColumns()
+    columns.extend(rows)
+    return columns
+
+
 class RouteTest(unittest.TestCase):
 
     """Route function tests."""
 
+    def setUp(self):
+        """Patch location database."""
+        self.location_db_patcher = patch('pic2map.server.app.LocationDB')
+        self.location_db_cls = self.location_db_patcher.start()
+        self.location_db = self.location_db_cls().__enter__()
+        self.generation_patcher = patch(
+            'pic2map.server.app.location_generation')
+        self.location_generation = self.generation_patcher.start()
+        self.location_generation.return_value = 1
+        self.client = app.test_client()
+        response_cache.clear()
+
+    def tearDown(self):
+        """Undo location database patching."""
+        self.generation_patcher.stop()
+        self.location_db_patcher.stop()
+
     def test_index(self):
         """Index page."""
         render_template_patcher = patch('pic2map.server.app.render_template')
-        location_db_patcher = patch('pic2map.server.app.LocationDB')
-        row_to_serializable_patcher = patch('pic2map.server.app.row_to_serializable')
         with render_template_patcher as render_template, \
-                location_db_patcher as location_db_cls, \
-                row_to_serializable_patcher as row_to_serializable_mock:
-            location_db = location_db_cls().__enter__()
-            rows = [
-                {
-                    'latitude': 0.0,
-                    'longitude': 0.0,
-                    'datetime': datetime(2015, 1, 1, 12, 34, 56),
-                },
-            ]
-            location_db.select_all.return_value = rows
-            new_row = {
-                'latitude': 0.0,
-                'longitude': 0.0,
-                'datetime': 'some datetime',
-            }
-            row_to_serializable_mock.return_value = new_row
+                app.test_request_context('/'):
+            render_template.return_value = 'page'
+            self.location_db.centroid.return_value = (1.0, 2.0)
+            self.location_db.bounds.return_value = (0.0, 1.0, 2.0, 3.0)
+            index()
+            render_template.assert_called_once_with(
+                'index.html',
+                centroid=json.dumps((1.0, 2.0)),
+                bounds=json.dumps([[0.0, 1.0], [2.0, 3.0]]),
+                max_cluster_zoom=MAX_CLUSTER_ZOOM,
+            )
+
+    def test_index_empty_database(self):
+        """Index page with no locations in the database."""
+        render_template_patcher = patch('pic2map.server.app.render_template')
+        with render_template_patcher as render_template, \
+                app.test_request_context('/'):
+            render_template.return_value = 'page'
+            self.location_db.centroid.return_value = None
+            self.location_db.bounds.return_value = None
             index()
             render_template.assert_called_once_with(
                 'index.html',
-                centroid=json.dumps(
-                    [new_row['latitude'], new_row['longitude']]),
-                rows=json.dumps([new_row]),
+                centroid=json.dumps(DEFAULT_CENTER),
+                bounds='null',
+                max_cluster_zoom=MAX_CLUSTER_ZOOM,
             )
 
+    def test_locations(self):
+        """Locations in the viewport are returned."""
+        self.location_db.select_columns.return_value = location_columns(
+            [(1, u'a.jpg', 0.5, 0.5, 1420115696)])
+        response = self.client.get(
+            '/api/locations?bbox=0,0,1,1&zoom={}'
+            .format(MAX_CLUSTER_ZOOM + 1))
+        self.assertEqual(response.status_code, 200)
+        self.assertDictEqual(
+            json.loads(response.data),
+            {
+                'zoom': MAX_CLUSTER_ZOOM + 1,
+                'truncated': False,
+                'clusters': [],
+                'locations': [
+                    {
+                        'id': 1,
+                        'latitude': 0.5,
+                        'longitude': 0.5,
+                    },
+                ],
+            },
+        )
+        self.location_db.select_columns.assert_called_once_with(
+            (0.0, 0.0, 1.0, 1.0), limit=10001)
+
+    def test_locations_clusters(self):
+        """Clusters and single locations in the viewport are returned."""
+        self.location_db.select_clusters.return_value = [
+            {
+                'count': 3,
+                'latitude': 0.25,
+                'longitude': 0.75,
+                'id': None,
+            },
+            {
+                'count': 1,
+                'latitude': 0.5,
+                'longitude': 0.5,
+                'id': 1,
+            },
+        ]
+        response = self.client.get('/api/locations?bbox=0,0,1,1&zoom=5')
+        self.assertEqual(response.status_code, 200)
+        self.assertDictEqual(
+            json.loads(response.data),
+            {
+                'zoom': 5,
+                'truncated': False,
+                'clusters': [
+                    {
+                        'count': 3,
+                        'latitude': 0.25,
+                        'longitude': 0.75,
+                    },
+                ],
+                'locations': [
+                    {
+                        'id': 1,
+                        'latitude': 0.5,
+                        'longitude': 0.5,
+                    },
+                ],
+            },
+        )
+        self.location_db.select_clusters.assert_called_once_with(
+            0.0, 0.0, 1.0, 1.0, zoom=5)
+        self.assertFalse(self.location_db.select_columns.called)
+
+    def test_locations_truncated(self):
+        """Number of locations returned is limited."""
+        self.location_db.select_columns.return_value = location_columns(
+            [(index, u'a.jpg', 0.5, 0.5, None) for index in range(3)])
+        with patch('pic2map.server.app.MAX_LOCATIONS', 2):
+            response = self.client.get('/api/locations?bbox=0,0,1,1')
+        data = json.loads(response.data)
+        self.assertTrue(data['truncated'])
+        self.assertEqual(len(data['locations']), 2)
+
+    def test_location(self):
+        """Location details are returned."""
+        self.location_db.select_location.return_value = {
+            'id': 1,
+            'filename': 'a.jpg',
+            'latitude': 0.5,
+            'longitude': 0.5,
+            'datetime': datetime(2015, 1, 1, 12, 34, 56),
+        }
+        response = self.client.get('/api/locations/1')
+        self.assertEqual(response.status_code, 200)
+        self.assertDictEqual(
+            json.loads(response.data),
+            {
+                'id': 1,
+                'filename': 'a.jpg',
+                'latitude': 0.5,
+                'longitude': 0.5,
+                'datetime': '2015/01/01 12:34:56',
+            },
+        )
+        self.location_db.select_location.assert_called_once_with(1)
+
+    def test_location_not_found(self):
+        """Not found returned for unknown locations."""
+        self.location_db.select_location.return_value = None
+        response = self.client.get('/api/locations/1')
+        self.assertEqual(response.status_code, 404)
+
+    def test_locations_binary(self):
+        """Locations are returned in binary format."""
+        self.location_db.select_points.return_value = [
+            [(1, 0.5, 0.5)],
+        ]
+        response = self.client.get('/api/locations.bin?bbox=0,0,1,1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/octet-stream')
+        self.assertEqual(len(response.data), 8 + 20)
+        self.location_db.select_points.assert_called_once_with(
+            (0.0, 0.0, 1.0, 1.0))
+
+    def test_locations_stream(self):
+        """All locations are streamed as a JSON array."""
+        self.location_db.select_column_chunks.return_value = [
+            location_columns([(1, u'a.jpg', 0.5, 0.5, 1420115696)]),
+            location_columns([
+                (2, u'b.jpg', None, None, None),
+                (3, u'c.jpg', 1.5, 2.5, None),
+            ]),
+        ]
+        response = self.client.get('/api/locations.json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/json')
+        self.assertListEqual(
+            [location['filename'] for location in json.loads(response.data)],
+            ['a.jpg', 'b.jpg', 'c.jpg'],
+        )
+        self.location_db.select_column_chunks.assert_called_once_with(None)
+
+    def test_locations_stream_empty(self):
+        """Empty JSON array is streamed if there are no locations."""
+        self.location_db.select_column_chunks.return_value = []
+        response = self.client.get('/api/locations.json')
+        self.assertListEqual(json.loads(response.data), [])
+
+    def test_locations_stream_ndjson(self):
+        """Locations in the viewport are streamed as newline delimited JSON."""
+        self.location_db.select_column_chunks.return_value = [
+            location_columns([(1, u'a.jpg', 0.5, 0.5, None)]),
+            location_columns([(2, u'b.jpg', 0.5, 0.5, None)]),
+        ]
+        response = self.client.get('/api/locations.ndjson?bbox=0,0,1,1')
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        self.assertListEqual(
+            [
+                json.loads(line)['filename']
+                for line in response.data.splitlines()
+            ],
+            ['a.jpg', 'b.jpg'],
+        )
+        self.location_db.select_column_chunks.assert_called_once_with(
+            (0.0, 0.0, 1.0, 1.0))
+
+    def test_locations_stream_invalid_bbox(self):
+        """Bad request returned for an invalid bounding box."""
+        response = self.client.get('/api/locations.json?bbox=a,b,c,d')
+        self.assertEqual(response.status_code, 400)
+
+    def test_jobs(self):
+        """Progress of the most recent jobs is returned."""
+        with patch('pic2map.server.app.JobQueue') as job_queue_cls, \
+                patch('pic2map.server.app.job_progress') as job_progress:
+            job_queue = job_queue_cls()
+            job_queue.jobs.return_value = ['job']
+            job_queue.expected_file_count.return_value = 10
+            job_progress.return_value = {'id': 1, 'state': 'running'}
+            response = self.client.get('/api/jobs?limit=5')
+        self.assertEqual(response.status_code, 200)
+        self.assertDictEqual(
+            json.loads(response.data),
+            {'jobs': [{'id': 1, 'state': 'running'}]},
+        )
+        job_queue.jobs.assert_called_once_with(5)
+        job_progress.assert_called_once_with('job', 10)
+
+    def test_jobs_invalid_limit(self):
+        """Bad request returned for an invalid limit."""
+        response = self.client.get('/api/jobs?limit=a')
+        self.assertEqual(response.status_code, 400)
+
+    def test_tile(self):
+        """Vector tiles are returned."""
+        with patch('pic2map.server.app.get_tile') as get_tile:
+            get_tile.return_value = 'data'
+            response = self.client.get('/tiles/1/0/1.pbf')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, 'data')
+        self.assertEqual(
+            response.mimetype, 'application/vnd.mapbox-vector-tile')
+        get_tile.assert_called_once_with(
+            self.location_db, tile_cache, 1, 0, 1)
+
+    def test_tile_not_found(self):
+        """Tiles outside the zoom level grid are not found."""
+        with patch('pic2map.server.app.get_tile') as get_tile:
+            for url in ['/tiles/1/2/0.pbf', '/tiles/31/0/0.pbf']:
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 404)
+        self.assertFalse(get_tile.called)
+
+    def test_cached_response(self):
+        """Responses are cached until the database generation changes."""
+        self.location_db.centroid.return_value = (1.0, 2.0)
+        self.location_db.bounds.return_value = None
+        self.client.get('/')
+        self.client.get('/')
+        self.assertEqual(self.location_db.centroid.call_count, 1)
+
+        self.location_generation.return_value = 2
+        self.client.get('/')
+        self.assertEqual(self.location_db.centroid.call_count, 2)
+
+    def test_locations_invalid_bbox(self):
+        """Invalid viewports are rejected."""
+        response = self.client.get('/api/locations?bbox=0,0,1')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(self.location_db.select_bbox.called)
+
+
+class ParseBBoxTest(unittest.TestCase):
+
+    """Bounding box argument parsing tests."""
+
+    def test_parse_bbox(self):
+        """Coordinates are reordered as expected by the database."""
+        self.assertEqual(
+            parse_bbox('-4.5,40.1,-3.5,41.2'),
+            (40.1, -4.5, 41.2, -3.5),
+        )
+
+    def test_world(self):
+        """Latitudes are clamped and longitudes cover the whole world."""
+        self.assertEqual(
+            parse_bbox('-200,-100,200,100'),
+            (-90.0, -180.0, 90.0, 180.0),
+        )
+
+    def test_antimeridian(self):
+        """Longitudes beyond the antimeridian are wrapped."""
+        self.assertEqual(
+            parse_bbox('170,0,190,10'),
+            (0.0, 170.0, 10.0, -170.0),
+        )
+
+    def test_eastern_edge(self):
+        """Eastern longitude at the antimeridian is not wrapped."""
+        self.assertEqual(
+            parse_bbox('170,0,180,10'),
+            (0.0, 170.0, 10.0, 180.0),
+        )
+
+    def test_invalid(self):
+        """Invalid bounding boxes raise an error."""
+        for bbox_str in ['', 'a,b,c,d', '0,0,1', '1,0,0,1', '0,1,1,0']:
+            with self.assertRaises(ValueError):
+                parse_bbox(bbox_str)
+
+
+class ParseZoomTest(unittest.TestCase):
+
+    """Zoom level argument parsing tests."""
+
+    def test_parse_zoom(self):
+        """Zoom level is parsed."""
+        self.assertEqual(parse_zoom('10'), 10)
+
+    def test_missing(self):
+        """Zoom level is optional."""
+        self.assertIsNone(parse_zoom(None))
+
+    def test_invalid(self):
+        """Invalid zoom levels raise an error."""
+        for zoom_str in ['a', '-1', '100']:
+            with self.assertRaises(ValueError):
+                parse_zoom(zoom_str)
+
+
+class WrapLongitudeTest(unittest.TestCase):
+
+    """Longitude wrapping tests."""
+
+    def test_wrap_longitude(self):
+        """Longitudes are wrapped to the [-180, 180) range."""
+        self.assertEqual(wrap_longitude(10.0), 10.0)
+        self.assertEqual(wrap_longitude(190.0), -170.0)
+        self.assertEqual(wrap_longitude(-190.0), 170.0)
+        self.assertEqual(wrap_longitude(180.0), -180.0)
+
 
 class RowToSerializableTest(unittest.TestCase):
 
@@ -70,3 +414,46 @@ class RowToSerializableTest(unittest.TestCase):
             new_row,
             row,
         )
+
+
+class PointToSerializableTest(unittest.TestCase):
+
+    """Point to serializable tests."""
+
+    def test_point_to_serializable(self):
+        """Identifier and coordinates are kept."""
+        self.assertDictEqual(
+            point_to_serializable((1, 0.5, 1.5)),
+            {'id': 1, 'latitude': 0.5, 'longitude': 1.5},
+        )
+
+
+class EncodeLocationTest(unittest.TestCase):
+
+    """Encode location tests."""
+
+    def test_encode_location(self):
+        """Location is encoded as a JSON object."""
+        self.assertDictEqual(
+            json.loads(encode_location(location_columns(
+                [(1, u'dir/a "b".jpg', 1.5, -2.25, 1420115696)]), 0)),
+            {
+                'filename': u'dir/a "b".jpg',
+                'latitude': 1.5,
+                'longitude': -2.25,
+                'datetime': '2015/01/01 12:34:56',
+            },
+        )
+
+    def test_missing_values(self):
+        """Missing values are encoded as null."""
+        self.assertDictEqual(
+            json.loads(encode_location(location_columns(
+                [(1, u'a.jpg', None, None, None)]), 0)),
+            {
+                'filename': u'a.jpg',
+                'latitude': None,
+                'longitude': None,
+                'datetime': None,
+            },
+        )
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""Binary location points encoding tests."""
+
+import struct
+import unittest
+
+from pic2map.server.binary import (
+    MAGIC,
+    encode_points,
+)
+
+
+def decode_points(data):
+    """Decode location points.
+
+    :param data: Encoded points
+    :type data: str
+    :returns: A row per point
+    :rtype: list(tuple(int, float, float))
+
+    """
+    magic, count = struct.unpack_from('<4sI', data)
+    assert magic == MAGIC
+    offset = 8
+    latitudes = struct.unpack_from('<{}d'.format(count), data, offset)
+    offset += count * 8
+    longitudes = struct.unpack_from('<{}d'.format(count), data, offset)
+    offset += count * 8
+    ids = struct.unpack_from('<{}I'.format(count), data, offset)
+    assert offset + count * 4 == len(data)
+    return zip(ids, latitudes, longitudes)
+
+
+class EncodePointsTest(unittest.TestCase):
+
+    """Encode points tests."""
+
+    def test_encode_points(self):
+        """Points are encoded in columns."""
+        data = encode_points([
+            [(1, 1.5, 2.5), (2, 3.5, 4.5)],
+            [(5, -1.5, -2.5)],
+        ])
+        self.assertListEqual(
+            decode_points(data),
+            [
+                (1, 1.5, 2.5),
+                (2, 3.5, 4.5),
+                (5, -1.5, -2.5),
+            ],
+        )
+
+    def test_empty(self):
+        """Header is encoded if there are no points."""
+        data = encode_points([])
+        self.assertEqual(len(data), 8)
+        self.assertListEqual(decode_points(data), [])
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""Response cache tests."""
+
+import gzip
+import unittest
+
+from StringIO import StringIO
+
+from flask import Flask
+
+from pic2map.server.cache import (
+    CachedResponse,
+    ResponseCache,
+    cached,
+)
+
+
+class ResponseCacheTest(unittest.TestCase):
+
+    """Least recently used cache tests."""
+
+    def test_get(self):
+        """Cached responses are returned."""
+        cache = ResponseCache()
+        entry = CachedResponse('etag', 'data', 'gzip data', 'text/plain')
+        cache.set(('/', 1), entry)
+        self.assertEqual(cache.get(('/', 1)), entry)
+        self.assertIsNone(cache.get(('/', 2)))
+
+    def test_max_entries(self):
+        """Least recently used responses are discarded."""
+        cache = ResponseCache(max_entries=2)
+        for key in ['a', 'b']:
+            cache.set(key, key)
+        cache.get('a')
+        cache.set('c', 'c')
+        self.assertListEqual(cache.entries.keys(), ['a', 'c'])
+
+    def test_clear(self):
+        """All responses are removed."""
+        cache = ResponseCache()
+        cache.set('a', 'a')
+        cache.clear()
+        self.assertIsNone(cache.get('a'))
+
+
+class CachedTest(unittest.TestCase):
+
+    """Cached view tests."""
+
+    def setUp(self):
+        """Create application with a cached view."""
+        self.generation = 1
+        self.call_count = 0
+        self.cache = ResponseCache()
+        app = Flask(__name__)
+
+        @app.route('/')
+        @cached(self.cache, lambda: self.generation)
+        def view():
+            """Count calls to view."""
+            self.call_count += 1
+            return 'response {}'.format(self.generation)
+
+        @app.route('/missing')
+        @cached(self.cache, lambda: self.generation)
+        def missing():
+            """Return error response."""
+            self.call_count += 1
+            return 'not found', 404
+
+        self.client = app.test_client()
+
+    def test_cached(self):
+        """View is called only when the generation changes."""
+        self.assertEqual(self.client.get('/').data, 'response 1')
+        self.assertEqual(self.client.get('/').data, 'response 1')
+        self.assertEqual(self.call_count, 1)
+
+        self.generation = 2
+        self.assertEqual(self.client.get('/').data, 'response 2')
+        self.assertEqual(self.call_count, 2)
+
+    def test_query_string(self):
+        """Responses are cached separately for each query string."""
+        self.client.get('/?a=1')
+        self.client.get('/?a=2')
+        self.assertEqual(self.call_count, 2)
+
+    def test_error_not_cached(self):
+        """Error responses are not cached."""
+        self.assertEqual(self.client.get('/missing').status_code, 404)
+        self.assertEqual(self.client.get('/missing').status_code, 404)
+        self.assertEqual(self.call_count, 2)
+
+    def test_etag(self):
+        """Not modified responses are returned if the entity tag matches."""
+        response = self.client.get('/')
+        etag = response.headers['ETag']
+        self.assertEqual(response.headers['Cache-Control'], 'no-cache')
+
+        response = self.client.get('/', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, '')
+
+        self.generation = 2
+        response = self.client.get('/', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_gzip(self):
+        """Compressed responses are returned if accepted by the client."""
+        response = self.client.get('/', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(response.headers['Vary'], 'Accept-Encoding')
+        with gzip.GzipFile(fileobj=StringIO(response.data)) as file_:
+            self.assertEqual(file_.read(), 'response 1')
+
+        response = self.client.get('/')
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(response.data, 'response 1')
+
+    def test_gzip_etag(self):
+        """Compressed responses have their own entity tag."""
+        gzip_headers = {'Accept-Encoding': 'gzip'}
+        gzip_etag = self.client.get('/', headers=gzip_headers).headers['ETag']
+        etag = self.client.get('/').headers['ETag']
+        self.assertNotEqual(gzip_etag, etag)
+
+        response = self.client.get(
+            '/', headers=dict(gzip_headers, **{'If-None-Match': gzip_etag}))
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers['ETag'], gzip_etag)
+
+        # Uncompressed tag doesn't validate the compressed representation
+        response = self.client.get(
+            '/', headers=dict(gzip_headers, **{'If-None-Match': etag}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""Mapbox Vector Tile encoding tests."""
+
+import struct
+import unittest
+
+from pic2map.server.mvt import (
+    EXTENT,
+    Layer,
+    encode_tile,
+)
+
+
+def decode_varint(data, offset):
+    """Decode variable length integer.
+
+    :param data: Encoded message
+    :type data: str
+    :param offset: Position of the integer in the message
+    :type offset: int
+    :returns: Integer and position after it
+    :rtype: tuple(int, int)
+
+    """
+    value = 0
+    shift = 0
+    while True:
+        byte = ord(data[offset])
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            return value, offset
+
+
+def decode_message(data):
+    """Decode protocol buffers message fields.
+
+    :param data: Encoded message
+    :type data: str
+    :returns: Field number and value for each field
+    :rtype: list(tuple(int, int | str))
+
+    """
+    fields = []
+    offset = 0
+    while offset < len(data):
+        key, offset = decode_varint(data, offset)
+        field_number, wire_type = key >> 3, key & 0x7
+        if wire_type == 0:
+            value, offset = decode_varint(data, offset)
+        elif wire_type == 1:
+            value = data[offset:offset + 8]
+            offset += 8
+        elif wire_type == 2:
+            length, offset = decode_varint(data, offset)
+            value = data[offset:offset + length]
+            offset += length
+        else:
+            raise ValueError('Unexpected wire type: {}'.format(wire_type))
+        fields.append((field_number, value))
+    return fields
+
+
+def decode_packed(data):
+    """Decode packed unsigned integers.
+
+    :param data: Encoded integers
+    :type data: str
+    :returns: Integers
+    :rtype: list(int)
+
+    """
+    values = []
+    offset = 0
+    while offset < len(data):
+        value, offset = decode_varint(data, offset)
+        values.append(value)
+    return values
+
+
+class LayerTest(unittest.TestCase):
+
+    """Vector tile layer tests."""
+
+    def test_empty_layer(self):
+        """Empty layer has only version, name and extent."""
+        self.assertListEqual(
+            decode_message(Layer('points').encode()),
+            [(15, 2), (1, 'points'), (5, EXTENT)],
+        )
+
+    def test_point(self):
+        """Point feature geometry and properties."""
+        layer = Layer('points')
+        layer.add_point(25, 17, {'name': u'á.jpg', 'count': 1}, feature_id=7)
+        layer.add_point(
+            300, -2, {'count': 1, 'ratio': 0.5, 'flag': True, 'delta': -3})
+
+        fields = decode_message(layer.encode())
+        features = [
+            decode_message(value)
+            for field_number, value in fields
+            if field_number == 2
+        ]
+        keys = [value for field_number, value in fields if field_number == 3]
+        values = [
+            decode_message(value)
+            for field_number, value in fields
+            if field_number == 4
+        ]
+
+        self.assertListEqual(keys, ['count', 'name', 'delta', 'flag', 'ratio'])
+        self.assertListEqual(
+            values,
+            [
+                [(5, 1)],
+                [(1, u'á.jpg'.encode('utf-8'))],
+                [(6, 5)],
+                [(7, 1)],
+                [(3, struct.pack('<d', 0.5))],
+            ],
+        )
+
+        feature_id, tags, geometry_type, geometry = features[0]
+        self.assertEqual(feature_id, (1, 7))
+        self.assertListEqual(decode_packed(tags[1]), [0, 0, 1, 1])
+        self.assertEqual(geometry_type, (3, 1))
+        self.assertListEqual(decode_packed(geometry[1]), [9, 50, 34])
+
+        tags, geometry_type, geometry = features[1]
+        self.assertListEqual(
+            decode_packed(tags[1]), [0, 0, 2, 2, 3, 3, 4, 4])
+        self.assertListEqual(decode_packed(geometry[1]), [9, 600, 3])
+
+    def test_none_properties(self):
+        """Properties without value are skipped."""
+        layer = Layer('points')
+        layer.add_point(0, 0, {'name': None})
+        fields = decode_message(layer.encode())
+        self.assertNotIn(3, [field_number for field_number, _ in fields])
+
+
+class EncodeTileTest(unittest.TestCase):
+
+    """Vector tile encoding tests."""
+
+    def test_encode_tile(self):
+        """Layers are embedded in the tile."""
+        layers = [Layer('a'), Layer('b')]
+        self.assertListEqual(
+            decode_message(encode_tile(layers)),
+            [(3, layer.encode()) for layer in layers],
+        )
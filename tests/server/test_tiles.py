@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""Map tiles tests."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import (
+    MagicMock as Mock,
+    patch,
+)
+
+from pic2map.db import MAX_CLUSTER_ZOOM
+from pic2map.server.tiles import (
+    MAX_LATITUDE,
+    TILE_FORMAT_VERSION,
+    TileCache,
+    get_tile,
+    is_valid_tile,
+    project,
+    render_tile,
+    tile_bbox,
+)
+
+
+class TileCacheTest(unittest.TestCase):
+
+    """Tile cache tests."""
+
+    def setUp(self):
+        """Create temporary directory."""
+        self.directory = tempfile.mkdtemp()
+        self.tile_cache = TileCache(os.path.join(self.directory, 'tiles'))
+
+    def tearDown(self):
+        """Remove temporary directory."""
+        shutil.rmtree(self.directory)
+
+    def test_missing_tile(self):
+        """Tiles not in cache are not found."""
+        self.assertIsNone(self.tile_cache.get(1, 0, 1, '1-1'))
+
+    def test_cached_tile(self):
+        """Tiles are found if the version matches."""
+        self.tile_cache.set(1, 0, 1, '1-1', 'data\n')
+        self.assertEqual(self.tile_cache.get(1, 0, 1, '1-1'), 'data\n')
+        self.assertIsNone(self.tile_cache.get(1, 0, 1, '1-2'))
+
+        self.tile_cache.set(1, 0, 1, '1-2', 'new data')
+        self.assertEqual(self.tile_cache.get(1, 0, 1, '1-2'), 'new data')
+        self.assertListEqual(
+            os.listdir(os.path.join(self.directory, 'tiles', '1', '0')),
+            ['1.pbf'],
+        )
+
+
+class TileGeometryTest(unittest.TestCase):
+
+    """Tile coordinates tests."""
+
+    def test_is_valid_tile(self):
+        """Tiles exist only inside the zoom level grid."""
+        self.assertTrue(is_valid_tile(0, 0, 0))
+        self.assertTrue(is_valid_tile(2, 3, 3))
+        self.assertFalse(is_valid_tile(2, 4, 0))
+        self.assertFalse(is_valid_tile(2, 0, -1))
+
+    def test_tile_bbox(self):
+        """Tile bounding boxes."""
+        self.assertEqual(
+            tile_bbox(0, 0, 0),
+            (-MAX_LATITUDE, -180.0, MAX_LATITUDE, 180.0),
+        )
+        south, west, north, east = tile_bbox(1, 1, 0)
+        self.assertAlmostEqual(south, 0.0)
+        self.assertEqual((west, north, east), (0.0, MAX_LATITUDE, 180.0))
+
+    def test_project(self):
+        """Coordinates are projected to tile coordinates."""
+        self.assertEqual(project(0.0, 0.0, 0, 0, 0), (2048, 2048))
+        self.assertEqual(project(0.0, 0.0, 1, 1, 1), (0, 0))
+        self.assertEqual(project(0.0, 0.0, 1, 0, 0), (4096, 4096))
+        self.assertEqual(project(0.0, -180.0, 0, 0, 0, 256), (0, 128))
+
+
+class RenderTileTest(unittest.TestCase):
+
+    """Tile rendering tests."""
+
+    def setUp(self):
+        """Patch vector tile encoding."""
+        self.mvt_patcher = patch('pic2map.server.tiles.mvt')
+        mvt = self.mvt_patcher.start()
+        self.layer = mvt.Layer()
+        self.layer.extent = 4096
+
+    def tearDown(self):
+        """Undo vector tile encoding patching."""
+        self.mvt_patcher.stop()
+
+    def test_clusters(self):
+        """Clusters with their centroid in the tile are rendered."""
+        location_db = Mock()
+        location_db.select_clusters.return_value = [
+            {
+                'count': 2,
+                'latitude': 10.0,
+                'longitude': -10.0,
+                'id': None,
+            },
+            {
+                'count': 1,
+                'latitude': -10.0,
+                'longitude': 10.0,
+                'id': 1,
+            },
+        ]
+        render_tile(location_db, 1, 0, 0)
+
+        location_db.select_clusters.assert_called_once_with(
+            *tile_bbox(1, 0, 0), zoom=1)
+        point_x, point_y = project(10.0, -10.0, 1, 0, 0)
+        self.layer.add_point.assert_called_once_with(
+            point_x, point_y, {'count': 2}, None)
+
+    def test_locations(self):
+        """Locations are rendered above the maximum cluster zoom."""
+        zoom = MAX_CLUSTER_ZOOM + 1
+        location_db = Mock()
+        location_db.select_points.return_value = [
+            [(1, 0.0, 0.0)],
+        ]
+        tile_count = 2 ** zoom
+        render_tile(location_db, zoom, tile_count / 2, tile_count / 2)
+
+        self.assertTrue(location_db.select_points.called)
+        self.layer.add_point.assert_called_once_with(0, 0, {'count': 1}, 1)
+
+
+class GetTileTest(unittest.TestCase):
+
+    """Cached tile tests."""
+
+    def test_cached(self):
+        """Cached tiles are not rendered."""
+        location_db = Mock()
+        location_db.cluster_version.return_value = '1-1'
+        tile_cache = Mock()
+        tile_cache.get.return_value = 'data'
+        with patch('pic2map.server.tiles.render_tile') as render_tile_mock:
+            data = get_tile(location_db, tile_cache, 1, 0, 1)
+        self.assertEqual(data, 'data')
+        self.assertFalse(render_tile_mock.called)
+        tile_cache.get.assert_called_once_with(
+            1, 0, 1, '{}-1-1'.format(TILE_FORMAT_VERSION))
+
+    def test_not_cached(self):
+        """Tiles are rendered and cached if needed."""
+        location_db = Mock()
+        location_db.cluster_version.return_value = '1-1'
+        tile_cache = Mock()
+        tile_cache.get.return_value = None
+        with patch('pic2map.server.tiles.render_tile') as render_tile_mock:
+            render_tile_mock.return_value = 'data'
+            data = get_tile(location_db, tile_cache, 1, 0, 1)
+        self.assertEqual(data, 'data')
+        tile_cache.set.assert_called_once_with(
+            1, 0, 1, '{}-1-1'.format(TILE_FORMAT_VERSION), 'data')
+
+    def test_version_zoom(self):
+        """Tile version is based on clusters at the maximum cluster zoom."""
+        zoom = MAX_CLUSTER_ZOOM + 2
+        location_db = Mock()
+        tile_cache = Mock()
+        get_tile(location_db, tile_cache, zoom, 0, 0)
+        location_db.cluster_version.assert_called_once_with(
+            *tile_bbox(zoom, 0, 0), zoom=MAX_CLUSTER_ZOOM)
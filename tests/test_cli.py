@@ -19,9 +19,13 @@ from pic2map.cli import (
     count,
     main,
     parse_arguments,
+    positive_integer,
     remove,
     serve,
+    status,
     valid_directory,
+    watch,
+    worker,
 )
 
 
@@ -61,49 +65,149 @@ class CommandFunctionTests(unittest.TestCase):
 
     def setUp(self):
         """Patch dependencies."""
-        self.tree_explorer_patcher = patch('pic2map.cli.TreeExplorer')
-        self.tree_explorer_cls = self.tree_explorer_patcher.start()
-
-        self.filter_gps_metadata_patcher = (
-            patch('pic2map.cli.filter_gps_metadata'))
-        self.filter_gps_metadata = self.filter_gps_metadata_patcher.start()
-
-        self.transform_metadata_to_row_patcher = (
-            patch('pic2map.cli.transform_metadata_to_row'))
-        self.transform_metadata_to_row = (
-            self.transform_metadata_to_row_patcher.start())
-
-        self.location_db_patcher = patch('pic2map.cli.LocationDB')
-        self.location_cls = self.location_db_patcher.start()
-
+        self.patchers = {
+            name: patch('pic2map.cli.{}'.format(name))
+            for name in [
+                'ExifCache',
+                'LocationDB',
+                'JobQueue',
+                'apply_changes',
+                'create_watcher',
+                'iter_batches',
+                'job_progress',
+                'run_job',
+            ]
+        }
+        self.mocks = {
+            name: patcher.start()
+            for name, patcher in self.patchers.iteritems()
+        }
+        self.location_cls = self.mocks['LocationDB']
 
     def tearDown(self):
         """Undo the patching."""
-        self.tree_explorer_patcher.stop()
-        self.filter_gps_metadata_patcher.stop()
-        self.transform_metadata_to_row_patcher.stop()
-        self.location_db_patcher.stop()
-
+        for patcher in self.patchers.itervalues():
+            patcher.stop()
 
     def test_add(self):
-        """Add command function."""
-        tree_explorer = self.tree_explorer_cls()
-        paths = Mock()
-        tree_explorer.paths.return_value = paths
-        metadata_record = Mock()
-        metadata_records = [metadata_record]
-        self.filter_gps_metadata.return_value = metadata_records
-        row = Mock()
-        self.transform_metadata_to_row.return_value = row
+        """Add command function runs a job in the foreground."""
         database = self.location_cls().__enter__()
+        job_queue = self.mocks['JobQueue']()
+        self.mocks['run_job'].return_value = {
+            'rows_inserted': 1,
+            'rows_updated': 0,
+            'rows_unchanged': 0,
+        }
 
         directory = 'some directory'
-        args = argparse.Namespace(directory=directory)
+        args = argparse.Namespace(
+            directory=directory,
+            detection='signature',
+            incremental=False,
+            jobs=2,
+            no_sync=False,
+            queue=False,
+            walk_threads=4,
+        )
         add(args)
-        self.tree_explorer_cls.assert_called_with(directory)
-        self.filter_gps_metadata.assert_called_once_with(paths)
-        self.transform_metadata_to_row.assert_called_once_with(metadata_record)
-        database.insert.assert_called_with([row])
+        job_queue.submit.assert_called_once_with(
+            directory,
+            {
+                'detection': 'signature',
+                'incremental': False,
+                'jobs': 2,
+                'no_sync': False,
+                'walk_threads': 4,
+            },
+        )
+        job_queue.claim.assert_called_once_with(job_queue.submit())
+        self.mocks['run_job'].assert_called_once_with(
+            database, job_queue, job_queue.claim())
+
+    def test_add_queue(self):
+        """Add command function only queues a job."""
+        job_queue = self.mocks['JobQueue']()
+
+        args = argparse.Namespace(
+            directory='some directory',
+            detection='signature',
+            incremental=True,
+            jobs=1,
+            no_sync=True,
+            queue=True,
+            walk_threads=1,
+        )
+        add(args)
+        self.assertEqual(
+            job_queue.submit.call_args[0][0],
+            os.path.abspath('some directory'))
+        self.assertFalse(job_queue.claim.called)
+        self.assertFalse(self.mocks['run_job'].called)
+
+    def test_worker(self):
+        """Worker command function runs jobs until none is left."""
+        database = self.location_cls().__enter__()
+        job_queue = self.mocks['JobQueue']()
+        jobs = [{'id': 1}, {'id': 2}]
+        job_queue.claim.side_effect = jobs + [None]
+        self.mocks['run_job'].side_effect = [ValueError('failed'), None]
+
+        worker(argparse.Namespace())
+        self.assertListEqual(
+            self.mocks['run_job'].call_args_list,
+            [((database, job_queue, job),) for job in jobs],
+        )
+
+    def test_status(self):
+        """Status command function prints jobs progress."""
+        job_queue = self.mocks['JobQueue']()
+        job_queue.jobs.return_value = ['job']
+        self.mocks['job_progress'].return_value = {
+            'id': 1,
+            'directory': 'some directory',
+            'state': 'running',
+            'files_seen': 50,
+            'files_extracted': 40,
+            'rows_inserted': 30,
+            'rows_updated': 0,
+            'rate': 5.0,
+            'eta': 10.0,
+            'error': None,
+        }
+
+        with patch('sys.stdout', new_callable=StringIO) as stdout:
+            status(argparse.Namespace(limit=5))
+        job_queue.jobs.assert_called_once_with(5)
+        self.assertEqual(
+            stdout.getvalue(),
+            '   1 running  some directory: 50 files seen, 40 extracted, '
+            '30 inserted, 0 updated (5.0 files/s, ETA 10s)\n')
+
+    def test_watch(self):
+        """Watch command function applies batches of changes."""
+        database = self.location_cls().__enter__()
+        watcher = self.mocks['create_watcher']()
+        self.mocks['iter_batches'].return_value = ['first', 'second']
+
+        args = argparse.Namespace(
+            directory='some directory',
+            detection='extension',
+            jobs=2,
+            poll=True,
+            interval=3,
+        )
+        watch(args)
+        self.mocks['create_watcher'].assert_called_with(
+            'some directory', True, 3)
+        self.mocks['iter_batches'].assert_called_once_with(watcher)
+        self.assertListEqual(
+            self.mocks['apply_changes'].call_args_list,
+            [
+                ((database, changes, 'extension', 2,
+                  self.mocks['ExifCache']()),)
+                for changes in ['first', 'second']
+            ],
+        )
 
     def test_remove(self):
         """Remove command function."""
@@ -166,6 +270,25 @@ class ValidDirectoryTest(unittest.TestCase):
             os.rmdir(temp_directory)
 
 
+class PositiveIntegerTest(unittest.TestCase):
+
+    """Positive integer test cases."""
+
+    def test_positive_integer(self):
+        """Positive integer."""
+        self.assertEqual(positive_integer('4'), 4)
+
+    def test_zero(self):
+        """Zero is not a positive integer."""
+        with self.assertRaises(argparse.ArgumentTypeError):
+            positive_integer('0')
+
+    def test_not_a_number(self):
+        """Not a number."""
+        with self.assertRaises(argparse.ArgumentTypeError):
+            positive_integer('four')
+
+
 class ParseArgumentsTest(unittest.TestCase):
 
     """Parse arguments test case."""
@@ -177,8 +300,65 @@ class ParseArgumentsTest(unittest.TestCase):
             valid_directory_func.return_value = directory
             args = parse_arguments(['add', directory])
             self.assertEqual(args.directory, directory)
+            self.assertFalse(args.incremental)
+            self.assertEqual(args.jobs, 1)
+            self.assertEqual(args.detection, 'signature')
+            self.assertEqual(args.walk_threads, 1)
+            self.assertFalse(args.no_sync)
+            self.assertFalse(args.queue)
             self.assertEqual(args.func, add)
 
+    def test_add_incremental_command(self):
+        """Add command in incremental mode."""
+        directory = 'some directory'
+        with patch('pic2map.cli.valid_directory') as valid_directory_func:
+            valid_directory_func.return_value = directory
+            args = parse_arguments(['add', '--incremental', directory])
+            self.assertTrue(args.incremental)
+
+    def test_add_jobs_command(self):
+        """Add command with multiple exiftool processes."""
+        directory = 'some directory'
+        with patch('pic2map.cli.valid_directory') as valid_directory_func:
+            valid_directory_func.return_value = directory
+            args = parse_arguments(['add', '--jobs', '4', directory])
+            self.assertEqual(args.jobs, 4)
+
+    def test_add_no_sync_command(self):
+        """Add command without syncing data to disk."""
+        directory = 'some directory'
+        with patch('pic2map.cli.valid_directory') as valid_directory_func:
+            valid_directory_func.return_value = directory
+            args = parse_arguments(['add', '--no-sync', directory])
+            self.assertTrue(args.no_sync)
+
+    def test_add_detection_command(self):
+        """Add command with a different detection method."""
+        directory = 'some directory'
+        with patch('pic2map.cli.valid_directory') as valid_directory_func:
+            valid_directory_func.return_value = directory
+            args = parse_arguments(['add', '--detection', 'magic', directory])
+            self.assertEqual(args.detection, 'magic')
+
+    def test_add_queue_command(self):
+        """Add command that only queues a job."""
+        directory = 'some directory'
+        with patch('pic2map.cli.valid_directory') as valid_directory_func:
+            valid_directory_func.return_value = directory
+            args = parse_arguments(['add', '--queue', directory])
+            self.assertTrue(args.queue)
+
+    def test_watch_command(self):
+        """Watch command."""
+        directory = 'some directory'
+        with patch('pic2map.cli.valid_directory') as valid_directory_func:
+            valid_directory_func.return_value = directory
+            args = parse_arguments(['watch', '--poll', directory])
+            self.assertEqual(args.directory, directory)
+            self.assertTrue(args.poll)
+            self.assertEqual(args.interval, 5)
+            self.assertEqual(args.func, watch)
+
     def test_remove(self):
         """Remove command."""
         directory = 'some directory'
@@ -193,6 +373,17 @@ class ParseArgumentsTest(unittest.TestCase):
         args = parse_arguments(['count'])
         self.assertEqual(args.func, count)
 
+    def test_worker_command(self):
+        """Worker command."""
+        args = parse_arguments(['worker'])
+        self.assertEqual(args.func, worker)
+
+    def test_status_command(self):
+        """Status command."""
+        args = parse_arguments(['status', '--limit', '3'])
+        self.assertEqual(args.limit, 3)
+        self.assertEqual(args.func, status)
+
     def test_serve_command(self):
         """Serve command."""
         args = parse_arguments(['serve'])
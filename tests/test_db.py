@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 """Test database functionality."""
 
+import math
 import os
 import shutil
 import sqlite3
@@ -11,7 +12,10 @@ from contextlib import closing
 from datetime import datetime
 
 from dateutil.tz import tzutc
-from mock import patch
+from mock import (
+    MagicMock as Mock,
+    patch,
+)
 
 from sqlalchemy.exc import NoSuchTableError
 from sqlalchemy.types import (
@@ -21,10 +25,16 @@ from sqlalchemy.types import (
 
 
 from pic2map.db import (
+    MISSING_TIMESTAMP,
     Database,
     LocationDB,
+    UpsertCounts,
+    _register_math_functions,
+    cluster_cell,
+    location_generation,
     transform_metadata_to_row,
 )
+from pic2map.util import centroid
 
 
 class DatabaseTest(unittest.TestCase):
@@ -104,6 +114,12 @@ class LocationDBTest(unittest.TestCase):
         self.base_directory_patcher.stop()
         shutil.rmtree(self.directory)
 
+    def assertCoordinatesAlmostEqual(self, first, second):
+        """Check that two pairs of coordinates are almost equal."""
+        self.assertEqual(len(first), len(second))
+        for first_value, second_value in zip(first, second):
+            self.assertAlmostEqual(first_value, second_value)
+
     def test_database_exists(self):
         """Database not create if exists."""
         filename = os.path.join(self.directory, 'location.db')
@@ -114,10 +130,26 @@ class LocationDBTest(unittest.TestCase):
 
         location_db = LocationDB()
         self.assertListEqual(
-            location_db.location_table.columns.keys(),
+            location_db.location_table.columns.keys()[:2],
             ['column_1', 'column_2'],
         )
 
+    def test_upgrade_database(self):
+        """Missing columns are added to an existing location table."""
+        filename = os.path.join(self.directory, 'location.db')
+        with closing(sqlite3.connect(filename)) as connection:
+            with closing(connection.cursor()) as cursor:
+                cursor.execute(
+                    'CREATE TABLE location '
+                    '(filename TEXT, latitude FLOAT, longitude FLOAT, '
+                    'datetime DATETIME)')
+
+        location_db = LocationDB()
+        self.assertListEqual(
+            location_db.location_table.columns.keys(),
+            ['filename', 'latitude', 'longitude', 'datetime', 'size', 'mtime'],
+        )
+
     def test_create_database(self):
         """Create database file."""
         LocationDB()
@@ -141,7 +173,7 @@ class LocationDBTest(unittest.TestCase):
             },
         ]
         with LocationDB() as location_db:
-            location_db.insert(rows)
+            self.assertEqual(location_db.insert(rows), 2)
 
         filename = os.path.join(self.directory, 'location.db')
         with closing(sqlite3.connect(filename)) as connection:
@@ -149,6 +181,125 @@ class LocationDBTest(unittest.TestCase):
                 result = cursor.execute('SELECT COUNT(*) FROM location')
                 self.assertListEqual(result.fetchall(), [(2,)])
 
+    def test_insert_chunks(self):
+        """Insert records in database in multiple transactions."""
+        rows = [
+            {
+                'filename': '{}.jpg'.format(index),
+                'latitude': 1.2,
+                'longitude': 2.1,
+                'datetime': datetime(2015, 1, 1, 12, 34, 56)
+            }
+            for index in range(5)
+        ]
+        with LocationDB() as location_db:
+            self.assertEqual(location_db.insert(iter(rows), chunk_size=2), 5)
+            self.assertEqual(location_db.loaded_row_count, 5)
+            self.assertEqual(location_db.insert([]), 0)
+            self.assertEqual(location_db.count(), 5)
+
+    def test_upsert(self):
+        """Insert new records and update the modified ones."""
+        rows = [
+            {
+                'filename': 'a.jpg',
+                'latitude': 1.2,
+                'longitude': 2.1,
+                'datetime': datetime(2015, 1, 1, 12, 34, 56),
+                'size': 1024,
+                'mtime': 1.5,
+            },
+            {
+                'filename': 'b.jpg',
+                'latitude': 3.4,
+                'longitude': 4.3,
+                'datetime': datetime(2015, 1, 1, 12, 34, 56),
+                'size': 1024,
+                'mtime': 1.5,
+            },
+        ]
+        with LocationDB() as location_db:
+            self.assertEqual(
+                location_db.upsert(rows[:1]),
+                UpsertCounts(1, 0, 0),
+            )
+
+            rows[0] = dict(rows[0], latitude=5.6, mtime=2.5)
+            rows.append(dict(rows[1], filename='c.jpg'))
+            self.assertEqual(
+                location_db.upsert(rows, chunk_size=2),
+                UpsertCounts(2, 1, 0),
+            )
+            self.assertEqual(
+                location_db.upsert(rows),
+                UpsertCounts(0, 0, 3),
+            )
+            self.assertEqual(location_db.loaded_row_count, 4)
+
+            rows = [tuple(row) for row in location_db.select_all()]
+        self.assertListEqual(
+            rows,
+            [
+                (u'a.jpg', 5.6, 2.1, datetime(2015, 1, 1, 12, 34, 56),
+                 1024, 2.5),
+                (u'b.jpg', 3.4, 4.3, datetime(2015, 1, 1, 12, 34, 56),
+                 1024, 1.5),
+                (u'c.jpg', 3.4, 4.3, datetime(2015, 1, 1, 12, 34, 56),
+                 1024, 1.5),
+            ],
+        )
+
+    def test_upsert_missing_values(self):
+        """Missing values are stored as NULL."""
+        with LocationDB() as location_db:
+            self.assertEqual(
+                location_db.upsert([{
+                    'filename': 'a.jpg',
+                    'latitude': 1.2,
+                    'longitude': 2.1,
+                }]),
+                UpsertCounts(1, 0, 0),
+            )
+            row = location_db.select_all().first()
+        self.assertIsNone(row['datetime'])
+        self.assertIsNone(row['size'])
+
+    def test_bulk_load(self):
+        """Connection settings are restored after bulk loading rows."""
+        with LocationDB() as location_db:
+            connection = location_db.connection
+            journal_mode = connection.execute('PRAGMA journal_mode').scalar()
+            synchronous = connection.execute('PRAGMA synchronous').scalar()
+            cache_size = connection.execute('PRAGMA cache_size').scalar()
+
+            with location_db.bulk_load(synchronous=False):
+                self.assertEqual(
+                    connection.execute('PRAGMA journal_mode').scalar(),
+                    'wal',
+                )
+                self.assertEqual(
+                    connection.execute('PRAGMA synchronous').scalar(), 0)
+                location_db.insert([{
+                    'filename': 'a.jpg',
+                    'latitude': 1.2,
+                    'longitude': 2.1,
+                    'datetime': datetime(2015, 1, 1, 12, 34, 56)
+                }])
+
+            self.assertEqual(
+                connection.execute('PRAGMA journal_mode').scalar(),
+                journal_mode,
+            )
+            self.assertEqual(
+                connection.execute('PRAGMA synchronous').scalar(),
+                synchronous,
+            )
+            self.assertEqual(
+                connection.execute('PRAGMA cache_size').scalar(),
+                cache_size,
+            )
+            self.assertEqual(location_db.count(), 1)
+
     def test_select_all(self):
         """Select all rows from location table."""
         filename = os.path.join(self.directory, 'location.db')
@@ -165,7 +316,734 @@ class LocationDBTest(unittest.TestCase):
             rows = result.fetchall()
             self.assertEqual(len(rows), 1)
             row = rows[0]
-            self.assertSequenceEqual(row, (u'Hello world!',))
+            self.assertEqual(row['name'], u'Hello world!')
+
+    def test_select_bbox(self):
+        """Select rows inside a bounding box."""
+        rows = [
+            {
+                'filename': '{}.jpg'.format(index),
+                'latitude': latitude,
+                'longitude': longitude,
+            }
+            for index, (latitude, longitude) in enumerate([
+                (40.4, -3.7),
+                (40.5, -3.6),
+                (41.4, 2.2),
+                (-33.9, 151.2),
+            ])
+        ]
+        with LocationDB() as location_db:
+            location_db.insert(rows)
+            filenames = [
+                row['filename']
+                for row in location_db.select_bbox(40.0, -4.0, 41.0, -3.0)
+            ]
+        self.assertListEqual(sorted(filenames), [u'0.jpg', u'1.jpg'])
+
+    def test_select_bbox_antimeridian(self):
+        """Select rows inside a bounding box that crosses the antimeridian."""
+        rows = [
+            {
+                'filename': '{}.jpg'.format(index),
+                'latitude': 0.0,
+                'longitude': longitude,
+            }
+            for index, longitude in enumerate([179.5, -179.5, 0.0])
+        ]
+        with LocationDB() as location_db:
+            location_db.insert(rows)
+            filenames = [
+                row['filename']
+                for row in location_db.select_bbox(-1.0, 179.0, 1.0, -179.0)
+            ]
+        self.assertListEqual(sorted(filenames), [u'0.jpg', u'1.jpg'])
+
+    def test_select_bbox_limit(self):
+        """Number of rows selected inside a bounding box is limited."""
+        rows = [
+            {
+                'filename': '{}.jpg'.format(index),
+                'latitude': 0.0,
+                'longitude': longitude,
+            }
+            for index, longitude in enumerate([179.5, -179.5, 0.0])
+        ]
+        with LocationDB() as location_db:
+            location_db.insert(rows)
+            self.assertEqual(
+                len(location_db.select_bbox(
+                    -1.0, 179.0, 1.0, -179.0, limit=1).fetchall()),
+                1,
+            )
+            self.assertEqual(
+                len(location_db.select_bbox(
+                    -1.0, -180.0, 1.0, 180.0, limit=2).fetchall()),
+                2,
+            )
+
+    def test_select_columns(self):
+        """Select location information in columns."""
+        rows = [
+            {
+                'filename': u'a/1.jpg',
+                'latitude': 1.0,
+                'longitude': 2.0,
+                'datetime': datetime(2015, 1, 1, 12, 34, 56),
+            },
+            {
+                'filename': u'a/2.jpg',
+                'latitude': 3.0,
+                'longitude': 4.0,
+                'datetime': None,
+            },
+            {
+                'filename': u'b/3.jpg',
+                'latitude': None,
+                'longitude': None,
+                'datetime': None,
+            },
+        ]
+        with LocationDB() as location_db:
+            location_db.insert(rows)
+            columns = location_db.select_columns()
+            bbox_columns = location_db.select_columns((0.0, 0.0, 2.0, 3.0))
+            limit_columns = location_db.select_columns(limit=1)
+
+        self.assertEqual(len(columns), 3)
+        self.assertListEqual(columns.ids.tolist(), [1, 2, 3])
+        self.assertListEqual(
+            [columns.filename(index) for index in range(3)],
+            [u'a/1.jpg', u'a/2.jpg', u'b/3.jpg'],
+        )
+        self.assertListEqual(columns.directories, [u'a', u'b'])
+        self.assertListEqual(columns.latitudes[:2].tolist(), [1.0, 3.0])
+        self.assertTrue(math.isnan(columns.latitudes[2]))
+        self.assertListEqual(
+            columns.timestamps.tolist(),
+            [1420115696, MISSING_TIMESTAMP, MISSING_TIMESTAMP],
+        )
+        self.assertEqual(
+            columns.datetime(0), datetime(2015, 1, 1, 12, 34, 56))
+        self.assertIsNone(columns.datetime(1))
+
+        self.assertEqual(len(bbox_columns), 1)
+        self.assertEqual(bbox_columns.filename(0), u'a/1.jpg')
+        self.assertEqual(len(limit_columns), 1)
+
+    def test_select_column_chunks(self):
+        """Select location information in columns chunk by chunk."""
+        rows = [
+            {'filename': u'a/{}.jpg'.format(index)} for index in range(5)
+        ]
+        with LocationDB() as location_db:
+            location_db.insert(rows)
+            chunks = list(location_db.select_column_chunks(chunk_size=2))
+
+        self.assertListEqual([len(columns) for columns in chunks], [2, 2, 1])
+        self.assertListEqual(
+            [
+                columns.filename(index)
+                for columns in chunks
+                for index in range(len(columns))
+            ],
+            [row['filename'] for row in rows],
+        )
+
+    def test_select_points(self):
+        """Select identifiers and coordinates of located rows."""
+        rows = [
+            {
+                'filename': u'a.jpg',
+                'latitude': 1.0,
+                'longitude': 2.0,
+                'datetime': datetime(2015, 1, 1, 12, 34, 56),
+            },
+            {
+                'filename': u'b.jpg',
+                'latitude': None,
+                'longitude': None,
+                'datetime': None,
+            },
+            {
+                'filename': u'c.jpg',
+                'latitude': 3.0,
+                'longitude': 4.0,
+                'datetime': None,
+            },
+        ]
+        with LocationDB() as location_db:
+            location_db.insert(rows)
+            points = [
+                row
+                for chunk in location_db.select_points()
+                for row in chunk
+            ]
+            bbox_points = [
+                row
+                for chunk in location_db.select_points((0.0, 0.0, 2.0, 3.0))
+                for row in chunk
+            ]
+
+        self.assertListEqual(sorted(points), [(1, 1.0, 2.0), (3, 3.0, 4.0)])
+        self.assertListEqual(bbox_points, [(1, 1.0, 2.0)])
+
+    def test_select_clusters(self):
+        """Select location clusters inside a bounding box."""
+        rows = [
+            {
+                'filename': '{}.jpg'.format(index),
+                'latitude': latitude,
+                'longitude': longitude,
+                'datetime': datetime(2015, 1, 1, 12, 34, 56),
+            }
+            for index, (latitude, longitude) in enumerate([
+                (40.4, -3.7),
+                (40.5, -3.6),
+                (41.4, 2.2),
+                (-33.9, 151.2),
+            ])
+        ]
+        with LocationDB() as location_db:
+            location_db.insert(rows)
+            clusters = [
+                tuple(row)
+                for row in location_db.select_clusters(
+                    30.0, -10.0, 50.0, 10.0, zoom=2)
+            ]
+        single_location, cluster = sorted(clusters)
+        self.assertTupleEqual(single_location, (1, 41.4, 2.2, 3))
+        count, latitude, longitude, row_id = cluster
+        self.assertEqual(count, 2)
+        self.assertAlmostEqual(latitude, 40.45)
+        self.assertAlmostEqual(longitude, -3.65)
+        self.assertIsNone(row_id)
+
+    def test_select_clusters_antimeridian(self):
+        """Select clusters inside a bounding box crossing the antimeridian."""
+        rows = [
+            {
+                'filename': '{}.jpg'.format(index),
+                'latitude': 0.0,
+                'longitude': longitude,
+            }
+            for index, longitude in enumerate([179.5, -179.5, 0.0])
+        ]
+        with LocationDB() as location_db:
+            location_db.insert(rows)
+            ids = [
+                row['id']
+                for row in location_db.select_clusters(
+                    -1.0, 179.0, 1.0, -179.0, zoom=5)
+            ]
+        self.assertListEqual(sorted(ids), [1, 2])
+
+    def test_select_location(self):
+        """Select location information for a row identifier."""
+        rows = [
+            {
+                'filename': u'a.jpg',
+                'latitude': 1.0,
+                'longitude': 2.0,
+                'datetime': datetime(2015, 1, 1, 12, 34, 56),
+            },
+        ]
+        with LocationDB() as location_db:
+            location_db.insert(rows)
+            row = location_db.select_location(1)
+            self.assertIsNone(location_db.select_location(2))
+        self.assertDictEqual(dict(row), dict(rows[0], id=1))
+
+    def test_cluster_sync(self):
+        """Clusters are updated when rows are modified or deleted."""
+        rows = [
+            {
+                'filename': '{}.jpg'.format(index),
+                'latitude': 1.0,
+                'longitude': 1.0,
+            }
+            for index in range(3)
+        ]
+
+        def select_clusters(location_db):
+            """Get clusters in the whole world at zoom level 0."""
+            return [
+                (row['count'], row['id'])
+                for row in location_db.select_clusters(
+                    -90.0, -180.0, 90.0, 180.0, zoom=0)
+            ]
+
+        with LocationDB() as location_db:
+            location_db.insert(rows)
+            self.assertListEqual(select_clusters(location_db), [(3, None)])
+
+            location_db.upsert([dict(rows[0], longitude=-100.0)])
+            self.assertListEqual(
+                sorted(select_clusters(location_db)),
+                [(1, 1), (2, None)],
+            )
+
+            location_db.delete_files(['1.jpg'])
+            self.assertListEqual(
+                sorted(select_clusters(location_db)),
+                [(1, 1), (1, 3)],
+            )
+
+            location_db.delete_files(['0.jpg', '2.jpg'])
+            self.assertListEqual(select_clusters(location_db), [])
+
+    def test_cluster_version(self):
+        """Cluster version changes only when locations in the area change."""
+        row = {
+            'filename': 'a.jpg',
+            'latitude': 1.0,
+            'longitude': 1.0,
+        }
+        with LocationDB() as location_db:
+            def versions():
+                """Get version of an area with changes and one without."""
+                return (
+                    location_db.cluster_version(0.0, 0.0, 2.0, 2.0, zoom=10),
+                    location_db.cluster_version(
+                        -2.0, -2.0, -1.0, -1.0, zoom=10),
+                )
+
+            initial_versions = versions()
+            location_db.insert([row])
+            inserted_versions = versions()
+            location_db.delete_files(['a.jpg'])
+            deleted_versions = versions()
+            location_db.insert([row])
+            reinserted_versions = versions()
+
+        self.assertEqual(
+            len(set(version for version, _ in [
+                initial_versions,
+                inserted_versions,
+                deleted_versions,
+                reinserted_versions,
+            ])),
+            4,
+        )
+        self.assertEqual(
+            len(set(version for _, version in [
+                initial_versions,
+                inserted_versions,
+                deleted_versions,
+                reinserted_versions,
+            ])),
+            1,
+        )
+
+    def test_cluster_chunk_changes(self):
+        """Clusters match the locations after changes in many cells."""
+        rows = [
+            {
+                'filename': '{}.jpg'.format(index),
+                'latitude': (index * 7.3) % 180.0 - 90.0,
+                'longitude': (index * 13.1) % 360.0 - 180.0,
+            }
+            for index in range(200)
+        ]
+        moved_rows = [
+            dict(row, latitude=-row['latitude']) for row in rows[::3]
+        ]
+        deleted_filenames = [row['filename'] for row in rows[1::3]]
+
+        with LocationDB() as location_db:
+            location_db.insert(rows)
+            location_db.upsert(moved_rows)
+            location_db.delete_files(deleted_filenames)
+
+            locations = location_db.connection.execute(
+                'SELECT latitude, longitude, rowid FROM location').fetchall()
+            expected_clusters = {}
+            for latitude, longitude, row_id in locations:
+                for zoom in range(17):
+                    x, y = cluster_cell(latitude, longitude, zoom)
+                    count, id_sum = expected_clusters.get(
+                        (zoom, x, y), (0, 0))
+                    expected_clusters[(zoom, x, y)] = (
+                        count + 1, id_sum + row_id)
+
+            clusters = dict(
+                (tuple(row[:3]), tuple(row[3:]))
+                for row in location_db.connection.execute(
+                    'SELECT zoom, x, y, count, id_sum FROM location_cluster '
+                    'WHERE count > 0')
+            )
+            pending_changes = location_db.connection.execute(
+                'SELECT (SELECT COUNT(*) FROM location_cluster_change) + '
+                '(SELECT COUNT(*) FROM location_cluster_delta)').scalar()
+
+        self.assertDictEqual(clusters, expected_clusters)
+        self.assertEqual(pending_changes, 0)
+
+    def test_cluster_bulk_load(self):
+        """Cluster changes are applied in batches during bulk loads."""
+        rows = [
+            {
+                'filename': '{}.jpg'.format(index),
+                'latitude': 1.0,
+                'longitude': 1.0,
+            }
+            for index in range(3)
+        ]
+
+        def cluster_count(location_db):
+            """Get number of locations in clusters at zoom level 0."""
+            return sum(
+                row['count']
+                for row in location_db.select_clusters(
+                    -90.0, -180.0, 90.0, 180.0, zoom=0)
+            )
+
+        with LocationDB() as location_db, \
+                patch('pic2map.db.CLUSTER_APPLY_SIZE', 2):
+            with location_db.bulk_load():
+                location_db.insert(rows[:1])
+                self.assertEqual(cluster_count(location_db), 0)
+                location_db.insert(rows[1:2])
+                self.assertEqual(cluster_count(location_db), 2)
+                location_db.insert(rows[2:])
+                self.assertEqual(cluster_count(location_db), 2)
+                generation = location_db.generation()
+            self.assertEqual(cluster_count(location_db), 3)
+            self.assertEqual(location_db.generation(), generation + 1)
+
+    def test_cluster_cancelled_changes(self):
+        """Cluster version doesn't change for changes that cancel out."""
+        row = {
+            'filename': 'a.jpg',
+            'latitude': 1.0,
+            'longitude': 1.0,
+        }
+        with LocationDB() as location_db:
+            location_db.insert([row])
+            version = location_db.cluster_version(
+                0.0, 0.0, 2.0, 2.0, zoom=10)
+            with location_db.bulk_load():
+                location_db.upsert([dict(row, latitude=-1.0)])
+                location_db.upsert([row])
+            self.assertEqual(
+                location_db.cluster_version(0.0, 0.0, 2.0, 2.0, zoom=10),
+                version,
+            )
+
+    def test_cluster_outdated_triggers(self):
+        """Cluster triggers from older versions are replaced."""
+        with LocationDB() as location_db:
+            for statement in [
+                    'DROP TRIGGER location_cluster_insert',
+                    'DROP TABLE location_cluster_change',
+                    'DROP TABLE location_cluster_delta',
+                    'CREATE TRIGGER location_cluster_insert '
+                    'AFTER INSERT ON location BEGIN '
+                    'UPDATE location_cluster SET count = count + 1; '
+                    'END',
+            ]:
+                location_db.connection.execute(statement)
+
+        with LocationDB() as location_db:
+            location_db.insert(
+                [{'filename': 'a.jpg', 'latitude': 1.0, 'longitude': 1.0}])
+            rows = location_db.select_clusters(
+                0.0, 0.0, 2.0, 2.0, zoom=10).fetchall()
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['count'], 1)
+
+    def test_cluster_existing_rows(self):
+        """Clusters are created for rows in an existing database."""
+        filename = os.path.join(self.directory, 'location.db')
+        with closing(sqlite3.connect(filename)) as connection:
+            with closing(connection.cursor()) as cursor:
+                cursor.execute(
+                    'CREATE TABLE location '
+                    '(filename TEXT, latitude FLOAT, longitude FLOAT, '
+                    'datetime DATETIME)')
+                cursor.execute(
+                    'INSERT INTO location VALUES ("a.jpg", 1.0, 1.0, NULL)')
+                cursor.execute(
+                    'INSERT INTO location VALUES ("b.jpg", 1.0, 1.0, NULL)')
+            connection.commit()
+
+        with LocationDB() as location_db:
+            rows = location_db.select_clusters(
+                0.0, 0.0, 2.0, 2.0, zoom=10).fetchall()
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['count'], 2)
+
+    def test_centroid(self):
+        """Average coordinates of the rows in the location table."""
+        rows = [
+            {'filename': 'a.jpg', 'latitude': 1.0, 'longitude': 2.0},
+            {'filename': 'b.jpg', 'latitude': 3.0, 'longitude': 4.0},
+        ]
+        with LocationDB() as location_db:
+            self.assertIsNone(location_db.centroid())
+            location_db.insert(rows)
+            self.assertCoordinatesAlmostEqual(
+                location_db.centroid(), centroid([(1.0, 2.0), (3.0, 4.0)]))
+
+    def test_centroid_antimeridian(self):
+        """Centroid of locations around the antimeridian."""
+        rows = [
+            {'filename': 'a.jpg', 'latitude': 10.0, 'longitude': 179.0},
+            {'filename': 'b.jpg', 'latitude': 10.0, 'longitude': -179.0},
+        ]
+        with LocationDB() as location_db:
+            location_db.insert(rows)
+            latitude, longitude = location_db.centroid()
+        self.assertGreater(latitude, 10.0)
+        self.assertAlmostEqual(abs(longitude), 180.0)
+
+    def test_summary_sync(self):
+        """Summary is kept in sync with the location table."""
+        rows = [
+            {
+                'filename': 'a.jpg',
+                'latitude': 1.0,
+                'longitude': 2.0,
+                'datetime': datetime(2015, 1, 1),
+            },
+            {
+                'filename': 'b.jpg',
+                'latitude': 3.0,
+                'longitude': 4.0,
+                'datetime': datetime(2016, 1, 1),
+            },
+            {
+                'filename': 'c.jpg',
+                'latitude': 5.0,
+                'longitude': 6.0,
+                'datetime': None,
+            },
+            {
+                'filename': 'd.jpg',
+                'latitude': None,
+                'longitude': None,
+                'datetime': None,
+            },
+        ]
+        with LocationDB() as location_db:
+            self.assertEqual(location_db.count(), 0)
+            self.assertIsNone(location_db.bounds())
+            self.assertIsNone(location_db.date_range())
+
+            location_db.insert(rows)
+            self.assertEqual(location_db.count(), 4)
+            self.assertCoordinatesAlmostEqual(
+                location_db.centroid(),
+                centroid([(1.0, 2.0), (3.0, 4.0), (5.0, 6.0)]),
+            )
+            self.assertTupleEqual(location_db.bounds(), (1.0, 2.0, 5.0, 6.0))
+            self.assertTupleEqual(
+                location_db.date_range(),
+                (datetime(2015, 1, 1), datetime(2016, 1, 1)),
+            )
+
+            location_db.upsert([dict(rows[0], latitude=-1.0)])
+            self.assertCoordinatesAlmostEqual(
+                location_db.centroid(),
+                centroid([(-1.0, 2.0), (3.0, 4.0), (5.0, 6.0)]),
+            )
+            self.assertTupleEqual(
+                location_db.bounds(), (-1.0, 2.0, 5.0, 6.0))
+
+            location_db.delete_files(['a.jpg', 'c.jpg'])
+            self.assertEqual(location_db.count(), 2)
+            self.assertCoordinatesAlmostEqual(
+                location_db.centroid(), (3.0, 4.0))
+            self.assertTupleEqual(location_db.bounds(), (3.0, 4.0, 3.0, 4.0))
+            self.assertTupleEqual(
+                location_db.date_range(),
+                (datetime(2016, 1, 1), datetime(2016, 1, 1)),
+            )
+
+            location_db.delete_files(['b.jpg'])
+            self.assertEqual(location_db.count(), 1)
+            self.assertIsNone(location_db.centroid())
+            self.assertIsNone(location_db.bounds())
+
+    def test_summary_existing_rows(self):
+        """Summary is created for rows in an existing database."""
+        filename = os.path.join(self.directory, 'location.db')
+        with closing(sqlite3.connect(filename)) as connection:
+            with closing(connection.cursor()) as cursor:
+                cursor.execute(
+                    'CREATE TABLE location '
+                    '(filename TEXT, latitude FLOAT, longitude FLOAT, '
+                    'datetime DATETIME)')
+                cursor.execute(
+                    'INSERT INTO location VALUES ("a.jpg", 1.0, 2.0, NULL)')
+                cursor.execute(
+                    'INSERT INTO location VALUES ("b.jpg", 3.0, NULL, NULL)')
+            connection.commit()
+
+        with LocationDB() as location_db:
+            self.assertEqual(location_db.count(), 2)
+            self.assertCoordinatesAlmostEqual(
+                location_db.centroid(), (1.0, 2.0))
+            self.assertTupleEqual(location_db.bounds(), (1.0, 2.0, 1.0, 2.0))
+            self.assertIsNone(location_db.date_range())
+
+    def test_summary_outdated(self):
+        """Summary from older versions is recreated."""
+        filename = os.path.join(self.directory, 'location.db')
+        with closing(sqlite3.connect(filename)) as connection:
+            with closing(connection.cursor()) as cursor:
+                cursor.execute(
+                    'CREATE TABLE location '
+                    '(filename TEXT, latitude FLOAT, longitude FLOAT, '
+                    'datetime DATETIME)')
+                cursor.execute(
+                    'INSERT INTO location VALUES ("a.jpg", 1.0, 2.0, NULL)')
+                cursor.execute(
+                    'CREATE TABLE location_summary '
+                    '(row_count INTEGER, location_count INTEGER, '
+                    'lat_sum FLOAT, lon_sum FLOAT)')
+                cursor.execute(
+                    'CREATE TRIGGER location_summary_insert '
+                    'AFTER INSERT ON location BEGIN '
+                    'UPDATE location_summary SET row_count = row_count + 1; '
+                    'END')
+            connection.commit()
+
+        with LocationDB() as location_db:
+            location_db.insert([
+                {'filename': 'b.jpg', 'latitude': 3.0, 'longitude': 4.0}])
+            self.assertEqual(location_db.count(), 2)
+            self.assertCoordinatesAlmostEqual(
+                location_db.centroid(), centroid([(1.0, 2.0), (3.0, 4.0)]))
+
+    def test_spatial_index_sync(self):
+        """Spatial index is updated when rows are modified or deleted."""
+        row = {
+            'filename': 'a.jpg',
+            'latitude': 1.0,
+            'longitude': 1.0,
+        }
+        with LocationDB() as location_db:
+            location_db.insert([row])
+            location_db.upsert([dict(row, latitude=10.0)])
+            self.assertEqual(
+                len(location_db.select_bbox(0.0, 0.0, 2.0, 2.0).fetchall()),
+                0,
+            )
+            self.assertEqual(
+                len(location_db.select_bbox(9.0, 0.0, 11.0, 2.0).fetchall()),
+                1,
+            )
+
+            location_db.delete_files(['a.jpg'])
+            self.assertEqual(
+                location_db.connection.execute(
+                    'SELECT COUNT(*) FROM location_rtree').scalar(),
+                0,
+            )
+
+    def test_spatial_index_existing_rows(self):
+        """Spatial index is created for rows in an existing database."""
+        filename = os.path.join(self.directory, 'location.db')
+        with closing(sqlite3.connect(filename)) as connection:
+            with closing(connection.cursor()) as cursor:
+                cursor.execute(
+                    'CREATE TABLE location '
+                    '(filename TEXT, latitude FLOAT, longitude FLOAT, '
+                    'datetime DATETIME)')
+                cursor.execute(
+                    'INSERT INTO location VALUES ("a.jpg", 1.0, 1.0, NULL)')
+            connection.commit()
+
+        with LocationDB() as location_db:
+            rows = location_db.select_bbox(0.0, 0.0, 2.0, 2.0).fetchall()
+        self.assertEqual(len(rows), 1)
+
+    def test_generation(self):
+        """Generation counter changes only when rows are changed."""
+        row = {
+            'filename': 'a.jpg',
+            'latitude': 1.0,
+            'longitude': 2.0,
+        }
+        with LocationDB() as location_db:
+            self.assertEqual(location_db.generation(), 0)
+            location_db.insert([row])
+            self.assertEqual(location_db.generation(), 1)
+            location_db.upsert([row])
+            self.assertEqual(location_db.generation(), 1)
+            location_db.upsert([dict(row, latitude=3.0)])
+            self.assertEqual(location_db.generation(), 2)
+            location_db.delete_files(['b.jpg'])
+            self.assertEqual(location_db.generation(), 2)
+            location_db.delete_files(['a.jpg'])
+            self.assertEqual(location_db.generation(), 3)
+
+    def test_location_generation(self):
+        """Generation counter is read without a location database object."""
+        self.assertEqual(location_generation(), 0)
+        with LocationDB() as location_db:
+            location_db.insert([{'filename': 'a.jpg'}])
+
+        with patch('pic2map.db.LocationDB') as location_db_cls:
+            self.assertEqual(location_generation(), 1)
+            self.assertFalse(location_db_cls.called)
+
+    def test_location_generation_missing_table(self):
+        """Generation table is created if it doesn't exist yet."""
+        filename = os.path.join(self.directory, 'location.db')
+        with closing(sqlite3.connect(filename)) as connection:
+            with closing(connection.cursor()) as cursor:
+                cursor.execute(
+                    'CREATE TABLE location '
+                    '(filename TEXT, latitude FLOAT, longitude FLOAT, '
+                    'datetime DATETIME)')
+            connection.commit()
+
+        self.assertEqual(location_generation(), 0)
+
+    def test_file_stats(self):
+        """Get size and modification time for files in the database."""
+        rows = [
+            {
+                'filename': 'a.jpg',
+                'latitude': 1.2,
+                'longitude': 2.1,
+                'datetime': None,
+                'size': 1024,
+                'mtime': 1.5,
+            },
+            {
+                'filename': 'b.jpg',
+                'latitude': 3.4,
+                'longitude': 4.3,
+                'datetime': None,
+                'size': 2048,
+                'mtime': 2.5,
+            },
+        ]
+        with LocationDB() as location_db:
+            location_db.insert(rows)
+            file_stats = location_db.file_stats(['a.jpg', 'c.jpg'])
+        self.assertDictEqual(file_stats, {'a.jpg': (1024, 1.5)})
+
+    def test_delete_files(self):
+        """Delete rows for the given files."""
+        filename = os.path.join(self.directory, 'location.db')
+        with closing(sqlite3.connect(filename)) as connection:
+            with closing(connection.cursor()) as cursor:
+                cursor.execute(
+                    'CREATE TABLE location (filename TEXT)')
+                for basename in ['a', 'b', 'c']:
+                    cursor.execute(
+                        'INSERT INTO location VALUES ("{}.jpg")'
+                        .format(basename))
+            connection.commit()
+
+        with LocationDB() as location_db:
+            row_count = location_db.delete_files(['a.jpg', 'c.jpg'])
+            self.assertEqual(row_count, 2)
+            self.assertEqual(location_db.count(), 1)
 
     def test_remove(self):
         """Delete rows for files under a given directory."""
@@ -188,6 +1066,101 @@ class LocationDBTest(unittest.TestCase):
             result = location_db.delete('a')
             self.assertEqual(result.rowcount, file_count)
 
+    def test_remove_prefix(self):
+        """Only files under the directory are deleted."""
+        filenames = [
+            'a/1.jpg',
+            'a/b/2.jpg',
+            'ab/3.jpg',
+            'a_c/4.jpg',
+            'a%/5.jpg',
+            'a%/b/6.jpg',
+        ]
+        rows = [{'filename': filename} for filename in filenames]
+        with LocationDB() as location_db:
+            location_db.insert(rows)
+            self.assertEqual(location_db.delete('a').rowcount, 2)
+            self.assertEqual(location_db.delete('a%/').rowcount, 2)
+            self.assertEqual(location_db.delete('a_').rowcount, 0)
+            remaining = [row['filename'] for row in location_db.select_all()]
+        self.assertListEqual(sorted(remaining), [u'a_c/4.jpg', u'ab/3.jpg'])
+
+    def test_remove_non_ascii(self):
+        """Delete rows under a directory passed as an encoded string."""
+        rows = [
+            {'filename': u'/fotos año/1.jpg'},
+            {'filename': u'/fotos/2.jpg'},
+        ]
+        with LocationDB() as location_db:
+            location_db.insert(rows)
+            self.assertEqual(
+                location_db.delete('/fotos a\xc3\xb1o').rowcount, 1)
+            remaining = [row['filename'] for row in location_db.select_all()]
+        self.assertListEqual(remaining, [u'/fotos/2.jpg'])
+
+    def test_remove_sync(self):
+        """Summary and clusters are updated when a directory is deleted."""
+        rows = [
+            {
+                'filename': 'a/1.jpg',
+                'latitude': 1.0,
+                'longitude': 2.0,
+                'datetime': datetime(2015, 1, 1),
+            },
+            {
+                'filename': 'a/2.jpg',
+                'latitude': None,
+                'longitude': None,
+                'datetime': None,
+            },
+            {
+                'filename': 'b/3.jpg',
+                'latitude': 3.0,
+                'longitude': 4.0,
+                'datetime': datetime(2016, 1, 1),
+            },
+            {
+                'filename': 'b/4.jpg',
+                'latitude': 5.0,
+                'longitude': 6.0,
+                'datetime': None,
+            },
+        ]
+
+        def select_clusters(location_db):
+            """Get clusters in the whole world at zoom level 10."""
+            return sorted(
+                (row['count'], row['id'])
+                for row in location_db.select_clusters(
+                    -90.0, -180.0, 90.0, 180.0, zoom=10)
+            )
+
+        with LocationDB() as location_db:
+            location_db.insert(rows)
+            location_db.delete('a')
+            self.assertEqual(location_db.count(), 2)
+            self.assertCoordinatesAlmostEqual(
+                location_db.centroid(), centroid([(3.0, 4.0), (5.0, 6.0)]))
+            self.assertTupleEqual(location_db.bounds(), (3.0, 4.0, 5.0, 6.0))
+            self.assertTupleEqual(
+                location_db.date_range(),
+                (datetime(2016, 1, 1), datetime(2016, 1, 1)),
+            )
+            self.assertListEqual(
+                select_clusters(location_db), [(1, 3), (1, 4)])
+
+            # Delete triggers are still in place after the directory delete
+            location_db.delete_files(['b/3.jpg'])
+            self.assertEqual(location_db.count(), 1)
+            self.assertTupleEqual(location_db.bounds(), (5.0, 6.0, 5.0, 6.0))
+            self.assertListEqual(select_clusters(location_db), [(1, 4)])
+
+            location_db.delete('b')
+            self.assertEqual(location_db.count(), 0)
+            self.assertIsNone(location_db.centroid())
+            self.assertIsNone(location_db.bounds())
+            self.assertListEqual(select_clusters(location_db), [])
+
     def test_count(self):
         """Count rows in database."""
         file_count = 10
@@ -208,6 +1181,47 @@ class LocationDBTest(unittest.TestCase):
             self.assertEqual(result, file_count)
 
 
+class RegisterMathFunctionsTest(unittest.TestCase):
+
+    """SQLite math functions registration tests."""
+
+    def test_missing(self):
+        """Functions are registered when SQLite doesn't provide them."""
+        connection = Mock()
+        connection.execute.side_effect = sqlite3.OperationalError
+        _register_math_functions(connection, None)
+
+        functions = {
+            call_args[0][0]: call_args[0][2]
+            for call_args in connection.create_function.call_args_list
+        }
+        self.assertItemsEqual(functions, ['cos', 'sin', 'radians'])
+        self.assertEqual(functions['cos'](0.0), 1.0)
+        self.assertIsNone(functions['sin'](None))
+
+    def test_available(self):
+        """Functions are not registered when SQLite provides them."""
+        connection = Mock()
+        _register_math_functions(connection, None)
+        self.assertFalse(connection.create_function.called)
+
+
+class ClusterCellTest(unittest.TestCase):
+
+    """Cluster grid cell calculation tests."""
+
+    def test_cluster_cell(self):
+        """Cells are numbered from the north west corner."""
+        self.assertEqual(cluster_cell(89.0, -179.0, 0), (0, 0))
+        self.assertEqual(cluster_cell(-89.0, 179.0, 0), (3, 1))
+        self.assertEqual(cluster_cell(-89.0, 179.0, 1), (7, 3))
+
+    def test_edges(self):
+        """Locations at the edges belong to the last cells."""
+        self.assertEqual(cluster_cell(-90.0, 180.0, 0), (3, 1))
+        self.assertEqual(cluster_cell(90.0, -180.0, 0), (0, 0))
+
+
 class TransformMetadataToRowTest(unittest.TestCase):
 
     """EXIF metadata to database row transformation tests."""
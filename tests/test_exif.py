@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""Native EXIF GPS reader test cases."""
+
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from PIL import Image
+
+from pic2map.exif import read_gps_tags
+
+
+def rational(endianness, *values):
+    """Pack rational numbers.
+
+    :param endianness: Byte order prefix for the struct module
+    :type endianness: str
+    :param values: Numerator and denominator pairs
+    :type values: tuple(int, int)
+    :returns: Field type, count and packed value
+    :rtype: tuple(int, int, str)
+
+    """
+    data = ''.join(
+        struct.pack(endianness + 'II', numerator, denominator)
+        for numerator, denominator in values)
+    return 5, len(values), data
+
+
+def ascii(value):
+    """Pack ASCII string.
+
+    :param value: String to pack
+    :type value: str
+    :returns: Field type, count and packed value
+    :rtype: tuple(int, int, str)
+
+    """
+    data = value + '\x00'
+    return 2, len(data), data
+
+
+def build_exif(gps_entries, endianness='<'):
+    """Build EXIF segment data with a GPS IFD.
+
+    :param gps_entries: Tag id and packed value for each GPS tag
+    :type gps_entries: list(tuple(int, tuple(int, int, str)))
+    :param endianness: Byte order prefix for the struct module
+    :type endianness: str
+    :returns: EXIF segment data
+    :rtype: str
+
+    """
+    byte_order = 'II' if endianness == '<' else 'MM'
+    gps_ifd_offset = 8 + 2 + 12 + 4
+    data_offset = gps_ifd_offset + 2 + 12 * len(gps_entries) + 4
+
+    ifd0 = (
+        struct.pack(endianness + 'H', 1) +
+        struct.pack(endianness + 'HHII', 0x8825, 4, 1, gps_ifd_offset) +
+        struct.pack(endianness + 'I', 0)
+    )
+
+    entries = ''
+    data = ''
+    for tag_id, (field_type, count, value) in gps_entries:
+        entries += struct.pack(endianness + 'HHI', tag_id, field_type, count)
+        if len(value) <= 4:
+            entries += value.ljust(4, '\x00')
+        else:
+            entries += struct.pack(endianness + 'I', data_offset + len(data))
+            data += value
+    gps_ifd = (
+        struct.pack(endianness + 'H', len(gps_entries)) +
+        entries +
+        struct.pack(endianness + 'I', 0)
+    )
+
+    return (
+        'Exif\x00\x00' +
+        byte_order +
+        struct.pack(endianness + 'HI', 42, 8) +
+        ifd0 +
+        gps_ifd +
+        data
+    )
+
+
+def build_gps_entries(endianness='<'):
+    """Build GPS entries for a well known location.
+
+    :param endianness: Byte order prefix for the struct module
+    :type endianness: str
+    :returns: Tag id and packed value for each GPS tag
+    :rtype: list(tuple(int, tuple(int, int, str)))
+
+    """
+    return [
+        (0x0001, ascii('N')),
+        (0x0002, rational(endianness, (40, 1), (26, 1), (4614, 100))),
+        (0x0003, ascii('W')),
+        (0x0004, rational(endianness, (79, 1), (58, 1), (5604, 100))),
+        (0x0007, rational(endianness, (12, 1), (34, 1), (56, 1))),
+        (0x001d, ascii('2015:01:01')),
+    ]
+
+
+class ReadGPSTagsTest(unittest.TestCase):
+
+    """Native GPS tags reader test cases."""
+
+    def setUp(self):
+        """Create temporary directory."""
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, u'picture.jpg')
+
+    def tearDown(self):
+        """Remove temporary directory."""
+        shutil.rmtree(self.directory)
+
+    def create_picture(self, exif=None):
+        """Create picture file with the given EXIF data.
+
+        :param exif: EXIF segment data
+        :type exif: str
+
+        """
+        picture = Image.new('RGB', (1, 1))
+        if exif is None:
+            picture.save(self.path, 'JPEG')
+        else:
+            picture.save(self.path, 'JPEG', exif=exif)
+
+    def assert_gps_tags(self, metadata_record):
+        """Check GPS tags for the well known location."""
+        self.assertEqual(metadata_record['SourceFile'], self.path)
+        self.assertEqual(metadata_record['EXIF:GPSLatitudeRef'], u'N')
+        self.assertAlmostEqual(
+            metadata_record['EXIF:GPSLatitude'], 40.44615)
+        self.assertEqual(metadata_record['EXIF:GPSLongitudeRef'], u'W')
+        self.assertAlmostEqual(
+            metadata_record['EXIF:GPSLongitude'], 79.982233333)
+        self.assertEqual(metadata_record['EXIF:GPSTimeStamp'], u'12:34:56')
+        self.assertEqual(metadata_record['EXIF:GPSDateStamp'], u'2015:01:01')
+
+    def test_little_endian(self):
+        """GPS tags are read from little endian EXIF data."""
+        self.create_picture(build_exif(build_gps_entries('<'), '<'))
+        self.assert_gps_tags(read_gps_tags(self.path))
+
+    def test_big_endian(self):
+        """GPS tags are read from big endian EXIF data."""
+        self.create_picture(build_exif(build_gps_entries('>'), '>'))
+        self.assert_gps_tags(read_gps_tags(self.path))
+
+    def test_fractional_time(self):
+        """Fractional seconds are formatted like exiftool does."""
+        gps_entries = [
+            (0x0007, rational('<', (1, 1), (2, 1), (35, 10))),
+        ]
+        self.create_picture(build_exif(gps_entries))
+        self.assertEqual(
+            read_gps_tags(self.path)['EXIF:GPSTimeStamp'],
+            u'01:02:03.5',
+        )
+
+    def test_fractional_time_round_up(self):
+        """Fractions that round up carry into the next minute."""
+        # Minutes and seconds add up to a fraction of a nanosecond less
+        # than a minute
+        gps_entries = [
+            (0x0007, rational(
+                '<', (1, 1), (1, 65537), (3935633407, 65594891))),
+        ]
+        self.create_picture(build_exif(gps_entries))
+        self.assertEqual(
+            read_gps_tags(self.path)['EXIF:GPSTimeStamp'],
+            u'01:01:00',
+        )
+
+    def test_no_gps_ifd(self):
+        """No GPS tags if there is no EXIF data."""
+        self.create_picture()
+        self.assertDictEqual(
+            read_gps_tags(self.path),
+            {'SourceFile': self.path},
+        )
+
+    def test_not_a_jpeg_file(self):
+        """Files that are not JPEG are not supported."""
+        with open(self.path, 'w') as file_:
+            file_.write('this is a text file')
+        self.assertIsNone(read_gps_tags(self.path))
+
+    def test_invalid_offset(self):
+        """EXIF data with offsets out of the segment is not supported."""
+        gps_entries = [
+            (0x0002, (5, 3, struct.pack('<I', 0xffff))),
+        ]
+        self.create_picture(build_exif(gps_entries))
+        self.assertIsNone(read_gps_tags(self.path))
+
+    def test_missing_file(self):
+        """Files that cannot be read are not supported."""
+        self.assertIsNone(read_gps_tags(self.path))
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""EXIF metadata cache test cases."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+
+from pic2map.db import LocationDB
+from pic2map.exif_cache import (
+    HASH_BLOCK_SIZE,
+    ExifCache,
+    content_digest,
+)
+
+GPS_METADATA = {
+    'EXIF:GPSLatitude': 1.2,
+    'EXIF:GPSLatitudeRef': u'N',
+    'EXIF:GPSLongitude': 2.1,
+    'EXIF:GPSLongitudeRef': u'E',
+}
+
+
+class ExifCacheTest(unittest.TestCase):
+
+    """EXIF metadata cache test cases."""
+
+    def setUp(self):
+        """Create location database and pictures in a temporary directory."""
+        self.directory = tempfile.mkdtemp()
+        self.base_directory_patcher = patch('pic2map.db.BaseDirectory')
+        base_directory = self.base_directory_patcher.start()
+        base_directory.save_data_path.return_value = self.directory
+
+        self.database = LocationDB()
+        self.database.connect()
+
+        self.files = []
+        for index in range(3):
+            path = os.path.join(self.directory, '{}.jpg'.format(index))
+            with open(path, 'wb') as file_:
+                file_.write('picture {}'.format(index))
+            self.files.append((path, (os.path.getsize(path), 1.5 + index)))
+
+    def tearDown(self):
+        """Remove temporary directory."""
+        self.database.disconnect()
+        self.base_directory_patcher.stop()
+        shutil.rmtree(self.directory)
+
+    def test_get(self):
+        """Cached metadata is found for moved files."""
+        cache = ExifCache(self.database)
+        self.assertTupleEqual(cache.get(self.files), ({}, {}))
+
+        path_0, path_1 = self.files[0][0], self.files[1][0]
+        cache.put(self.files, {
+            path_0: dict(GPS_METADATA, SourceFile=path_0),
+            path_1: None,
+        })
+
+        moved_path = os.path.join(self.directory, 'moved.jpg')
+        os.rename(path_0, moved_path)
+        moved_files = [(moved_path, self.files[0][1])] + self.files[1:]
+        metadata_records, keys = cache.get(moved_files)
+        self.assertDictEqual(
+            metadata_records,
+            {
+                moved_path: dict(GPS_METADATA, SourceFile=moved_path),
+                path_1: None,
+            },
+        )
+        self.assertItemsEqual(keys, [moved_path, path_1])
+        self.assertEqual(cache.hits, 2)
+        self.assertEqual(cache.misses, 4)
+
+    def test_not_hashed(self):
+        """Files whose size and modification time aren't cached aren't read."""
+        cache = ExifCache(self.database)
+        cache.put(self.files[:1], {self.files[0][0]: None})
+
+        with patch('pic2map.exif_cache.content_digest') as content_digest:
+            metadata_records, keys = cache.get(self.files[1:])
+        self.assertDictEqual(metadata_records, {})
+        self.assertDictEqual(keys, {})
+        self.assertFalse(content_digest.called)
+
+    def test_modified_file(self):
+        """Cached metadata is not used after a file is modified."""
+        cache = ExifCache(self.database)
+        path, file_stat = self.files[0]
+        cache.put(self.files, {path: dict(GPS_METADATA, SourceFile=path)})
+
+        with open(path, 'wb') as file_:
+            file_.write('picture x')
+        metadata_records, keys = cache.get([(path, file_stat)])
+        self.assertDictEqual(metadata_records, {})
+        self.assertItemsEqual(keys, [path])
+
+    def test_eviction(self):
+        """Least recently used files are evicted."""
+        cache = ExifCache(self.database, max_entries=2)
+        paths = [path for path, _file_stat in self.files]
+
+        with patch('pic2map.exif_cache.time') as time_mock:
+            time_mock.time.return_value = 1.0
+            cache.put(self.files, {paths[0]: None})
+            time_mock.time.return_value = 2.0
+            cache.put(self.files, {paths[1]: None})
+            time_mock.time.return_value = 3.0
+            cache.get(self.files[:1])
+            time_mock.time.return_value = 4.0
+            cache.put(self.files, {paths[2]: None})
+
+        self.assertEqual(cache.entry_count, 2)
+        metadata_records, _keys = cache.get(self.files)
+        self.assertItemsEqual(metadata_records, [paths[0], paths[2]])
+
+    def test_outdated_version(self):
+        """Metadata cached by older versions is not used."""
+        cache = ExifCache(self.database)
+        path = self.files[0][0]
+        cache.put(self.files, {path: None})
+        self.database.connection.execute(
+            'UPDATE exif_cache SET version = version - 1')
+
+        metadata_records, _keys = cache.get(self.files)
+        self.assertDictEqual(metadata_records, {})
+
+    def test_outdated_table(self):
+        """Cache table without versions is recreated."""
+        self.database.connection.execute(
+            'CREATE TABLE exif_cache (size INTEGER, mtime FLOAT, '
+            'digest TEXT, metadata TEXT, last_used FLOAT)')
+
+        cache = ExifCache(self.database)
+        path = self.files[0][0]
+        cache.put(self.files, {path: None})
+        metadata_records, _keys = cache.get(self.files)
+        self.assertDictEqual(metadata_records, {path: None})
+
+    def test_unreadable_file(self):
+        """Files that can't be read aren't cached."""
+        cache = ExifCache(self.database)
+        missing_path = os.path.join(self.directory, 'missing.jpg')
+        cache.put([(missing_path, (0, 0.0))], {missing_path: None})
+        self.assertEqual(cache.entry_count, 0)
+
+
+class ContentDigestTest(unittest.TestCase):
+
+    """Content digest test cases."""
+
+    def test_beginning_and_end(self):
+        """Only the beginning and the end of big files are hashed."""
+        def digest(beginning, middle):
+            """Get digest of a file bigger than the hashed blocks."""
+            with tempfile.NamedTemporaryFile() as file_:
+                file_.write(
+                    beginning * HASH_BLOCK_SIZE + middle +
+                    'y' * HASH_BLOCK_SIZE)
+                file_.flush()
+                return content_digest(file_.name, 2 * HASH_BLOCK_SIZE + 1)
+
+        self.assertEqual(digest('x', 'a'), digest('x', 'b'))
+        self.assertNotEqual(digest('x', 'a'), digest('z', 'a'))
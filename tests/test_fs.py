@@ -5,11 +5,18 @@ import shutil
 import tempfile
 import unittest
 
-from mock import patch
+from mock import (
+    MagicMock as Mock,
+    patch,
+)
 
 from PIL import Image
 
-from pic2map.fs import TreeExplorer
+from pic2map.fs import (
+    TreeExplorer,
+    is_jpeg_by_extension,
+    is_jpeg_by_signature,
+)
 
 
 class TreeExplorerTest(unittest.TestCase):
@@ -104,6 +111,125 @@ class TreeExplorerTest(unittest.TestCase):
             sorted(self.picture_filenames),
         )
 
+    def test_iter_paths(self):
+        """Picture files are yielded while the directory is explored."""
+        metadata = {
+            'a': 'picture',
+            'subdir': {
+                'b': 'picture',
+            },
+        }
+        self.create_directory(self.directory, metadata)
+
+        tree_explorer = TreeExplorer(self.directory)
+        paths = tree_explorer.iter_paths()
+        self.assertNotIsInstance(paths, list)
+        self.assertListEqual(
+            sorted(paths),
+            sorted(self.picture_filenames),
+        )
+
+    def create_wide_tree(self):
+        """Create tree with many subdirectories."""
+        metadata = {
+            'dir{}'.format(index): {
+                'a': 'picture',
+                'b': 'text',
+                'subdir': {
+                    'c': 'picture',
+                },
+            }
+            for index in range(10)
+        }
+        metadata['z'] = 'picture'
+        self.create_directory(self.directory, metadata)
+
+    def test_parallel(self):
+        """Same files are found when listing directories in parallel."""
+        self.create_wide_tree()
+
+        tree_explorer = TreeExplorer(self.directory, threads=4)
+        self.assertListEqual(
+            sorted(tree_explorer.paths()),
+            sorted(self.picture_filenames),
+        )
+
+    def test_ordered(self):
+        """Files are sorted by path components when ordered."""
+        self.create_wide_tree()
+        expected_paths = sorted(
+            self.picture_filenames,
+            key=lambda path: path.split(os.sep),
+        )
+
+        for threads in (1, 4):
+            tree_explorer = TreeExplorer(
+                self.directory, threads=threads, ordered=True)
+            self.assertListEqual(tree_explorer.paths(), expected_paths)
+
+    @patch('pic2map.fs.ORDERED_LOOKAHEAD', 2)
+    @patch('pic2map.fs.ThreadPool')
+    def test_ordered_lookahead(self, thread_pool_cls):
+        """Only a few directories are listed ahead when ordered."""
+        self.create_wide_tree()
+        expected_paths = sorted(
+            self.picture_filenames,
+            key=lambda path: path.split(os.sep),
+        )
+
+        pending_listings = []
+
+        def apply_async(function, args):
+            """Return result that lists the directory when retrieved."""
+            listing = Mock()
+            pending_listings.append(listing)
+
+            def get(_timeout):
+                """List directory."""
+                pending_listings.remove(listing)
+                return function(*args)
+
+            listing.get.side_effect = get
+            return listing
+
+        thread_pool_cls().apply_async.side_effect = apply_async
+
+        tree_explorer = TreeExplorer(self.directory, ordered=True)
+        paths = []
+        pending_counts = []
+        for path in tree_explorer.iter_paths():
+            paths.append(path)
+            pending_counts.append(len(pending_listings))
+        self.assertListEqual(paths, expected_paths)
+        self.assertEqual(max(pending_counts), 2)
+
+    def test_iter_files(self):
+        """Size and modification time are returned for each file."""
+        self.create_directory(self.directory, {'a': 'picture'})
+
+        tree_explorer = TreeExplorer(self.directory)
+        files = list(tree_explorer.iter_files())
+        stat = os.stat(self.picture_filenames[0])
+        self.assertListEqual(
+            files,
+            [(self.picture_filenames[0], (stat.st_size, stat.st_mtime))],
+        )
+
+    def test_directory_symlink(self):
+        """Symbolic links to directories are not followed."""
+        metadata = {
+            'subdir': {
+                'a': 'picture',
+            },
+        }
+        self.create_directory(self.directory, metadata)
+        os.symlink(
+            os.path.join(self.directory, 'subdir'),
+            os.path.join(self.directory, 'link'))
+
+        tree_explorer = TreeExplorer(self.directory)
+        self.assertListEqual(tree_explorer.paths(), self.picture_filenames)
+
     def test_broken_symlink(self):
         """Broken symbolic links are skipped while exploring directory."""
         metadata = {
@@ -120,3 +246,81 @@ class TreeExplorerTest(unittest.TestCase):
             sorted(paths),
             sorted(self.picture_filenames),
         )
+
+
+class DetectorTest(unittest.TestCase):
+
+    """JPEG file detection test cases."""
+
+    def setUp(self):
+        """Create temporary directory."""
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Remove temporary directory."""
+        shutil.rmtree(self.directory)
+
+    def create_file(self, basename, picture):
+        """Create picture or text file.
+
+        :param basename: File name
+        :type basename: str
+        :param picture: Whether a picture or a text file should be created
+        :type picture: bool
+        :returns: Path to the file
+        :rtype: str
+
+        """
+        filename = os.path.join(self.directory, basename)
+        if picture:
+            Image.new('RGB', (1, 1)).save(filename, 'JPEG')
+        else:
+            with open(filename, 'w') as file_:
+                file_.write('this is a text file')
+        return filename
+
+    def test_extension(self):
+        """Only the extension is used to detect JPEG files."""
+        self.assertTrue(
+            is_jpeg_by_extension(self.create_file('a.JPG', picture=False)))
+        self.assertFalse(
+            is_jpeg_by_extension(self.create_file('b', picture=True)))
+
+    def test_signature(self):
+        """JPEG signature is used to detect JPEG files."""
+        with patch('pic2map.fs.magic') as magic:
+            self.assertTrue(
+                is_jpeg_by_signature(self.create_file('a', picture=True)))
+            self.assertFalse(
+                is_jpeg_by_signature(self.create_file('b', picture=False)))
+            self.assertFalse(magic.from_file.called)
+
+    def test_signature_skipped_extension(self):
+        """Files with extensions not used by JPEG files are not opened."""
+        filename = self.create_file('a.mp4', picture=True)
+        with patch('pic2map.fs.open', create=True) as open_:
+            self.assertFalse(is_jpeg_by_signature(filename))
+            self.assertFalse(open_.called)
+
+    def test_signature_ambiguous(self):
+        """Libmagic is used when extension and signature don't agree."""
+        filename = self.create_file('a.jpg', picture=False)
+        with patch('pic2map.fs.magic') as magic:
+            magic.from_file.return_value = 'ASCII text'
+            self.assertFalse(is_jpeg_by_signature(filename))
+            magic.from_file.assert_called_once_with(filename)
+
+    def test_tree_explorer_detection(self):
+        """Tree explorer uses the detection method passed."""
+        filenames = [
+            self.create_file('a.jpg', picture=True),
+            self.create_file('b', picture=True),
+        ]
+        self.assertListEqual(
+            sorted(TreeExplorer(self.directory, 'signature').paths()),
+            sorted(filenames),
+        )
+        self.assertListEqual(
+            TreeExplorer(self.directory, 'extension').paths(),
+            filenames[:1],
+        )
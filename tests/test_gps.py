@@ -3,13 +3,13 @@
 
 import unittest
 
-from mock import (
-    MagicMock as Mock,
-    patch,
-)
+from mock import patch
 
 from pic2map.gps import (
+    ExifToolPool,
+    TAGS,
     filter_gps_metadata,
+    iter_metadata_chunks,
     validate_gps_metadata,
 )
 
@@ -58,16 +58,147 @@ class FilterGPSMetadataTest(unittest.TestCase):
     def test_filter_metadata(self):
         """Filter out pictures without GPS information."""
         with patch('pic2map.gps.exiftool') as exiftool:
-            tool = exiftool.ExifTool().__enter__()
+            tool = exiftool.ExifTool()
             tool.get_tags_batch.return_value = [
                 VALID_METADATA,
                 VALID_METADATA_NO_DATETIME,
                 INVALID_METADATA,
             ]
 
-            paths = Mock()
+            paths = ['a.jpg', 'b.jpg', 'c.jpg']
             metadata_records = filter_gps_metadata(paths)
             self.assertListEqual(
                 metadata_records,
                 [VALID_METADATA, VALID_METADATA_NO_DATETIME],
             )
+
+    def test_iter_metadata_chunks(self):
+        """Metadata is returned for each chunk of paths."""
+        with patch('pic2map.gps.exiftool') as exiftool:
+            tool = exiftool.ExifTool()
+            tool.get_tags_batch.side_effect = (
+                lambda tags, paths: [{'SourceFile': path} for path in paths])
+
+            path_chunks = iter([['a.jpg', 'b.jpg'], ['c.jpg']])
+            self.assertListEqual(
+                list(iter_metadata_chunks(path_chunks, jobs=2)),
+                [
+                    [{'SourceFile': 'a.jpg'}, {'SourceFile': 'b.jpg'}],
+                    [{'SourceFile': 'c.jpg'}],
+                ],
+            )
+
+    def test_filter_metadata_no_paths(self):
+        """No exiftool process is launched when there are no paths."""
+        with patch('pic2map.gps.exiftool') as exiftool:
+            self.assertListEqual(filter_gps_metadata([]), [])
+            self.assertFalse(exiftool.ExifTool.called)
+
+
+class ExifToolPoolTest(unittest.TestCase):
+
+    """Exiftool process pool test cases."""
+
+    def test_processes(self):
+        """Exiftool processes are launched lazily and terminated."""
+        with patch('pic2map.gps.exiftool') as exiftool:
+            with ExifToolPool(3) as pool:
+                self.assertFalse(exiftool.ExifTool.called)
+                pool.get_tags_batch(TAGS, ['missing.jpg'])
+                self.assertEqual(exiftool.ExifTool.call_count, 1)
+                self.assertEqual(exiftool.ExifTool().start.call_count, 1)
+            self.assertEqual(exiftool.ExifTool().terminate.call_count, 1)
+
+    def test_failed_start(self):
+        """Exiftool process is launched again if it failed to start."""
+        with patch('pic2map.gps.exiftool') as exiftool:
+            exiftool.ExifTool().start.side_effect = [OSError(), None]
+            exiftool.ExifTool.reset_mock()
+            with ExifToolPool(1, native=False) as pool:
+                with self.assertRaises(OSError):
+                    pool.get_tags_batch(TAGS, ['a.jpg'])
+                pool.get_tags_batch(TAGS, ['a.jpg'])
+            self.assertEqual(exiftool.ExifTool.call_count, 2)
+            self.assertEqual(exiftool.ExifTool().start.call_count, 2)
+            self.assertEqual(
+                exiftool.ExifTool().get_tags_batch.call_count, 1)
+
+    def test_native(self):
+        """Exiftool is not used for files read natively."""
+        with patch('pic2map.gps.exiftool') as exiftool, \
+                patch('pic2map.gps.read_gps_tags') as read_gps_tags:
+            read_gps_tags.side_effect = lambda path: {'SourceFile': path}
+            with ExifToolPool(2) as pool:
+                metadata_records = pool.get_tags_batch(TAGS, ['a.jpg'])
+            self.assertListEqual(metadata_records, [{'SourceFile': 'a.jpg'}])
+            self.assertFalse(exiftool.ExifTool.called)
+
+    def test_native_and_fallback_order(self):
+        """Native and exiftool records are merged in the order of paths."""
+        def read_gps_tags(path):
+            """Read only odd numbered files natively."""
+            if int(path[0]) % 2:
+                return {'SourceFile': path, 'native': True}
+            return None
+
+        paths = ['{}.jpg'.format(index) for index in range(5)]
+        with patch('pic2map.gps.exiftool') as exiftool, \
+                patch('pic2map.gps.read_gps_tags') as read_gps_tags_mock:
+            read_gps_tags_mock.side_effect = read_gps_tags
+            exiftool.ExifTool().get_tags_batch.side_effect = (
+                lambda tags, paths: [{'SourceFile': path} for path in paths])
+            with ExifToolPool(1) as pool:
+                metadata_records = pool.get_tags_batch(TAGS, paths)
+
+        self.assertListEqual(
+            [record['SourceFile'] for record in metadata_records], paths)
+        self.assertListEqual(
+            [record.get('native', False) for record in metadata_records],
+            [False, True, False, True, False],
+        )
+
+    def test_fallback_missing_record(self):
+        """Records are matched by filename when exiftool skips a file."""
+        paths = ['a.jpg', 'b.jpg', 'c.jpg']
+        with patch('pic2map.gps.exiftool') as exiftool, \
+                patch('pic2map.gps.read_gps_tags') as read_gps_tags:
+            read_gps_tags.side_effect = (
+                lambda path: {'SourceFile': path} if path == 'b.jpg' else None)
+            exiftool.ExifTool().get_tags_batch.return_value = [
+                {'SourceFile': u'c.jpg'}]
+            with ExifToolPool(1) as pool:
+                metadata_records = pool.get_tags_batch(TAGS, paths)
+
+        self.assertListEqual(
+            metadata_records,
+            [{'SourceFile': 'b.jpg'}, {'SourceFile': u'c.jpg'}],
+        )
+
+    def test_native_disabled(self):
+        """Native reader is not used when disabled."""
+        with patch('pic2map.gps.exiftool'), \
+                patch('pic2map.gps.read_gps_tags') as read_gps_tags:
+            with ExifToolPool(2, native=False) as pool:
+                pool.get_tags_batch(TAGS, ['a.jpg'])
+            self.assertFalse(read_gps_tags.called)
+
+    def test_get_tags_batch(self):
+        """Paths are sent in chunks and results are kept in order."""
+        def get_tags_batch(tags, paths):
+            """Return one record per path."""
+            return [{'SourceFile': path} for path in paths]
+
+        with patch('pic2map.gps.exiftool') as exiftool:
+            tool = exiftool.ExifTool()
+            tool.get_tags_batch.side_effect = get_tags_batch
+
+            paths = ['{}.jpg'.format(index) for index in range(10)]
+            with ExifToolPool(2) as pool:
+                metadata_records = pool.get_tags_batch(
+                    TAGS, paths, chunk_size=3)
+
+            self.assertListEqual(
+                [record['SourceFile'] for record in metadata_records],
+                paths,
+            )
+            self.assertEqual(tool.get_tags_batch.call_count, 4)
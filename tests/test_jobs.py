@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+"""Indexing jobs test cases."""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+
+from pic2map.db import LocationDB
+from pic2map.jobs import (
+    DONE,
+    FAILED,
+    PENDING,
+    RUNNING,
+    JobQueue,
+    job_progress,
+    run_job,
+    skip_processed_files,
+)
+
+GPS_METADATA = {
+    'EXIF:GPSLatitude': 1.2,
+    'EXIF:GPSLatitudeRef': u'N',
+    'EXIF:GPSLongitude': 2.1,
+    'EXIF:GPSLongitudeRef': u'E',
+}
+
+
+class JobsTestCase(unittest.TestCase):
+
+    """Base test case with a location database and job queue."""
+
+    def setUp(self):
+        """Create location database in a temporary directory."""
+        self.directory = tempfile.mkdtemp()
+        self.base_directory_patcher = patch('pic2map.db.BaseDirectory')
+        base_directory = self.base_directory_patcher.start()
+        base_directory.save_data_path.return_value = self.directory
+
+        self.database = LocationDB()
+        self.database.connect()
+        self.job_queue = JobQueue(self.database)
+
+    def tearDown(self):
+        """Remove temporary directory."""
+        self.database.disconnect()
+        self.base_directory_patcher.stop()
+        shutil.rmtree(self.directory)
+
+
+class JobQueueTest(JobsTestCase):
+
+    """Job queue test cases."""
+
+    def test_submit(self):
+        """Jobs are submitted as pending with default options."""
+        job_id = self.job_queue.submit('some directory', {'jobs': 4})
+        job = self.job_queue.get(job_id)
+        self.assertEqual(job['directory'], 'some directory')
+        self.assertEqual(job['state'], PENDING)
+        self.assertEqual(job['files_seen'], 0)
+        options = json.loads(job['options'])
+        self.assertEqual(options['jobs'], 4)
+        self.assertEqual(options['detection'], 'signature')
+
+    def test_jobs(self):
+        """Most recent jobs are returned first."""
+        job_ids = [
+            self.job_queue.submit('directory {}'.format(index))
+            for index in range(3)
+        ]
+        self.assertListEqual(
+            [job['id'] for job in self.job_queue.jobs(limit=2)],
+            job_ids[:0:-1],
+        )
+
+    def test_claim(self):
+        """Oldest pending job is claimed by the current process."""
+        first_job_id = self.job_queue.submit('first directory')
+        self.job_queue.submit('second directory')
+
+        job = self.job_queue.claim()
+        self.assertEqual(job['id'], first_job_id)
+        self.assertEqual(job['state'], RUNNING)
+        self.assertEqual(job['pid'], os.getpid())
+
+    def test_claim_running_job(self):
+        """Jobs run by a process that still exists are not claimed."""
+        self.job_queue.submit('some directory')
+        self.job_queue.claim()
+        self.assertIsNone(self.job_queue.claim())
+
+    def test_claim_interrupted_job(self):
+        """Jobs run by a process that doesn't exist anymore are resumed."""
+        job_id = self.job_queue.submit('some directory')
+        self.job_queue.claim()
+        self.job_queue.update(job_id, pid=-1)
+
+        with patch('pic2map.jobs._process_exists') as process_exists:
+            process_exists.return_value = False
+            job = self.job_queue.claim()
+        self.assertEqual(job['id'], job_id)
+        self.assertEqual(job['pid'], os.getpid())
+
+    def test_expected_file_count(self):
+        """Files seen by the last finished job are expected."""
+        self.assertIsNone(
+            self.job_queue.expected_file_count(
+                {'id': 0, 'directory': 'some directory'}))
+
+        job_id = self.job_queue.submit('some directory')
+        self.job_queue.update(job_id, state=DONE, files_seen=10)
+        job = self.job_queue.get(self.job_queue.submit('some directory'))
+        self.assertEqual(self.job_queue.expected_file_count(job), 10)
+
+
+class RunJobTest(JobsTestCase):
+
+    """Job run test cases."""
+
+    def setUp(self):
+        """Patch tree explorer and GPS metadata extraction."""
+        JobsTestCase.setUp(self)
+        self.files = [
+            (os.path.join('base', '{}.jpg'.format(index)), (index, 1.0))
+            for index in range(4)
+        ]
+
+        self.tree_explorer_patcher = patch('pic2map.jobs.TreeExplorer')
+        tree_explorer_cls = self.tree_explorer_patcher.start()
+        tree_explorer_cls().iter_files.return_value = iter(self.files)
+
+        def extract_gps_metadata_chunks(files, _jobs, cache):
+            """Return GPS metadata for every file in chunks of two."""
+            self.assertIsNotNone(cache)
+            files = list(files)
+            for index in range(0, len(files), 2):
+                files_chunk = files[index:index + 2]
+                yield files_chunk, [
+                    (dict(GPS_METADATA, SourceFile=path), file_stat)
+                    for path, file_stat in files_chunk
+                ]
+
+        self.extract_patcher = patch(
+            'pic2map.jobs.extract_gps_metadata_chunks')
+        self.extract_patcher.start().side_effect = extract_gps_metadata_chunks
+
+    def tearDown(self):
+        """Undo the patching."""
+        self.tree_explorer_patcher.stop()
+        self.extract_patcher.stop()
+        JobsTestCase.tearDown(self)
+
+    def test_run_job(self):
+        """Files are indexed and progress is stored."""
+        self.job_queue.submit('base')
+        job = run_job(self.database, self.job_queue, self.job_queue.claim())
+
+        self.assertEqual(job['state'], DONE)
+        self.assertEqual(job['files_seen'], 4)
+        self.assertEqual(job['files_extracted'], 4)
+        self.assertEqual(job['rows_inserted'], 4)
+        self.assertEqual(job['checkpoint'], self.files[-1][0])
+        self.assertEqual(self.database.count(), 4)
+
+    def test_grouped_upserts(self):
+        """Rows of several extracted chunks are upserted together."""
+        self.job_queue.submit('base')
+        with patch('pic2map.jobs.INSERT_CHUNK_SIZE', 3), \
+                patch.object(
+                    self.database, 'upsert',
+                    wraps=self.database.upsert) as upsert:
+            job = run_job(
+                self.database, self.job_queue, self.job_queue.claim())
+
+        self.assertEqual(upsert.call_count, 1)
+        self.assertEqual(len(upsert.call_args[0][0]), 4)
+        self.assertEqual(job['files_extracted'], 4)
+        self.assertEqual(job['checkpoint'], self.files[-1][0])
+
+    def test_resume_job(self):
+        """Files before the checkpoint are skipped."""
+        job_id = self.job_queue.submit('base')
+        self.job_queue.update(
+            job_id, checkpoint=self.files[1][0], files_seen=2)
+        job = run_job(self.database, self.job_queue, self.job_queue.claim())
+
+        self.assertEqual(job['files_seen'], 4)
+        self.assertEqual(job['files_extracted'], 2)
+        self.assertEqual(self.database.count(), 2)
+
+    def test_non_ascii_directory(self):
+        """Directories with non-ASCII characters are indexed."""
+        directory = os.path.join(self.directory, 'fotos año')
+        os.mkdir(directory)
+        filename = os.path.join(directory, 'a.jpg')
+        open(filename, 'w').close()
+
+        self.tree_explorer_patcher.stop()
+        self.job_queue.submit(directory, {'detection': 'extension'})
+        job = run_job(self.database, self.job_queue, self.job_queue.claim())
+        self.tree_explorer_patcher.start()
+
+        self.assertEqual(job['state'], DONE)
+        self.assertEqual(job['directory'], directory.decode('utf8'))
+        self.assertEqual(job['checkpoint'], filename.decode('utf8'))
+        self.assertEqual(self.database.count(), 1)
+
+    def test_failed_job(self):
+        """Jobs are marked as failed on errors."""
+        self.extract_patcher.stop()
+        with patch('pic2map.jobs.extract_gps_metadata_chunks') as extract:
+            extract.side_effect = ValueError('exiftool not found')
+            self.job_queue.submit('base')
+            with self.assertRaises(ValueError):
+                run_job(
+                    self.database, self.job_queue, self.job_queue.claim())
+        self.extract_patcher.start()
+
+        job = self.job_queue.jobs()[0]
+        self.assertEqual(job['state'], FAILED)
+        self.assertEqual(job['error'], 'exiftool not found')
+
+    def test_failed_job_non_ascii_error(self):
+        """Jobs are marked as failed on errors with non-ASCII messages."""
+        errors = [
+            (ValueError(u'no se encontró exiftool'),
+             u'no se encontró exiftool'),
+            (IOError(2, 'No such file', '/fotos a\xc3\xb1o'),
+             u"[Errno 2] No such file: '/fotos a\\xc3\\xb1o'"),
+            (ValueError('/fotos a\xc3\xb1o'), u'/fotos año'),
+        ]
+        self.extract_patcher.stop()
+        for exception, error in errors:
+            with patch('pic2map.jobs.extract_gps_metadata_chunks') as extract:
+                extract.side_effect = exception
+                self.job_queue.submit('base')
+                with self.assertRaises(type(exception)):
+                    run_job(
+                        self.database, self.job_queue,
+                        self.job_queue.claim())
+
+            job = self.job_queue.jobs()[0]
+            self.assertEqual(job['state'], FAILED)
+            self.assertEqual(job['error'], error)
+        self.extract_patcher.start()
+
+
+class SkipProcessedFilesTest(unittest.TestCase):
+
+    """Checkpoint test cases."""
+
+    def test_skip_processed_files(self):
+        """Files up to the checkpoint are skipped."""
+        files = [
+            (os.path.join('base', path), (0, 0.0))
+            for path in ['a.jpg', os.path.join('b', 'c.jpg'), 'b.jpg']
+        ]
+        self.assertListEqual(
+            list(skip_processed_files(
+                iter(files), 'base', os.path.join('base', 'b', 'c.jpg'))),
+            files[2:],
+        )
+
+    def test_no_checkpoint(self):
+        """No files are skipped without a checkpoint."""
+        files = [('a.jpg', (0, 0.0))]
+        self.assertListEqual(
+            list(skip_processed_files(files, '.', None)), files)
+
+
+class JobProgressTest(unittest.TestCase):
+
+    """Job progress test cases."""
+
+    JOB = {
+        'id': 1,
+        'directory': 'some directory',
+        'state': RUNNING,
+        'elapsed': 10.0,
+        'files_seen': 50,
+        'files_extracted': 40,
+        'rows_inserted': 30,
+        'rows_updated': 0,
+        'rows_unchanged': 0,
+        'error': None,
+    }
+
+    def test_job_progress(self):
+        """Rate and ETA are calculated from the expected file count."""
+        progress = job_progress(self.JOB, 100)
+        self.assertEqual(progress['files_seen'], 50)
+        self.assertEqual(progress['rate'], 5.0)
+        self.assertEqual(progress['eta'], 10.0)
+
+    def test_unknown_eta(self):
+        """ETA is unknown if the expected file count is unknown."""
+        progress = job_progress(self.JOB)
+        self.assertIsNone(progress['eta'])
+
+    def test_not_started(self):
+        """Rate is unknown if the job hasn't run."""
+        progress = job_progress(dict(self.JOB, elapsed=0.0), 100)
+        self.assertIsNone(progress['rate'])
+        self.assertIsNone(progress['eta'])
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""Indexing pipeline test cases."""
+
+import unittest
+
+from datetime import datetime
+
+from dateutil.tz import tzutc
+from mock import (
+    MagicMock as Mock,
+    patch,
+)
+
+from pic2map.db import UpsertCounts
+from pic2map.pipeline import (
+    extract_gps_metadata,
+    extract_gps_metadata_chunks,
+    skip_unchanged_files,
+    transform_to_rows,
+    upsert_rows,
+)
+
+GPS_METADATA = {
+    'SourceFile': u'a.jpg',
+    'EXIF:GPSLatitude': 1.2,
+    'EXIF:GPSLatitudeRef': u'N',
+    'EXIF:GPSLongitude': 2.1,
+    'EXIF:GPSLongitudeRef': u'E',
+    'EXIF:GPSDateStamp': u'2015:01:01',
+    'EXIF:GPSTimeStamp': u'12:34:56',
+}
+
+
+class SkipUnchangedFilesTest(unittest.TestCase):
+
+    """Incremental scan test cases."""
+
+    def test_skip_unchanged_files(self):
+        """Unchanged files are skipped and modified ones deleted."""
+        database = Mock()
+        database.file_stats.return_value = {
+            'unchanged.jpg': (1024, 1.5),
+            'modified.jpg': (1024, 0.5),
+        }
+        files = [
+            ('unchanged.jpg', (1024, 1.5)),
+            ('modified.jpg', (1024, 1.5)),
+            ('new.jpg', (1024, 1.5)),
+        ]
+
+        self.assertListEqual(
+            list(skip_unchanged_files(database, files)),
+            files[1:],
+        )
+        database.file_stats.assert_called_once_with(
+            ['unchanged.jpg', 'modified.jpg', 'new.jpg'])
+        database.delete_files.assert_called_once_with(['modified.jpg'])
+
+    def test_chunks(self):
+        """Database is queried once per chunk."""
+        database = Mock()
+        database.file_stats.return_value = {}
+        files = [('{}.jpg'.format(index), (0, 0.0)) for index in range(5)]
+
+        self.assertEqual(
+            len(list(skip_unchanged_files(database, files, chunk_size=2))),
+            5,
+        )
+        self.assertEqual(database.file_stats.call_count, 3)
+
+
+class ExtractGPSMetadataTest(unittest.TestCase):
+
+    """GPS metadata extraction stage test cases."""
+
+    def test_extract_gps_metadata(self):
+        """File information is kept for files with GPS metadata."""
+        def iter_metadata_chunks(path_chunks, jobs):
+            """Return metadata only for the first file in each chunk."""
+            for paths in path_chunks:
+                metadata_records = [{'SourceFile': path} for path in paths]
+                metadata_records[0] = dict(GPS_METADATA, SourceFile=paths[0])
+                yield metadata_records
+
+        files = [
+            (u'{}.jpg'.format(index), (index, 1.0))
+            for index in range(4)
+        ]
+        with patch('pic2map.pipeline.iter_metadata_chunks') as iter_mock:
+            iter_mock.side_effect = iter_metadata_chunks
+            gps_metadata_files = list(
+                extract_gps_metadata(files, jobs=2, chunk_size=2))
+
+        self.assertListEqual(
+            [
+                (metadata['SourceFile'], file_stat)
+                for metadata, file_stat in gps_metadata_files
+            ],
+            [('0.jpg', (0, 1.0)), ('2.jpg', (2, 1.0))],
+        )
+
+    def test_extract_gps_metadata_chunks(self):
+        """Every chunk of files is returned with its GPS metadata."""
+        files = [
+            (u'{}.jpg'.format(index), (index, 1.0))
+            for index in range(3)
+        ]
+
+        def iter_metadata_chunks(path_chunks, _jobs):
+            """Return metadata only for the first file."""
+            for paths in path_chunks:
+                yield [
+                    dict(GPS_METADATA, SourceFile=path)
+                    if path == u'0.jpg' else {'SourceFile': path}
+                    for path in paths
+                ]
+
+        with patch('pic2map.pipeline.iter_metadata_chunks') as iter_mock:
+            iter_mock.side_effect = iter_metadata_chunks
+            chunks = list(extract_gps_metadata_chunks(files, chunk_size=2))
+
+        self.assertListEqual(
+            [files_chunk for files_chunk, _gps_metadata_files in chunks],
+            [files[:2], files[2:]],
+        )
+        self.assertListEqual(
+            [
+                [file_stat for _metadata, file_stat in gps_metadata_files]
+                for _files_chunk, gps_metadata_files in chunks
+            ],
+            [[(0, 1.0)], []],
+        )
+
+    def test_extract_gps_metadata_cache(self):
+        """Files in the cache are not extracted again."""
+        files = [
+            (u'{}.jpg'.format(index), (index, 1.0))
+            for index in range(3)
+        ]
+        cache = Mock()
+        keys = {u'0.jpg': (0, 1.0, 'digest')}
+        cache.get.return_value = (
+            {
+                u'0.jpg': dict(GPS_METADATA, SourceFile=u'0.jpg'),
+                u'1.jpg': None,
+            },
+            keys,
+        )
+
+        with patch('pic2map.pipeline.iter_metadata_chunks') as iter_mock:
+            iter_mock.side_effect = lambda path_chunks, _jobs: [
+                [{'SourceFile': path} for path in paths]
+                for paths in path_chunks
+            ]
+            gps_metadata_files = list(
+                extract_gps_metadata(files, cache=cache))
+
+        self.assertListEqual(
+            [file_stat for _metadata, file_stat in gps_metadata_files],
+            [(0, 1.0)],
+        )
+        cache.get.assert_called_once_with(files)
+        cache.put.assert_called_once_with(files, {u'2.jpg': None}, keys)
+
+    def test_extract_gps_metadata_cache_invalid(self):
+        """Files with invalid GPS tags are not cached."""
+        files = [
+            ('{}.jpg'.format(index), (index, 1.0))
+            for index in range(3)
+        ]
+        cache = Mock()
+        cache.get.return_value = ({}, {})
+
+        with patch('pic2map.pipeline.iter_metadata_chunks') as iter_mock:
+            iter_mock.side_effect = lambda path_chunks, _jobs: [
+                [
+                    dict(GPS_METADATA, SourceFile=paths[0]),
+                    dict(GPS_METADATA, SourceFile=paths[1],
+                         **{'EXIF:GPSLatitudeRef': u'X'}),
+                    {'SourceFile': paths[2]},
+                ]
+                for paths in path_chunks
+            ]
+            gps_metadata_files = list(
+                extract_gps_metadata(files, cache=cache))
+
+        self.assertListEqual(
+            [
+                (metadata['SourceFile'], file_stat)
+                for metadata, file_stat in gps_metadata_files
+            ],
+            [(u'0.jpg', (0, 1.0))],
+        )
+        self.assertIsInstance(gps_metadata_files[0][0]['SourceFile'], unicode)
+        cache.put.assert_called_once_with(
+            files,
+            {
+                '0.jpg': dict(GPS_METADATA, SourceFile=u'0.jpg'),
+                '2.jpg': None,
+            },
+            {},
+        )
+
+
+class TransformToRowsTest(unittest.TestCase):
+
+    """Row transformation stage test cases."""
+
+    def test_transform_to_rows(self):
+        """File information is added to each row."""
+        rows = list(transform_to_rows([(GPS_METADATA, (1024, 1.5))]))
+        self.assertListEqual(
+            rows,
+            [{
+                'filename': u'a.jpg',
+                'latitude': 1.2,
+                'longitude': 2.1,
+                'datetime': datetime(2015, 1, 1, 12, 34, 56, tzinfo=tzutc()),
+                'size': 1024,
+                'mtime': 1.5,
+            }],
+        )
+
+
+class UpsertRowsTest(unittest.TestCase):
+
+    """Row upsert stage test cases."""
+
+    def test_upsert_rows(self):
+        """Rows are upserted in chunks."""
+        database = Mock()
+        database.upsert.side_effect = [
+            UpsertCounts(2, 0, 0),
+            UpsertCounts(0, 1, 1),
+            UpsertCounts(0, 0, 1),
+        ]
+        rows = [{'filename': index} for index in range(5)]
+        upsert_counts = upsert_rows(database, iter(rows), chunk_size=2)
+        self.assertEqual(upsert_counts, UpsertCounts(2, 1, 2))
+        self.assertEqual(database.upsert.call_count, 3)
+        database.upsert.assert_called_with(rows[4:])
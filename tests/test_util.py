@@ -3,7 +3,11 @@ import unittest
 
 from operator import itemgetter
 
-from pic2map.util import average
+from pic2map.util import (
+    average,
+    centroid,
+    chunks,
+)
 
 
 class AverageTest(unittest.TestCase):
@@ -27,3 +31,62 @@ class AverageTest(unittest.TestCase):
             1.5,
         )
 
+
+class CentroidTest(unittest.TestCase):
+
+    """Geographic centroid function tests."""
+
+    def assertCoordinatesAlmostEqual(self, first, second):
+        """Check that two pairs of coordinates are almost equal."""
+        self.assertEqual(len(first), len(second))
+        for first_value, second_value in zip(first, second):
+            self.assertAlmostEqual(first_value, second_value)
+
+    def test_centroid(self):
+        """Centroid of locations on the equator."""
+        self.assertCoordinatesAlmostEqual(
+            centroid([(0.0, 10.0), (0.0, 20.0)]), (0.0, 15.0))
+
+    def test_antimeridian(self):
+        """Centroid of locations around the antimeridian."""
+        latitude, longitude = centroid([(10.0, 179.0), (10.0, -179.0)])
+        expected_latitude, _longitude = centroid([(10.0, -1.0), (10.0, 1.0)])
+        self.assertAlmostEqual(latitude, expected_latitude)
+        self.assertAlmostEqual(abs(longitude), 180.0)
+
+    def test_weights(self):
+        """Locations are weighted."""
+        self.assertCoordinatesAlmostEqual(
+            centroid([(0.0, 0.0), (0.0, 90.0)], [1.0, 0.0]), (0.0, 0.0))
+        self.assertCoordinatesAlmostEqual(
+            centroid([(0.0, 0.0), (0.0, 90.0)], [1.0, 1.0]), (0.0, 45.0))
+
+    def test_iterator(self):
+        """Coordinates may be an iterator."""
+        self.assertCoordinatesAlmostEqual(
+            centroid(iter([(0.0, 10.0), (0.0, 20.0)])), (0.0, 15.0))
+
+    def test_empty(self):
+        """No centroid for an empty collection."""
+        self.assertIsNone(centroid([]))
+
+    def test_undefined(self):
+        """No centroid for antipodal locations."""
+        self.assertIsNone(centroid([(0.0, 0.0), (0.0, 180.0)]))
+        self.assertIsNone(centroid([(90.0, 0.0), (-90.0, 0.0)]))
+
+
+class ChunksTest(unittest.TestCase):
+
+    """Chunks function tests."""
+
+    def test_chunks(self):
+        """Last chunk may be smaller."""
+        self.assertListEqual(
+            list(chunks(iter(range(5)), 2)),
+            [[0, 1], [2, 3], [4]],
+        )
+
+    def test_empty(self):
+        """No chunks for an empty iterable."""
+        self.assertListEqual(list(chunks([], 2)), [])
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""Filesystem watch mode test cases."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import (
+    MagicMock as Mock,
+    patch,
+)
+
+from PIL import Image
+
+from pic2map.db import (
+    LocationDB,
+    UpsertCounts,
+)
+from pic2map.exif_cache import ExifCache
+from pic2map.watch import (
+    LIBC,
+    ChangeSet,
+    InotifyWatcher,
+    PollingWatcher,
+    apply_changes,
+    create_watcher,
+    iter_batches,
+)
+from tests.test_exif import (
+    build_exif,
+    build_gps_entries,
+)
+
+
+def write_file(path, data='\xff\xd8\xff'):
+    """Write file contents."""
+    with open(path, 'wb') as file_:
+        file_.write(data)
+
+
+class ChangeSetTest(unittest.TestCase):
+
+    """Change set test cases."""
+
+    def test_last_change_wins(self):
+        """Only the last change to each file is kept."""
+        changes = ChangeSet()
+        changes.update_file('a.jpg')
+        changes.delete_file('a.jpg')
+        changes.delete_file('b.jpg')
+        changes.update_file('b.jpg')
+        self.assertSetEqual(changes.updated, set(['b.jpg']))
+        self.assertSetEqual(changes.deleted, set(['a.jpg']))
+
+    def test_delete_directory(self):
+        """Changes to files under a deleted directory are discarded."""
+        changes = ChangeSet()
+        changes.update_file(os.path.join('a', 'b.jpg'))
+        changes.delete_file(os.path.join('a', 'c.jpg'))
+        changes.update_file(os.path.join('ab', 'c.jpg'))
+        changes.delete_directory('a')
+        self.assertSetEqual(
+            changes.updated, set([os.path.join('ab', 'c.jpg')]))
+        self.assertSetEqual(changes.deleted, set())
+        self.assertSetEqual(changes.deleted_directories, set(['a']))
+        self.assertEqual(len(changes), 2)
+
+
+class WatcherTestCase(unittest.TestCase):
+
+    """Base test case with a temporary directory."""
+
+    def setUp(self):
+        """Create temporary directory."""
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Remove temporary directory."""
+        shutil.rmtree(self.directory)
+
+
+@unittest.skipIf(LIBC is None, 'inotify is not available')
+class InotifyWatcherTest(WatcherTestCase):
+
+    """inotify watcher test cases."""
+
+    def test_files(self):
+        """Written, moved and deleted files are detected."""
+        old_path = os.path.join(self.directory, 'old.jpg')
+        write_file(old_path)
+
+        with InotifyWatcher(self.directory) as watcher:
+            new_path = os.path.join(self.directory, 'new.jpg')
+            moved_path = os.path.join(self.directory, 'moved.jpg')
+            write_file(new_path)
+            os.rename(old_path, moved_path)
+
+            changes = ChangeSet()
+            while watcher.read(changes, 0):
+                pass
+            self.assertSetEqual(changes.updated, set([new_path, moved_path]))
+            self.assertSetEqual(changes.deleted, set([old_path]))
+
+    def test_directories(self):
+        """Files in new subdirectories are detected and watched."""
+        with InotifyWatcher(self.directory) as watcher:
+            subdirectory = os.path.join(self.directory, 'subdirectory')
+            os.mkdir(subdirectory)
+            first_path = os.path.join(subdirectory, 'first.jpg')
+            write_file(first_path)
+
+            changes = ChangeSet()
+            while watcher.read(changes, 0):
+                pass
+            self.assertSetEqual(changes.updated, set([first_path]))
+
+            second_path = os.path.join(subdirectory, 'second.jpg')
+            write_file(second_path)
+            changes = ChangeSet()
+            while watcher.read(changes, 0):
+                pass
+            self.assertSetEqual(changes.updated, set([second_path]))
+
+            shutil.rmtree(subdirectory)
+            changes = ChangeSet()
+            while watcher.read(changes, 0):
+                pass
+            self.assertSetEqual(
+                changes.deleted_directories, set([subdirectory]))
+            self.assertSetEqual(changes.deleted, set())
+            self.assertListEqual(
+                watcher.watches.values(), [self.directory])
+
+    def test_nothing_to_read(self):
+        """No events are read if nothing changes."""
+        with InotifyWatcher(self.directory) as watcher:
+            self.assertEqual(watcher.read(ChangeSet(), 0), 0)
+
+
+class PollingWatcherTest(WatcherTestCase):
+
+    """Polling watcher test cases."""
+
+    def test_read(self):
+        """New, modified and deleted files are detected."""
+        modified_path = os.path.join(self.directory, 'modified.jpg')
+        deleted_path = os.path.join(self.directory, 'deleted.jpg')
+        write_file(modified_path)
+        write_file(deleted_path)
+        watcher = PollingWatcher(self.directory, interval=0)
+
+        subdirectory = os.path.join(self.directory, 'subdirectory')
+        os.mkdir(subdirectory)
+        new_path = os.path.join(subdirectory, 'new.jpg')
+        write_file(new_path)
+        write_file(modified_path, 'modified')
+        os.remove(deleted_path)
+
+        changes = ChangeSet()
+        self.assertEqual(watcher.read(changes), 3)
+        self.assertSetEqual(changes.updated, set([new_path, modified_path]))
+        self.assertSetEqual(changes.deleted, set([deleted_path]))
+        self.assertEqual(watcher.read(ChangeSet()), 0)
+
+
+class CreateWatcherTest(WatcherTestCase):
+
+    """Watcher creation test cases."""
+
+    def test_poll(self):
+        """Polling is used when requested."""
+        self.assertIsInstance(
+            create_watcher(self.directory, poll=True), PollingWatcher)
+
+    def test_fallback(self):
+        """Polling is used when inotify fails."""
+        with patch('pic2map.watch.InotifyWatcher') as inotify_watcher_cls:
+            inotify_watcher_cls.side_effect = OSError(28, 'No space left')
+            self.assertIsInstance(
+                create_watcher(self.directory), PollingWatcher)
+
+
+class IterBatchesTest(unittest.TestCase):
+
+    """Change batching test cases."""
+
+    def test_iter_batches(self):
+        """Changes are batched until there are no more."""
+        paths = iter(['a.jpg', 'b.jpg', None, None, 'c.jpg', None])
+
+        def read(changes, _timeout=None):
+            """Add next change if any."""
+            path = next(paths)
+            if path is None:
+                return 0
+            changes.update_file(path)
+            return 1
+
+        watcher = Mock()
+        watcher.read.side_effect = read
+        batches = iter_batches(watcher, delay=0)
+        self.assertSetEqual(next(batches).updated, set(['a.jpg', 'b.jpg']))
+        self.assertSetEqual(next(batches).updated, set(['c.jpg']))
+
+
+class ApplyChangesTest(WatcherTestCase):
+
+    """Change application test cases."""
+
+    def setUp(self):
+        """Create location database in the temporary directory."""
+        WatcherTestCase.setUp(self)
+        self.base_directory_patcher = patch('pic2map.db.BaseDirectory')
+        base_directory = self.base_directory_patcher.start()
+        base_directory.save_data_path.return_value = self.directory
+
+    def tearDown(self):
+        """Undo the patching."""
+        self.base_directory_patcher.stop()
+        WatcherTestCase.tearDown(self)
+
+    def test_apply_changes(self):
+        """Deleted files are removed and updated pictures upserted."""
+        picture_path = os.path.join(self.directory, 'picture.jpg')
+        text_path = os.path.join(self.directory, 'text.jpg')
+        missing_path = os.path.join(self.directory, 'missing.jpg')
+        deleted_path = os.path.join(self.directory, 'deleted.jpg')
+        deleted_directory = os.path.join(self.directory, 'directory')
+        Image.new('RGB', (1, 1)).save(
+            picture_path, 'JPEG', exif=build_exif(build_gps_entries()))
+        write_file(text_path, 'text')
+
+        changes = ChangeSet()
+        for path in [picture_path, text_path, missing_path]:
+            changes.update_file(path)
+        changes.delete_file(deleted_path)
+        changes.delete_directory(deleted_directory)
+
+        with LocationDB() as database:
+            database.insert([
+                {'filename': path.decode('utf8'), 'latitude': 1.0,
+                 'longitude': 1.0}
+                for path in [
+                    text_path,
+                    deleted_path,
+                    os.path.join(deleted_directory, 'a.jpg'),
+                ]
+            ])
+            upsert_counts = apply_changes(
+                database, changes, cache=ExifCache(database))
+            rows = database.select_all().fetchall()
+
+        self.assertEqual(upsert_counts, UpsertCounts(1, 0, 0))
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['filename'], picture_path.decode('utf8'))
+        self.assertAlmostEqual(rows[0]['latitude'], 40.44615)
+        self.assertAlmostEqual(rows[0]['longitude'], -79.982233333)